@@ -10,6 +10,8 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.1/ref/settings/
 """
 import os
+import sys
+import tempfile
 from pathlib import Path
 
 from django.contrib import staticfiles
@@ -47,8 +49,11 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'shop.middleware.MetricsMiddleware',
+    'shop.middleware.QueryCountMiddleware',
     'django.middleware.security.SecurityMiddleware',
-    'whitenoise.middleware.WhiteNoiseMiddleware',
+    'shop.middleware.StaticFilesMiddleware',
+    'shop.middleware.CompressionMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -82,13 +87,47 @@ WSGI_APPLICATION = 'apiOrderBot.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.1/ref/settings/#databases
 
+# SQLITE_PROFILE=production (the default) tunes every connection for
+# several gunicorn workers writing at once: WAL lets readers run alongside
+# the writer, synchronous=NORMAL is durable with WAL except on power loss,
+# writers queue for up to `timeout` seconds instead of failing with
+# "database is locked", and BEGIN IMMEDIATE takes the write lock up front
+# so a transaction never fails upgrading from a read lock.
+# SQLITE_PROFILE=default is SQLite's stock behaviour, for comparison
+# (see `manage.py benchmark_writes`).
+SQLITE_PROFILES = {
+    'default': {},
+    'production': {
+        'init_command': (
+            'PRAGMA journal_mode=WAL;'
+            'PRAGMA synchronous=NORMAL;'
+            'PRAGMA mmap_size=268435456;'
+            'PRAGMA cache_size=-32000;'
+            'PRAGMA temp_store=MEMORY;'
+        ),
+        'transaction_mode': 'IMMEDIATE',
+        'timeout': 20,
+    },
+}
+SQLITE_PROFILE = os.environ.get('SQLITE_PROFILE', 'production')
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+        'NAME': os.environ.get('SQLITE_PATH', BASE_DIR / 'db.sqlite3'),
+        'OPTIONS': SQLITE_PROFILES[SQLITE_PROFILE],
+        # The concurrency tests need a real file: threads can't share an
+        # in-memory database without table-level locking errors.
+        'TEST': {
+            'NAME': BASE_DIR / 'test_db.sqlite3',
+        },
     }
 }
 
+# Send order and payment writes through one writer thread per process
+# (shop.db), which commits queued writes together.
+SQLITE_WRITE_QUEUE = os.environ.get('SQLITE_WRITE_QUEUE') == '1'
+
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
 
@@ -125,6 +164,14 @@ USE_TZ = True
 STATIC_URL = 'static/'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+# Uploads are served by shop.media (ETags, byte ranges, sendfile). Browsers
+# and the CDN may keep them this many seconds without asking again; upload
+# names are never reused for different images.
+MEDIA_CACHE_MAX_AGE = int(os.environ.get('MEDIA_CACHE_MAX_AGE', 30 * 24 * 3600))
+# Behind nginx, answer with "X-Accel-Redirect: <prefix>/<path>" and let
+# nginx send the file from an internal location such as
+#   location /protected-media/ { internal; alias /app/media/; }
+MEDIA_ACCEL_REDIRECT = os.environ.get('MEDIA_ACCEL_REDIRECT', '')
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.1/ref/settings/#default-auto-field
@@ -151,26 +198,149 @@ CSRF_COOKIE_HTTPONLY = False  # Make sure this is set correctly
 CSRF_COOKIE_SAMESITE = 'Lax'  # 'Strict' or 'Lax' is recommended for security
 
 
-LOGGING = {
-    'version': 1,
-    'disable_existing_loggers': False,
-    'handlers': {
-        'file': {
-            'level': 'DEBUG',
-            'class': 'logging.FileHandler',
-            'filename': 'debug.log',
+# LOG_PROFILE=production (the default) writes JSON lines through a queue
+# (shop.log): request threads only create the record and a background
+# thread formats and writes it. SQL is not logged, and the per-request
+# INFO messages are sampled at LOG_SAMPLE_RATE.
+# LOG_PROFILE=debug is the old setup: everything from the `django` logger,
+# including every SQL statement, written synchronously to debug.log.
+LOG_PROFILE = os.environ.get('LOG_PROFILE', 'production')
+# A file rotated by size (LOG_MAX_BYTES) or at midnight (LOG_ROTATION=time),
+# keeping LOG_BACKUP_COUNT old files. Processes rotate independently, so
+# start.sh sets LOG_FILE=- (stderr) for its gunicorn workers. Test runs log
+# to the temporary directory rather than the checkout.
+TESTING = sys.argv[1:2] == ['test']
+LOG_FILE = os.environ.get('LOG_FILE') or (
+    os.path.join(tempfile.gettempdir(), 'shop-test.log') if TESTING else os.path.join(BASE_DIR, 'logs', 'app.log')
+)
+LOG_ROTATION = os.environ.get('LOG_ROTATION', 'size')
+LOG_MAX_BYTES = int(os.environ.get('LOG_MAX_BYTES', 10 * 1024 * 1024))
+LOG_BACKUP_COUNT = int(os.environ.get('LOG_BACKUP_COUNT', 7))
+LOG_SAMPLE_RATE = float(os.environ.get('LOG_SAMPLE_RATE', 0.05))
+
+if LOG_PROFILE == 'debug':
+    LOGGING = {
+        'version': 1,
+        'disable_existing_loggers': False,
+        'handlers': {
+            'file': {
+                'level': 'DEBUG',
+                'class': 'logging.FileHandler',
+                'filename': 'debug.log',
+            },
         },
-    },
-    'loggers': {
-        'django': {
-            'handlers': ['file'],
-            'level': 'DEBUG',
-            'propagate': True,
+        'loggers': {
+            'django': {
+                'handlers': ['file'],
+                'level': 'DEBUG',
+                'propagate': True,
+            },
+            # At DEBUG every missing template variable is logged with the whole
+            # context, whose repr evaluates querysets: ten extra queries per
+            # admin page.
+            'django.template': {
+                'handlers': ['file'],
+                'level': 'INFO',
+                'propagate': False,
+            },
         },
-    },
-}
+    }
+else:
+    if LOG_FILE == '-':
+        LOG_TARGET = {'class': 'logging.StreamHandler'}
+    elif LOG_ROTATION == 'time':
+        LOG_TARGET = {
+            'class': 'logging.handlers.TimedRotatingFileHandler', 'filename': LOG_FILE,
+            'when': 'midnight', 'utc': True, 'backupCount': LOG_BACKUP_COUNT, 'encoding': 'utf-8',
+        }
+    else:
+        LOG_TARGET = {
+            'class': 'logging.handlers.RotatingFileHandler', 'filename': LOG_FILE,
+            'maxBytes': LOG_MAX_BYTES, 'backupCount': LOG_BACKUP_COUNT, 'encoding': 'utf-8',
+        }
+    LOGGING = {
+        'version': 1,
+        'disable_existing_loggers': False,
+        'formatters': {
+            'json': {'()': 'shop.log.JsonFormatter'},
+        },
+        'filters': {
+            'sample': {'()': 'shop.log.SamplingFilter', 'rate': LOG_SAMPLE_RATE},
+        },
+        'handlers': {
+            'queue': {
+                '()': 'shop.log.QueueHandler',
+                'target': LOG_TARGET,
+                'formatter': 'json',
+            },
+        },
+        'root': {'handlers': ['queue'], 'level': 'WARNING'},
+        'loggers': {
+            'django': {'level': 'INFO'},
+            'django.db.backends': {'level': 'WARNING'},
+            'django.template': {'level': 'WARNING'},
+            # A line per request from runserver, and the checkout's
+            # per-request messages.
+            'django.server': {'level': 'INFO', 'filters': ['sample'], 'propagate': True},
+            'shop.views': {'level': 'INFO', 'filters': ['sample']},
+            'shop': {'level': 'INFO'},
+        },
+    }
 
 
 # settings.py
 SITE_URL = 'https://admin.4gmobiles.com'
 
+
+# Telegram channel posts are queued in TelegramOutbox and delivered by
+# `python manage.py telegram_worker`.
+TELEGRAM_BOT_TOKEN = os.environ.get('TELEGRAM_BOT_TOKEN', 'TOKEN')
+TELEGRAM_CHANNEL_ID = os.environ.get('TELEGRAM_CHANNEL_ID', '-CHANNEL_ID')
+# bot.py: the order form opened by "Order Now", and the Telegram user ids
+# allowed to /broadcast.
+TELEGRAM_WEBAPP_URL = os.environ.get('TELEGRAM_WEBAPP_URL', 'https://apiorderbot.onrender.com/api/webapp/')
+TELEGRAM_ADMIN_IDS = [int(i) for i in os.environ.get('TELEGRAM_ADMIN_IDS', '').split(',') if i.strip()]
+
+# Excel exports above this many rows are generated in the background and
+# stored in EXPORT_ROOT until downloaded from the admin.
+EXPORT_BACKGROUND_THRESHOLD = int(os.environ.get('EXPORT_BACKGROUND_THRESHOLD', 20000))
+EXPORT_ROOT = os.path.join(BASE_DIR, 'exports')
+
+# Set REDIS_URL to share the cache between workers; otherwise each worker
+# keeps its own in-memory cache.
+if os.environ.get('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ['REDIS_URL'],
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'shop',
+        }
+    }
+
+# Seconds a compressed catalog list page stays cached. Keys contain the
+# catalog version, so this only bounds memory, never staleness.
+COMPRESSED_CATALOG_CACHE_TIMEOUT = int(os.environ.get('COMPRESSED_CATALOG_CACHE_TIMEOUT', 600))
+
+# Seconds a product stays in the mini-app cache. Saves invalidate it at
+# once in the saving worker; this bounds staleness elsewhere.
+PRODUCT_CACHE_TIMEOUT = int(os.environ.get('PRODUCT_CACHE_TIMEOUT', 60))
+
+# Add X-Query-Count/X-Query-Time headers to every response; used by
+# `python manage.py benchmark_http`.
+QUERY_COUNT_HEADER = os.environ.get('QUERY_COUNT_HEADER') == '1'
+
+# Per-route request metrics, served as Prometheus text at /metrics. Each
+# worker process writes its totals to METRICS_DIR (start.sh sets one) so
+# the endpoint reports all of them; unset, it reports the answering worker.
+# The endpoint needs "Authorization: Bearer $METRICS_TOKEN" (for the
+# scraper) or a staff login.
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', '1') == '1'
+METRICS_DIR = os.environ.get('METRICS_DIR') or None
+METRICS_FLUSH_INTERVAL = float(os.environ.get('METRICS_FLUSH_INTERVAL', 5))
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
@@ -1,48 +1,161 @@
-from telegram import InlineKeyboardButton, InlineKeyboardMarkup, WebAppInfo
-from telegram.ext import Application, CommandHandler, ContextTypes
+"""
+The shop's Telegram bot.
 
-# Initialize the bot with your token
-bot_token = '7543719732:AAH8cIPr_xv9oaxtzw21EmnDd0LhJXVfCPs'
+/start opens the order form for the product named in the deep link
+(t.me/<bot>?start=product-<id>). Chats opt in to product announcements with
+/subscribe, and channels or groups are registered when the bot is added to
+them. Admins (TELEGRAM_ADMIN_IDS) start a broadcast with /broadcast <ids>;
+the posts are sent in the background by shop.broadcast.BroadcastWorker,
+which also resumes broadcasts left unfinished by a restart.
 
+    python bot.py
+"""
+import asyncio
+import logging
+import os
 
-async def start(update, context: ContextTypes.DEFAULT_TYPE):
-    product_id = 2  # Example product ID (this should be dynamic for each product)
+import django
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'apiOrderBot.settings')
+django.setup()
+
+from asgiref.sync import sync_to_async  # noqa: E402
+from django.conf import settings  # noqa: E402
+from telegram import ChatMember, InlineKeyboardButton, InlineKeyboardMarkup, WebAppInfo  # noqa: E402
+from telegram.ext import Application, ChatMemberHandler, CommandHandler, ContextTypes  # noqa: E402
+
+from shop.broadcast import BroadcastWorker, create_broadcast  # noqa: E402
+from shop.models import BroadcastTarget, Product  # noqa: E402
+from shop.telegram import TelegramClient  # noqa: E402
+
+logger = logging.getLogger(__name__)
+
+CHAT_KINDS = {
+    'private': BroadcastTarget.KIND_USER,
+    'group': BroadcastTarget.KIND_GROUP,
+    'supergroup': BroadcastTarget.KIND_GROUP,
+    'channel': BroadcastTarget.KIND_CHANNEL,
+}
+
+
+def parse_product_id(value):
+    value = (value or '').removeprefix('product-')
+    return int(value) if value.isdigit() else None
 
-    # Create the WebApp URL with the product_id as a query parameter
-    webapp_url = f"https://apiorderbot.onrender.com/api/webapp/?product_id={product_id}"
 
-    # Create a button to launch the WebApp
+async def start(update, context: ContextTypes.DEFAULT_TYPE):
+    product_id = parse_product_id(context.args[0]) if context.args else None
+    product = await Product.objects.filter(pk=product_id).afirst() if product_id else None
+    if product is None:
+        await update.message.reply_text(
+            "Welcome! Send /subscribe to hear about new products, or open one from the channel to order it."
+        )
+        return
+
+    webapp_url = f"{settings.TELEGRAM_WEBAPP_URL}?tgWebAppStartParam=product-{product.pk}"
     keyboard = [
         [InlineKeyboardButton(text="Order Now", web_app=WebAppInfo(url=webapp_url))]
     ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    await update.message.reply_text(
+        text=f"{product.name} - {product.price} Birr. Click the button below to order.",
+        reply_markup=InlineKeyboardMarkup(keyboard)
+    )
+
+
+async def subscribe(update, context: ContextTypes.DEFAULT_TYPE):
+    chat = update.effective_chat
+    await BroadcastTarget.objects.aupdate_or_create(
+        chat_id=str(chat.id),
+        defaults={'kind': CHAT_KINDS.get(chat.type, BroadcastTarget.KIND_USER),
+                  'title': chat.title or chat.full_name or '', 'is_active': True},
+    )
+    await update.effective_message.reply_text("Subscribed. New products will be announced here.")
 
-    # Send the message with the WebApp button to the user
+
+async def unsubscribe(update, context: ContextTypes.DEFAULT_TYPE):
+    await BroadcastTarget.objects.filter(chat_id=str(update.effective_chat.id)).aupdate(is_active=False)
+    await update.effective_message.reply_text("Unsubscribed. Send /subscribe to hear from us again.")
+
+
+async def membership_changed(update, context: ContextTypes.DEFAULT_TYPE):
+    """Register channels and groups the bot is added to, and retire those it leaves."""
+    change = update.my_chat_member
+    chat = change.chat
+    if chat.type == 'private':
+        return
+    if change.new_chat_member.status in (ChatMember.ADMINISTRATOR, ChatMember.MEMBER):
+        await BroadcastTarget.objects.aupdate_or_create(
+            chat_id=str(chat.id), defaults={'kind': CHAT_KINDS[chat.type], 'title': chat.title or '', 'is_active': True},
+        )
+    else:
+        await BroadcastTarget.objects.filter(chat_id=str(chat.id)).aupdate(is_active=False)
+
+
+async def broadcast(update, context: ContextTypes.DEFAULT_TYPE):
+    if update.effective_user.id not in settings.TELEGRAM_ADMIN_IDS:
+        return
+    ids = [parse_product_id(arg) for arg in context.args]
+    if not ids or None in ids:
+        await update.message.reply_text("Usage: /broadcast <product id> [<product id> ...]")
+        return
+
+    products = [product async for product in Product.objects.filter(pk__in=ids)]
+    if not products:
+        await update.message.reply_text("No such products.")
+        return
+    created = await sync_to_async(create_broadcast)(products, requested_by=str(update.effective_chat.id))
     await update.message.reply_text(
-        text="Check out this amazing product! Click the button below to order.",
-        reply_markup=reply_markup
+        f"{created} queued: {await created.deliveries.acount()} posts. I'll report when it's done."
     )
 
-    # Send the message with the WebApp button to the channel
-    channel_id = "-1002437698028"  # Your Telegram channel ID
+
+async def send_broadcasts(application):
+    """Deliver queued broadcasts until the bot stops, reporting finished ones."""
+    client = TelegramClient(max_connections=30)
+    worker = BroadcastWorker(client, on_finished=lambda finished: report(application, finished))
     try:
-        await context.bot.send_message(
-            chat_id=channel_id,
-            text="Check out this amazing product! Click the button below to order.",
-            reply_markup=reply_markup
+        while True:
+            try:
+                await worker.drain()
+            except Exception:
+                logger.exception("Broadcast worker failed; retrying")
+            await asyncio.sleep(2)
+    finally:
+        await client.aclose()
+
+
+async def report(application, finished):
+    counts = await sync_to_async(finished.counts)()
+    if finished.requested_by.lstrip('-').isdigit():
+        await application.bot.send_message(
+            chat_id=finished.requested_by,
+            text=f"{finished} finished: {counts['sent']} delivered, {counts['failed']} failed.",
         )
-    except Exception as e:
-        # Detailed error handling
-        print(f"Error sending message to channel: {e}")
-        if 'Button_type_invalid' in str(e):
-            print("Button type invalid. Check the WebApp button configuration.")
 
 
-# Create the Application and add the command handler
-application = Application.builder().token(bot_token).build()
+async def post_init(application):
+    application.bot_data['broadcasts'] = asyncio.get_running_loop().create_task(send_broadcasts(application))
+
+
+async def post_shutdown(application):
+    task = application.bot_data.get('broadcasts')
+    if task:
+        task.cancel()
+
+
+def build_application():
+    application = (
+        Application.builder().token(settings.TELEGRAM_BOT_TOKEN)
+        .post_init(post_init).post_shutdown(post_shutdown).build()
+    )
+    application.add_handler(CommandHandler("start", start))
+    application.add_handler(CommandHandler("subscribe", subscribe))
+    application.add_handler(CommandHandler("unsubscribe", unsubscribe))
+    application.add_handler(CommandHandler("broadcast", broadcast))
+    application.add_handler(ChatMemberHandler(membership_changed, ChatMemberHandler.MY_CHAT_MEMBER))
+    return application
 
-# Add the command handler
-application.add_handler(CommandHandler("start", start))
 
-# Start the bot
-application.run_polling()
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    build_application().run_polling(allowed_updates=['message', 'my_chat_member'])
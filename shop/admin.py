@@ -1,11 +1,57 @@
-from django.contrib import admin
-from unfold.admin import ModelAdmin
+from django.contrib import admin, messages
+from unfold.admin import ModelAdmin, TabularInline
+from unfold.decorators import action
 from django.utils.html import format_html
-from .models import Order, Product, Category, Subcategory, Brand, ProductModel, Stock, Purchase, Telegram
+from .models import (
+    Order, Product, Category, Subcategory, Brand, ProductModel, Stock, Purchase, Telegram, TelegramOutbox, ExportJob,
+    BroadcastTarget, Broadcast, BroadcastDelivery, SalesRollup, DailySales,
+    StockMovement, StockSnapshot, StockSnapshotItem,
+)
 from django.core.exceptions import ValidationError
-from django.http import HttpResponse
-import csv
-from openpyxl import Workbook
+from django.db import transaction
+from django.db.models import Count, Q, Sum
+from django.http import Http404
+from django.shortcuts import redirect
+from django.template.response import TemplateResponse
+from django.urls import path, reverse
+from django.utils import timezone
+from . import exports
+from .broadcast import create_broadcast
+from .exports import export_csv, export_excel
+from .forms import CatalogImportForm
+from .importer import CatalogImporter, read_rows
+from .outbox import enqueue_posts
+from .responses import FileStreamResponse
+from . import images, inventory, sales, search
+
+
+class ProductSearchMixin:
+    """
+    Answer the changelist search box from the product full-text index
+    instead of ``icontains`` over ``search_fields``. ``product_search_path``
+    is the lookup from the admin's model to the product.
+    """
+    product_search_path = 'product'
+
+    def get_search_results(self, request, queryset, search_term):
+        if not search.terms(search_term):
+            return super().get_search_results(request, queryset, search_term)
+        return search.filter_products(queryset, search_term, self.product_search_path), False
+
+
+class RelatedListFilter(admin.RelatedFieldListFilter):
+    """
+    Related-object filter whose choices are loaded with their own foreign
+    keys joined in, because their ``__str__`` shows the parent's name.
+    """
+    def field_choices(self, field, request, model_admin):
+        model = field.related_model
+        parents = [f.name for f in model._meta.concrete_fields if f.many_to_one]
+        queryset = model._default_manager.select_related(*parents)
+        ordering = self.field_admin_ordering(field, request, model_admin)
+        if ordering:
+            queryset = queryset.order_by(*ordering)
+        return [(obj.pk, str(obj)) for obj in queryset]
 
 
 class OrderAdmin(ModelAdmin):
@@ -40,60 +86,15 @@ class OrderAdmin(ModelAdmin):
         'comment'
     )
     ordering = ('-order_date',)
+    list_select_related = ('product',)
     list_per_page = 10
 
 
     def export_as_csv(self, request, queryset):
-        # Create the response object for CSV
-        response = HttpResponse(content_type='text/csv')
-        response['Content-Disposition'] = 'attachment; filename="orders.csv"'
-
-        writer = csv.writer(response)
-        writer.writerow(['Product', 'Full Name', 'Address', 'Phone Number', 'Comment', 'Quantity', 'Order Date', 'Is Paid'])  # CSV Header
-
-        for order in queryset:
-            writer.writerow([
-                order.product.name,
-                order.full_name,
-                order.address,
-                order.phone_number,
-                order.comment,
-                order.quantity,
-                order.order_date,
-                order.is_paid,
-            ])  # CSV Data
-
-        return response
+        return export_csv(queryset, exports.ORDERS)
 
     def export_as_excel(self, request, queryset):
-        # Create the response object for Excel
-        response = HttpResponse(content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
-        response['Content-Disposition'] = 'attachment; filename="orders.xlsx"'
-
-        workbook = Workbook()
-        worksheet = workbook.active
-        worksheet.title = 'Orders'
-
-        # Write headers
-        headers = ['Product', 'Full Name', 'Address', 'Phone Number', 'Comment', 'Quantity', 'Order Date', 'Is Paid']
-        worksheet.append(headers)
-
-        # Write data
-        for order in queryset:
-            order_date_naive = order.order_date.replace(tzinfo=None)  # Make datetime naive
-            worksheet.append([
-                order.product.name,
-                order.full_name,
-                order.address,
-                order.phone_number,
-                order.comment,
-                order.quantity,
-                order_date_naive,  # Use the naive datetime
-                order.is_paid,
-            ])
-
-        workbook.save(response)
-        return response
+        return export_excel(request, queryset, exports.ORDERS)
 
     export_as_csv.short_description = "Export Selected Orders as CSV"
     export_as_excel.short_description = "Export Selected Orders as Excel"
@@ -108,7 +109,7 @@ class OrderAdmin(ModelAdmin):
             form.add_error(None, e)
             raise
 
-class ProductAdmin(ModelAdmin):
+class ProductAdmin(ProductSearchMixin, ModelAdmin):
     model = Product
     list_display = (
         'code',
@@ -121,64 +122,79 @@ class ProductAdmin(ModelAdmin):
     )
     list_filter = ('name', 'price', 'date_added')
     search_fields = ('code','name', 'price', 'date_added')
+    product_search_path = 'pk'
     ordering = ('-date_added',)
     list_per_page = 10
 
     def short_description(self, obj):
-        return obj.description if len(obj.description) <= 50 else f"{obj.description[:50]}..."
+        description = obj.description or ''
+        return description if len(description) <= 50 else f"{description[:50]}..."
     short_description.short_description = 'Description'
 
     def image_preview(self, obj):
         if obj.image:
-            return format_html('<img src="{}" style="width: 50px; height: auto;" />', obj.image.url)
+            return format_html(
+                '<img src="{}" style="width: 50px; height: auto;" loading="lazy" />',
+                images.variant_url(obj, 'thumb'),
+            )
         return "No image"
     image_preview.short_description = 'Image Preview'
 
     def export_as_csv(self, request, queryset):
-        # Create the response object for CSV
-        response = HttpResponse(content_type='text/csv')
-        response['Content-Disposition'] = 'attachment; filename="products.csv"'
-
-        writer = csv.writer(response)
-        writer.writerow(['Code', 'Name', 'Description', 'Quantity', 'Price', 'Date Added'])  # CSV Header
-
-        for product in queryset:
-            writer.writerow([product.code,product.name, product.description, product.quantity, product.price, product.date_added])  # CSV Data
-
-        return response
+        return export_csv(queryset, exports.PRODUCTS)
 
     def export_as_excel(self, request, queryset):
-        # Create the response object for Excel
-        response = HttpResponse(content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
-        response['Content-Disposition'] = 'attachment; filename="products.xlsx"'
+        return export_excel(request, queryset, exports.PRODUCTS)
 
-        workbook = Workbook()
-        worksheet = workbook.active
-        worksheet.title = 'Products'
-
-        # Write headers
-        headers = ['Name', 'Description', 'Quantity', 'Price', 'Date Added']
-        worksheet.append(headers)
-
-        # Write data
-        for product in queryset:
-            date_added_naive = product.date_added.replace(tzinfo=None)  # Make datetime naive
-            worksheet.append([product.name, product.description, product.quantity, product.price, date_added_naive])  # Use the naive datetime
-
-        workbook.save(response)
-        return response
+    def announce(self, request, queryset):
+        broadcast = create_broadcast(queryset, requested_by=request.user.get_username())
+        self.message_user(
+            request, f"{broadcast} queued: {broadcast.deliveries.count()} posts to subscribed chats."
+        )
 
     export_as_csv.short_description = "Export Selected Products as CSV"
     export_as_excel.short_description = "Export Selected Products as Excel"
+    announce.short_description = "Announce selected products to subscribers"
 
     # Adding the actions to the admin
-    actions = [export_as_csv, export_as_excel]
-
-class PurchaseAdmin(ModelAdmin):
+    actions = [export_as_csv, export_as_excel, announce]
+    actions_list = ['import_products']
+
+    @action(description="Import products", url_path='import', permissions=['add'])
+    def import_products(self, request):
+        form = CatalogImportForm(request.POST or None, request.FILES or None)
+        if request.method == 'POST' and form.is_valid():
+            upload = form.cleaned_data['file']
+            try:
+                result = CatalogImporter(user=request.user).run(
+                    read_rows(upload, upload.name), dry_run=form.cleaned_data['dry_run']
+                )
+            except ValueError as e:
+                form.add_error('file', str(e))
+            else:
+                level = messages.WARNING if result.errors else messages.SUCCESS
+                prefix = "Dry run, nothing saved. " if form.cleaned_data['dry_run'] else ""
+                self.message_user(request, f"{prefix}{result}", level)
+                for line, message in result.errors[:20]:
+                    self.message_user(request, f"Line {line}: {message}", messages.ERROR)
+                if len(result.errors) > 20:
+                    self.message_user(request, f"... and {len(result.errors) - 20} more errors.", messages.ERROR)
+                return redirect('admin:shop_product_changelist')
+
+        return TemplateResponse(request, 'admin/shop/product/import.html', {
+            **self.admin_site.each_context(request),
+            'opts': self.model._meta,
+            'title': "Import products",
+            'form': form,
+        })
+
+class PurchaseAdmin(ProductSearchMixin, ModelAdmin):
     model = Purchase
     list_display = ('product_name', 'product_code', 'product_brand', 'quantity_purchased', 'purchase_date')
     list_filter = ('product__name', 'quantity_purchased', 'purchase_date', 'product__brand__name')  # Filter by product's brand
     search_fields = ('product__name', 'product__code', 'product__brand__name', 'quantity_purchased', 'purchase_date')
+    ordering = ('-purchase_date',)
+    list_select_related = ('product__brand',)
     list_per_page = 10
 
     # Custom method to display the product's name
@@ -198,48 +214,11 @@ class PurchaseAdmin(ModelAdmin):
 
     # CSV export action
     def export_as_csv(self, request, queryset):
-        response = HttpResponse(content_type='text/csv')
-        response['Content-Disposition'] = 'attachment; filename="purchases.csv"'
-
-        writer = csv.writer(response)
-        writer.writerow(['Product Name', 'Product Code', 'Product Brand', 'Quantity Purchased', 'Purchase Date'])  # CSV Header
-
-        for purchase in queryset:
-            writer.writerow([
-                purchase.product.name,
-                purchase.product.code,
-                purchase.product.brand.name if purchase.product.brand else '',
-                purchase.quantity_purchased,
-                purchase.purchase_date
-            ])  # CSV Data
-
-        return response
+        return export_csv(queryset, exports.PURCHASES)
 
     # Excel export action
     def export_as_excel(self, request, queryset):
-        response = HttpResponse(content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
-        response['Content-Disposition'] = 'attachment; filename="purchases.xlsx"'
-
-        workbook = Workbook()
-        worksheet = workbook.active
-        worksheet.title = 'Purchases'
-
-        # Write headers
-        headers = ['Product Name', 'Product Code', 'Product Brand', 'Quantity Purchased', 'Purchase Date']
-        worksheet.append(headers)
-
-        # Write data
-        for purchase in queryset:
-            worksheet.append([
-                purchase.product.name,
-                purchase.product.code,
-                purchase.product.brand.name if purchase.product.brand else '',
-                purchase.quantity_purchased,
-                purchase.purchase_date
-            ])  # Purchase data
-
-        workbook.save(response)
-        return response
+        return export_excel(request, queryset, exports.PURCHASES)
 
     # Adding the actions to the admin
     actions = [export_as_csv, export_as_excel]
@@ -258,50 +237,132 @@ class SubcategoryAdmin(ModelAdmin):
     model = Subcategory
     list_display = ('name', 'category', )
     list_filter = ('name', 'category', )
+    list_select_related = ('category',)
     search_fields = ('name', 'category',)
     list_per_page = 10
 
 class BrandAdmin(ModelAdmin):
     model = Brand
     list_display = ('name', 'subcategory', )
-    list_filter = ('name', 'subcategory', )
+    list_filter = ('name', ('subcategory', RelatedListFilter), )
+    list_select_related = ('subcategory__category',)
     list_per_page = 10
     search_fields = ('name', 'subcategory',)
 
 class ProductModelAdmin(ModelAdmin):
     model = ProductModel
     list_display = ('name', 'brand', 'subcategory', )
-    list_filter = ('name', 'brand', 'subcategory', )
+    list_filter = ('name', ('brand', RelatedListFilter), ('subcategory', RelatedListFilter), )
+    list_select_related = ('brand__subcategory', 'subcategory__category')
     list_per_page = 10
     search_fields = ('name', 'brand', 'subcategory',)
 
-class StockAdmin(ModelAdmin):
+class StockAdmin(ProductSearchMixin, ModelAdmin):
     model = Stock
     list_display = ('product', 'quantity_in_stock', 'restock_date', )  # Display the fields we have
     list_filter = ('product', 'quantity_in_stock', 'restock_date',)  # Filterable fields
     search_fields = ('product__name', 'quantity_in_stock', 'restock_date')  # Searchable fields
+    list_select_related = ('product',)
     list_per_page = 10
 
-    actions = ['restock_items']
+    actions = ['restock_items', 'post_to_telegram']
 
     def restock_items(self, request, queryset):
-        for stock in queryset:
-            stock.quantity_in_stock += 10
-            stock.save()
+        with transaction.atomic():
+            for stock in queryset.select_related('product'):
+                stock.quantity_in_stock += 10
+                stock.save()
+                inventory.record(stock.product, StockMovement.KIND_RESTOCK, 10, user=request.user)
+
+    def post_to_telegram(self, request, queryset):
+        entries = enqueue_posts(queryset.order_by('pk'))
+        self.message_user(request, f"Selected stock items queued for the channel in {entries} posts.")
 
     restock_items.short_description = "Restock selected items"
+    post_to_telegram.short_description = "Post selected items to Telegram"
 
     def save_model(self, request, obj, form, change):
-        if not obj.added_by:
-            obj.added_by = request.user
-
         obj.clean()
-        super().save_model(request, obj, form, change)
+        with transaction.atomic():
+            super().save_model(request, obj, form, change)
+            before = form.initial.get('quantity_in_stock', 0) if change else 0
+            inventory.record(
+                obj.product, StockMovement.KIND_ADJUSTMENT, obj.quantity_in_stock - before, user=request.user
+            )
+
+    def delete_model(self, request, obj):
+        self.delete_queryset(request, Stock.objects.filter(pk=obj.pk))
+
+    def delete_queryset(self, request, queryset):
+        with transaction.atomic():
+            for stock in queryset.select_related('product'):
+                inventory.record(stock.product, StockMovement.KIND_ADJUSTMENT, -stock.quantity_in_stock,
+                                 user=request.user)
+            queryset.delete()
+
+
+class StockMovementAdmin(ProductSearchMixin, ModelAdmin):
+    model = StockMovement
+    list_display = ('date', 'product', 'product_code', 'kind', 'quantity', 'unit_price', 'order', 'user')
+    list_filter = ('kind',)
+    date_hierarchy = 'date'
+    list_select_related = ('product', 'order__product', 'user')
+    search_fields = ('product__name',)
+    list_per_page = 50
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
 
-class TelegramAdmin(ModelAdmin):
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+
+class StockSnapshotItemInline(TabularInline):
+    model = StockSnapshotItem
+    fields = ('product', 'product_code', 'quantity', 'unit_price')
+    readonly_fields = fields
+    can_delete = False
+    extra = 0
+
+    def has_add_permission(self, request, obj=None):
+        return False
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('product')
+
+
+class StockSnapshotAdmin(ModelAdmin):
+    model = StockSnapshot
+    list_display = ('taken_at', 'products', 'units')
+    readonly_fields = ('taken_at', 'last_movement_id')
+    inlines = [StockSnapshotItemInline]
+    list_per_page = 20
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).annotate(products=Count('items'), units=Sum('items__quantity'))
+
+    def products(self, obj):
+        return obj.products
+
+    def units(self, obj):
+        return obj.units
+
+
+class TelegramAdmin(ProductSearchMixin, ModelAdmin):
     model = Telegram
     list_display = ('product_name', 'product_code', 'quantity_in_stock', 'date_posted')
     search_fields = ('stock__product__name', 'stock__product__code', 'date_posted')
+    product_search_path = 'stock__product'
+    list_select_related = ('stock__product',)
     list_per_page = 10
 
     def product_name(self, obj):
@@ -316,6 +377,153 @@ class TelegramAdmin(ModelAdmin):
         return obj.stock.quantity_in_stock
     quantity_in_stock.short_description = 'Quantity in Stock'
 
+class TelegramOutboxAdmin(ModelAdmin):
+    model = TelegramOutbox
+    list_display = ('method', 'telegram', 'status', 'attempts', 'next_attempt_at', 'date_sent', 'last_error')
+    list_filter = ('status', 'method')
+    list_select_related = ('telegram__stock__product',)
+    list_per_page = 20
+
+    actions = ['retry_now']
+
+    def retry_now(self, request, queryset):
+        updated = queryset.exclude(status=TelegramOutbox.STATUS_SENT).update(
+            status=TelegramOutbox.STATUS_PENDING, attempts=0, next_attempt_at=timezone.now()
+        )
+        self.message_user(request, f"{updated} entries queued for delivery.")
+
+    retry_now.short_description = "Retry selected entries now"
+
+
+class BroadcastTargetAdmin(ModelAdmin):
+    model = BroadcastTarget
+    list_display = ('title', 'chat_id', 'kind', 'is_active', 'date_added')
+    list_filter = ('kind', 'is_active')
+    search_fields = ('title', 'chat_id')
+    list_per_page = 20
+
+
+class BroadcastDeliveryInline(TabularInline):
+    model = BroadcastDelivery
+    fields = ('target', 'product', 'status', 'attempts', 'date_sent', 'last_error')
+    readonly_fields = fields
+    extra = 0
+    can_delete = False
+    max_num = 0
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).filter(status=BroadcastDelivery.STATUS_FAILED).select_related(
+            'target', 'product'
+        )
+
+
+class BroadcastAdmin(ModelAdmin):
+    model = Broadcast
+    list_display = ('__str__', 'requested_by', 'date_created', 'date_finished', 'sent', 'failed', 'pending')
+    readonly_fields = ('products', 'requested_by', 'date_created', 'date_finished')
+    inlines = [BroadcastDeliveryInline]
+    list_per_page = 20
+
+    def has_add_permission(self, request):
+        return False
+
+    def get_queryset(self, request):
+        statuses = {
+            status: Count('deliveries', filter=Q(deliveries__status=status))
+            for status, _ in BroadcastDelivery.STATUSES
+        }
+        return super().get_queryset(request).annotate(**statuses)
+
+    def sent(self, obj):
+        return obj.sent
+
+    def failed(self, obj):
+        return obj.failed
+
+    def pending(self, obj):
+        return obj.pending
+
+
+class SalesTotalsAdmin(ModelAdmin):
+    """
+    Read-only sales dashboard over a rollup table, with the totals of the
+    filtered rows above the list.
+    """
+    list_filter = ('is_paid', 'order_type', 'payment_method')
+    date_hierarchy = 'day'
+    list_before_template = 'admin/shop/sales_totals.html'
+    list_per_page = 50
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+    def get_queryset(self, request):
+        # Rows whose orders all moved elsewhere stay behind at zero.
+        return super().get_queryset(request).filter(orders__gt=0)
+
+    def changelist_view(self, request, extra_context=None):
+        response = super().changelist_view(request, extra_context)
+        changelist = getattr(response, 'context_data', {}).get('cl')
+        if changelist is not None:
+            response.context_data['sales_totals'] = sales.totals(changelist.queryset.aggregate(**sales.TOTALS))
+        return response
+
+
+class DailySalesAdmin(SalesTotalsAdmin):
+    model = DailySales
+    list_display = ('day', 'payment_method', 'order_type', 'is_paid', 'orders', 'quantity', 'revenue')
+
+
+class SalesRollupAdmin(SalesTotalsAdmin):
+    model = SalesRollup
+    list_display = ('day', 'product', 'brand', 'payment_method', 'order_type', 'is_paid', 'orders', 'quantity',
+                    'revenue')
+    list_filter = SalesTotalsAdmin.list_filter + (('product__brand', RelatedListFilter),)
+    list_select_related = ('product__brand',)
+
+    def brand(self, obj):
+        return obj.product.brand.name if obj.product and obj.product.brand else None
+
+
+class ExportJobAdmin(ModelAdmin):
+    model = ExportJob
+    list_display = ('kind', 'status', 'row_count', 'requested_by', 'date_created', 'date_finished', 'download_link')
+    list_filter = ('kind', 'status')
+    list_select_related = ('requested_by',)
+    readonly_fields = ('kind', 'status', 'row_count', 'requested_by', 'date_created', 'date_finished', 'error')
+    exclude = ('selection', 'file')
+    list_per_page = 20
+
+    def has_add_permission(self, request):
+        return False
+
+    def get_queryset(self, request):
+        # The selected ids are only read by the export runner.
+        return super().get_queryset(request).defer('selection')
+
+    def download_link(self, obj):
+        if obj.status == ExportJob.STATUS_DONE and obj.file:
+            return format_html('<a href="{}">Download</a>', reverse('admin:shop_exportjob_download', args=[obj.pk]))
+        return "-"
+    download_link.short_description = 'File'
+
+    def get_urls(self):
+        return [
+            path('<int:pk>/download/', self.admin_site.admin_view(self.download_view), name='shop_exportjob_download'),
+        ] + super().get_urls()
+
+    def download_view(self, request, pk):
+        job = self.get_object(request, pk)
+        if job is None or not job.file or not self.has_view_permission(request, job):
+            raise Http404("Export not found.")
+        return FileStreamResponse(job.file.open('rb'), as_attachment=True, filename=f'{job.kind}.xlsx')
+
 admin.site.register(Order, OrderAdmin)
 admin.site.register(Product, ProductAdmin)
 admin.site.register(Category, CategoryAdmin)
@@ -323,8 +531,16 @@ admin.site.register(Subcategory, SubcategoryAdmin)
 admin.site.register(Brand, BrandAdmin)
 admin.site.register(ProductModel, ProductModelAdmin)
 admin.site.register(Stock, StockAdmin)
+admin.site.register(StockMovement, StockMovementAdmin)
+admin.site.register(StockSnapshot, StockSnapshotAdmin)
 admin.site.register(Purchase, PurchaseAdmin)
 admin.site.register(Telegram, TelegramAdmin)
+admin.site.register(TelegramOutbox, TelegramOutboxAdmin)
+admin.site.register(BroadcastTarget, BroadcastTargetAdmin)
+admin.site.register(Broadcast, BroadcastAdmin)
+admin.site.register(DailySales, DailySalesAdmin)
+admin.site.register(SalesRollup, SalesRollupAdmin)
+admin.site.register(ExportJob, ExportJobAdmin)
 
 admin.site.site_header = "Store Administration"
 admin.site.site_title = "Shop Admin Portal"
@@ -0,0 +1,132 @@
+"""
+Helpers shared by the benchmark management commands.
+
+Benchmarks seed their data with ``bulk_create`` inside ``rolled_back()``,
+so they can be pointed at a copy of the real database without leaving
+rows behind.
+"""
+import time
+import tracemalloc
+from contextlib import contextmanager
+from decimal import Decimal
+from itertools import cycle
+
+from django.db import connection, transaction
+
+from .models import Category, Subcategory, Brand, ProductModel, Product, Stock, Order
+
+
+ADJECTIVES = ['Smart', 'Ultra', 'Pro', 'Mini', 'Max', 'Lite', 'Plus', 'Neo', 'Prime', 'Air', 'Edge', 'Nova', 'Core']
+NOUNS = ['Phone', 'Tablet', 'Charger', 'Cable', 'Case', 'Earbuds', 'Watch', 'Speaker', 'Router', 'Laptop',
+         'Adapter', 'Screen protector', 'Power bank', 'Headset', 'Keyboard', 'Mouse', 'Camera']
+COLOURS = ['black', 'white', 'silver', 'gold', 'blue', 'red', 'green', 'graphite', 'purple', 'pink', 'titanium']
+
+
+def product_name(i):
+    return f'{ADJECTIVES[i % 13]} {NOUNS[(i // 13) % 17]} {COLOURS[(i // 221) % 11]} {i % 997}'
+
+
+@contextmanager
+def rolled_back():
+    with transaction.atomic():
+        yield
+        transaction.set_rollback(True)
+
+
+class QueryCounter:
+    """``connection.execute_wrapper`` hook counting queries and their time."""
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - start
+            self.count += 1
+
+
+def measure(func, *args, trace_memory=True, **kwargs):
+    """
+    Run ``func`` and return ``(result, stats)`` where stats holds the wall
+    time, the number of queries and, when traced, the peak Python memory.
+    """
+    counter = QueryCounter()
+    if trace_memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        with connection.execute_wrapper(counter):
+            result = func(*args, **kwargs)
+        elapsed = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1] if trace_memory else None
+    finally:
+        if trace_memory:
+            tracemalloc.stop()
+    return result, {'seconds': elapsed, 'queries': counter.count, 'peak_bytes': peak}
+
+
+def seed_catalog(count, batch_size=5000, stock=1000):
+    """Create ``count`` products, each with a Stock row. Returns their ids."""
+    category = Category.objects.create(name='Benchmark')
+    subcategory = Subcategory.objects.create(name='Benchmark', category=category)
+    brands = [Brand.objects.create(name=f'Brand {i}', subcategory=subcategory) for i in range(10)]
+    models = [
+        ProductModel.objects.create(name=f'Model {i}', brand=brand, subcategory=subcategory)
+        for i, brand in enumerate(brands)
+    ]
+
+    existing = set(Product.objects.values_list('pk', flat=True))
+    products = (
+        Product(
+            name=product_name(i), code=f'BENCH-{i}', category=category, subcategory=subcategory,
+            brand=brands[i % 10], model=models[i % 10], quantity=stock,
+            description=f'{product_name(i * 7)} with a {COLOURS[i % 11]} finish, benchmark item {i}.',
+            price=Decimal(100 + i % 900),
+        )
+        for i in range(count)
+    )
+    bulk_create(Product, products, batch_size)
+    product_ids = list(Product.objects.exclude(pk__in=existing).values_list('pk', flat=True))
+
+    bulk_create(Stock, (Stock(product_id=pk, quantity_in_stock=stock) for pk in product_ids), batch_size)
+    return product_ids
+
+
+def seed_orders(count, product_ids, batch_size=5000):
+    """Create ``count`` online orders spread over ``product_ids``."""
+    product_ids = cycle(product_ids)
+    methods = cycle([method for method, _ in Order.PAYMENT_METHODS])
+    orders = (
+        Order(
+            product_id=next(product_ids), order_type='online', full_name=f'Customer {i}',
+            address=f'Bole, house {i}', phone_number=f'09{i:08d}'[:10], comment='Benchmark order',
+            quantity=1 + i % 3, total_price=Decimal(100 * (1 + i % 3)),
+            payment_method=next(methods), is_paid=i % 2 == 0,
+        )
+        for i in range(count)
+    )
+    bulk_create(Order, orders, batch_size)
+
+
+def bulk_create(model, objects, batch_size):
+    batch = []
+    for obj in objects:
+        batch.append(obj)
+        if len(batch) >= batch_size:
+            model.objects.bulk_create(batch)
+            batch = []
+    if batch:
+        model.objects.bulk_create(batch)
+
+
+def format_bytes(value):
+    if value is None:
+        return '-'
+    for unit in ('B', 'KiB', 'MiB', 'GiB'):
+        if value < 1024 or unit == 'GiB':
+            return f'{value:.1f} {unit}'
+        value /= 1024
@@ -0,0 +1,187 @@
+"""
+Product announcements to many chats.
+
+``create_broadcast`` queues one ``BroadcastDelivery`` per product and
+target; ``BroadcastWorker`` sends them concurrently, spaced by a
+``RateLimiter`` so that neither Telegram's global limit nor any chat's
+limit is exceeded. Deliveries are claimed and retried like outbox entries,
+so a broadcast interrupted by a crash resumes where it stopped.
+"""
+import time
+
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Broadcast, BroadcastDelivery, BroadcastTarget, Product, Stock
+from .outbox import OutboxWorker
+from .telegram import TelegramError, build_post
+
+# Bot API limits, from https://core.telegram.org/bots/faq#my-bot-is-hitting-limits-how-do-i-avoid-this
+GLOBAL_RATE = 30  # messages per second over all chats
+PRIVATE_CHAT_RATE = 1  # messages per second in one private chat
+GROUP_CHAT_RATE = 20 / 60  # messages per second in one group or channel
+
+
+def is_private_chat(chat_id):
+    # Users have positive ids; groups and channels negative ids or @names.
+    return str(chat_id).isdigit()
+
+
+class TokenBucket:
+    """
+    ``rate`` tokens per second, up to ``capacity`` saved for a burst.
+
+    Kept as the time at which the next token is due (the GCRA form of a token
+    bucket), so a caller can reserve a future token without sleeping first.
+    """
+
+    def __init__(self, rate, capacity=1):
+        self.interval = 1 / rate
+        self.tolerance = (capacity - 1) * self.interval
+        self.next_token = 0.0
+
+    def delay(self, now):
+        """Seconds after ``now`` until a token is available."""
+        return max(0.0, self.next_token - self.tolerance - now)
+
+    def take(self, at):
+        """Reserve a token at or after ``at``; returns the time it is granted."""
+        granted = at + self.delay(at)
+        self.next_token = max(self.next_token, granted) + self.interval
+        return granted
+
+
+class RateLimiter:
+    """
+    One global bucket plus one per chat. A sender first waits until its chat
+    is free (``delay``), then reserves the next global token (``reserve``),
+    so concurrent senders queue for the global limit in order, and a busy
+    chat never holds back sends to other chats.
+    """
+    max_chats = 10000
+
+    def __init__(self, global_rate=GLOBAL_RATE, private_rate=PRIVATE_CHAT_RATE, group_rate=GROUP_CHAT_RATE):
+        self.overall = TokenBucket(global_rate)
+        self.private_rate = private_rate
+        self.group_rate = group_rate
+        self.chats = {}
+
+    def bucket(self, chat_id):
+        bucket = self.chats.get(chat_id)
+        if bucket is None:
+            bucket = TokenBucket(self.private_rate if is_private_chat(chat_id) else self.group_rate)
+            self.chats[chat_id] = bucket
+        return bucket
+
+    def delay(self, chat_id, now=None):
+        """Seconds until ``chat_id`` may be sent to again."""
+        now = time.monotonic() if now is None else now
+        return self.bucket(chat_id).delay(now)
+
+    def reserve(self, chat_id, now=None):
+        """
+        Reserve the next global token for a send to ``chat_id``, which must be
+        free, and return the seconds to wait for it. The chat's next send is
+        counted from that moment.
+        """
+        now = time.monotonic() if now is None else now
+        granted = self.overall.take(now)
+        self.bucket(chat_id).take(granted)
+        if len(self.chats) > self.max_chats:
+            self.chats = {key: bucket for key, bucket in self.chats.items() if bucket.next_token > now}
+        return granted - now
+
+
+def create_broadcast(products, targets=None, requested_by=''):
+    """
+    Queue ``products`` for every target (all active ones by default).
+    Deliveries are created product by product, so consecutive sends go to
+    different chats and the per-chat limits rarely hold anything up.
+    """
+    products = list(products)
+    if targets is None:
+        targets = BroadcastTarget.objects.filter(is_active=True)
+    targets = list(targets)
+    now = timezone.now()
+    with transaction.atomic():
+        broadcast = Broadcast.objects.create(requested_by=requested_by)
+        broadcast.products.set(products)
+        BroadcastDelivery.objects.bulk_create(
+            [
+                BroadcastDelivery(broadcast=broadcast, target=target, product=product, next_attempt_at=now)
+                for product in products for target in targets
+            ],
+            batch_size=1000,
+        )
+    return broadcast
+
+
+class BroadcastWorker(OutboxWorker):
+    """
+    Drains ``BroadcastDelivery`` with the outbox's claiming, retry and flood
+    control handling, throttled by a ``RateLimiter``. ``on_finished`` is
+    awaited with each broadcast that has no pending deliveries left.
+    """
+    model = BroadcastDelivery
+
+    def __init__(self, client, concurrency=30, batch_size=100, limiter=None, on_finished=None, **kwargs):
+        super().__init__(
+            client, concurrency=concurrency, batch_size=batch_size, limiter=limiter or RateLimiter(), **kwargs
+        )
+        self.on_finished = on_finished
+        self._posts = {}
+        self._blocked = set()
+
+    def due(self):
+        return BroadcastDelivery.objects.select_related('target')
+
+    def chat_id(self, entry):
+        return entry.target.chat_id
+
+    async def drain(self):
+        handled = await super().drain()
+        # Build the posts afresh next time, in case the products changed.
+        self._posts.clear()
+        await self.finish()
+        return handled
+
+    async def finish(self):
+        """Mark broadcasts without pending deliveries finished and return them."""
+        finished = [
+            broadcast async for broadcast in Broadcast.objects.filter(date_finished__isnull=True).exclude(
+                deliveries__status=BroadcastDelivery.STATUS_PENDING
+            )
+        ]
+        if finished:
+            now = timezone.now()
+            await Broadcast.objects.filter(pk__in=[b.pk for b in finished]).aupdate(date_finished=now)
+            for broadcast in finished:
+                broadcast.date_finished = now
+                if self.on_finished:
+                    await self.on_finished(broadcast)
+        return finished
+
+    async def deliver(self, entry):
+        if entry.target_id in self._blocked:
+            raise TelegramError("Chat is no longer reachable", error_code=403)
+        method, payload = await self.post(entry.product_id)
+        return await self.send(method, {**payload, 'chat_id': entry.target.chat_id})
+
+    async def post(self, product_id):
+        if product_id not in self._posts:
+            product = await Product.objects.with_available_stock().select_related(
+                'brand', 'model', 'category'
+            ).aget(pk=product_id)
+            # Announce what is on hand, not the last purchased quantity.
+            self._posts[product_id] = build_post(Stock(product=product, quantity_in_stock=product.available_stock))
+        return self._posts[product_id]
+
+    async def _failed(self, entry, error):
+        if error.error_code == 403 and entry.target_id not in self._blocked:
+            # Blocked by the user, or removed from the group or channel.
+            self._blocked.add(entry.target_id)
+            await BroadcastTarget.objects.filter(pk=entry.target_id).aupdate(is_active=False)
+            await BroadcastDelivery.objects.filter(
+                target_id=entry.target_id, status=BroadcastDelivery.STATUS_PENDING
+            ).exclude(pk=entry.pk).aupdate(status=BroadcastDelivery.STATUS_FAILED, last_error=str(error))
+        await super()._failed(entry, error)
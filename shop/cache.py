@@ -0,0 +1,125 @@
+"""
+Read-through cache of the product shown by the Telegram mini-app.
+
+A channel post sends hundreds of users to the same product within seconds;
+with the cache only the first open reads the database. Entries are dropped
+from the Product/Stock (and catalog hierarchy) save paths in ``signals.py``
+and expire after ``PRODUCT_CACHE_TIMEOUT`` seconds as a backstop for other
+worker processes when the cache backend is per-process.
+
+A miss is filled by one caller at a time: it takes a short-lived lock key
+with ``cache.add`` while it reads the database, and the others poll the
+cache until the product appears instead of all reading it at once. If the
+filler takes longer than ``FILL_WAIT`` seconds they read it themselves.
+"""
+import asyncio
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .models import Product
+
+# Seconds a filler may hold the lock; it expires if the filler dies.
+FILL_LOCK_TIMEOUT = 5
+# Seconds the others wait for it, checking the cache every FILL_POLL.
+FILL_WAIT = 1
+FILL_POLL = 0.02
+
+_stats_lock = threading.Lock()
+_stats = {'hits': 0, 'misses': 0}
+
+
+def product_cache_key(pk):
+    return f'shop:product:{pk}'
+
+
+def fill_lock_key(key):
+    return f'{key}:fill'
+
+
+def _count(name):
+    with _stats_lock:
+        _stats[name] += 1
+
+
+def _product(pk):
+    return Product.objects.select_related('category', 'subcategory', 'brand', 'model').filter(pk=pk)
+
+
+def get_product(pk):
+    """Return the product with its category, brand and model, or ``None``."""
+    key = product_cache_key(pk)
+    product = cache.get(key)
+    if product is not None:
+        _count('hits')
+        return product
+
+    lock = fill_lock_key(key)
+    deadline = time.monotonic() + FILL_WAIT
+    while not cache.add(lock, True, FILL_LOCK_TIMEOUT):
+        if time.monotonic() >= deadline:
+            _count('misses')
+            return _product(pk).first()
+        time.sleep(FILL_POLL)
+        product = cache.get(key)
+        if product is not None:
+            _count('hits')
+            return product
+    try:
+        # Filled by whoever held the lock before us?
+        product = cache.get(key)
+        if product is not None:
+            _count('hits')
+            return product
+        _count('misses')
+        product = _product(pk).first()
+        if product is not None:
+            cache.set(key, product, settings.PRODUCT_CACHE_TIMEOUT)
+        return product
+    finally:
+        cache.delete(lock)
+
+
+async def aget_product(pk):
+    """Async version of ``get_product``."""
+    key = product_cache_key(pk)
+    product = await cache.aget(key)
+    if product is not None:
+        _count('hits')
+        return product
+
+    lock = fill_lock_key(key)
+    deadline = time.monotonic() + FILL_WAIT
+    while not await cache.aadd(lock, True, FILL_LOCK_TIMEOUT):
+        if time.monotonic() >= deadline:
+            _count('misses')
+            return await _product(pk).afirst()
+        await asyncio.sleep(FILL_POLL)
+        product = await cache.aget(key)
+        if product is not None:
+            _count('hits')
+            return product
+    try:
+        product = await cache.aget(key)
+        if product is not None:
+            _count('hits')
+            return product
+        _count('misses')
+        product = await _product(pk).afirst()
+        if product is not None:
+            await cache.aset(key, product, settings.PRODUCT_CACHE_TIMEOUT)
+        return product
+    finally:
+        await cache.adelete(lock)
+
+
+def invalidate_products(*pks):
+    cache.delete_many([product_cache_key(pk) for pk in pks])
+
+
+def product_cache_stats():
+    """Hit and miss counts of this process since it started."""
+    with _stats_lock:
+        return dict(_stats)
@@ -0,0 +1,86 @@
+"""
+Cheap fingerprints of the product catalog.
+
+Everything the product API serializes lives on ``Product`` or ``Stock``
+rows, and both carry an indexed ``date_updated``. Their row counts and
+latest update times therefore change whenever the API output can, and
+reading them takes two aggregate queries instead of rebuilding the body.
+"""
+import hashlib
+
+from django.db.models import Count, Max
+
+from .models import Product, Stock
+
+
+class CatalogVersion:
+    def __init__(self, token, last_modified):
+        self.token = token
+        self.last_modified = last_modified
+
+    def etag(self, *parts):
+        return hashlib.sha1(':'.join([self.token, *map(str, parts)]).encode()).hexdigest()
+
+
+def catalog_version():
+    products = Product.objects.aggregate(count=Count('pk'), updated=Max('date_updated'))
+    stocks = Stock.objects.aggregate(count=Count('pk'), updated=Max('date_updated'))
+    token = f"{products['count']}:{products['updated']}:{stocks['count']}:{stocks['updated']}"
+    last_modified = max(filter(None, [products['updated'], stocks['updated']]), default=None)
+    return CatalogVersion(token, last_modified)
+
+
+def product_version(pk):
+    """Version of a single product, or ``None`` if it doesn't exist."""
+    try:
+        pk = int(pk)
+    except (TypeError, ValueError):
+        return None
+    row = Product.objects.filter(pk=pk).annotate(
+        stock_count=Count('stocks'), stock_updated=Max('stocks__date_updated')
+    ).values('date_updated', 'stock_count', 'stock_updated').first()
+    if row is None:
+        return None
+    token = f"{pk}:{row['date_updated']}:{row['stock_count']}:{row['stock_updated']}"
+    last_modified = max(filter(None, [row['date_updated'], row['stock_updated']]))
+    return CatalogVersion(token, last_modified)
+
+
+def request_catalog_version(request):
+    """``catalog_version()``, computed once per request."""
+    if not hasattr(request, '_catalog_version'):
+        request._catalog_version = catalog_version()
+    return request._catalog_version
+
+
+def request_product_version(request, pk):
+    if not hasattr(request, '_product_version'):
+        request._product_version = product_version(pk)
+    return request._product_version
+
+
+def origin(request):
+    # Image URLs in the body are absolute, built from the request's host.
+    return f'{request.scheme}://{request.get_host()}'
+
+
+def list_etag(request, *args, **kwargs):
+    # The body depends on the page, the filters and the renderer too.
+    accepted = getattr(request, 'accepted_media_type', '')
+    return request_catalog_version(request).etag(origin(request), request.get_full_path(), accepted)
+
+
+def list_last_modified(request, *args, **kwargs):
+    return request_catalog_version(request).last_modified
+
+
+def detail_etag(request, pk=None, *args, **kwargs):
+    version = request_product_version(request, pk)
+    if version is None:
+        return None
+    return version.etag(origin(request), getattr(request, 'accepted_media_type', ''))
+
+
+def detail_last_modified(request, pk=None, *args, **kwargs):
+    version = request_product_version(request, pk)
+    return version.last_modified if version else None
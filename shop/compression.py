@@ -0,0 +1,129 @@
+"""
+Brotli and gzip compression of API and page responses.
+
+``CompressionMiddleware`` encodes text and JSON bodies in the best encoding
+the client accepts (``choose_encoding``), marks their ETags weak and adds
+``Vary: Accept-Encoding``. Brotli runs at a mid quality: the higher ones
+save a few more percent for several times the CPU on every response.
+
+Catalog list responses are identical for everyone until the catalog
+changes, and their strong ETag already names the catalog version, origin,
+page, filters and renderer. The middleware keeps their compressed bodies in the
+cache under that ETag (``remember``), and ``ProductViewSet.list`` answers
+from there (``cached_response``) before serializing anything, so each page
+is compressed once per catalog change instead of once per request.
+"""
+import gzip
+
+import brotli
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.utils.cache import patch_vary_headers
+
+# Preferred first, for clients that accept several equally.
+ENCODINGS = ('br', 'gzip')
+BROTLI_QUALITY = 5
+GZIP_LEVEL = 6
+# Below this, headers and framing outweigh what compression saves.
+MIN_SIZE = 200
+COMPRESSIBLE_TYPES = ('text/', 'application/json', 'application/javascript', 'application/xml')
+# What the view set on a cached response, stored with its body.
+REPLAYED_HEADERS = ('Content-Type', 'Vary', 'Allow')
+
+
+def choose_encoding(accept_encoding):
+    """The encoding to use for an ``Accept-Encoding`` header, or ``None``."""
+    weights = {}
+    for item in accept_encoding.split(','):
+        coding, _, params = item.strip().partition(';')
+        quality = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                continue
+        weights[coding.strip().lower()] = quality
+    default = weights.get('*', 0)
+    qualities = {encoding: weights.get(encoding, default) for encoding in ENCODINGS}
+    best = max(ENCODINGS, key=qualities.get)  # the first of equals
+    return best if qualities[best] > 0 else None
+
+
+def compress(data, encoding):
+    if encoding == 'br':
+        return brotli.compress(data, quality=BROTLI_QUALITY)
+    # mtime=0 keeps equal bodies byte-identical.
+    return gzip.compress(data, compresslevel=GZIP_LEVEL, mtime=0)
+
+
+def is_compressible(response):
+    return (
+        not response.streaming
+        and not response.has_header('Content-Encoding')
+        and response.get('Content-Type', '').startswith(COMPRESSIBLE_TYPES)
+        and 'no-transform' not in response.get('Cache-Control', '')
+        and len(response.content) >= MIN_SIZE
+    )
+
+
+def encode(response, encoding, body):
+    """Put the ``encoding``-compressed ``body`` in ``response``."""
+    response.content = body
+    response['Content-Length'] = str(len(body))
+    response['Content-Encoding'] = encoding
+    # The bytes differ from the uncompressed ones; the content does not.
+    etag = response.get('ETag')
+    if etag and etag.startswith('"'):
+        response['ETag'] = f'W/{etag}'
+    return response
+
+
+def cache_key(etag, encoding):
+    return f'compressed:{encoding}:{etag.removeprefix("W/")}'
+
+
+def remember(response, encoding):
+    """Keep an encoded response's body and headers for ``cached_response``."""
+    headers = {name: response[name] for name in REPLAYED_HEADERS if response.has_header(name)}
+    cache.set(
+        cache_key(response['ETag'], encoding),
+        (headers, response.content),
+        settings.COMPRESSED_CATALOG_CACHE_TIMEOUT,
+    )
+
+
+def cached_response(request, etag):
+    """
+    The cached, compressed body for the strong ``etag`` as a response, or
+    ``None``. Responses this returns ``None`` for should set
+    ``cache_compressed`` so the middleware stores their body.
+    """
+    encoding = choose_encoding(request.headers.get('Accept-Encoding', ''))
+    if encoding is None:
+        return None
+    cached = cache.get(cache_key(f'"{etag}"', encoding))
+    if cached is None:
+        return None
+    headers, body = cached
+    response = HttpResponse(headers=headers)
+    response['ETag'] = f'"{etag}"'
+    patch_vary_headers(response, ['Accept-Encoding'])
+    return encode(response, encoding, body)
+
+
+def compress_response(request, response):
+    if not is_compressible(response):
+        return response
+    patch_vary_headers(response, ['Accept-Encoding'])
+    encoding = choose_encoding(request.headers.get('Accept-Encoding', ''))
+    if encoding is None:
+        return response
+    body = compress(response.content, encoding)
+    if len(body) >= len(response.content):
+        return response
+    encode(response, encoding, body)
+    if getattr(response, 'cache_compressed', False) and response.status_code == 200 and response.has_header('ETag'):
+        remember(response, encoding)
+    return response
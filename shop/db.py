@@ -0,0 +1,97 @@
+"""
+Optional single-writer queue for SQLite.
+
+SQLite allows one writer at a time. With ``SQLITE_WRITE_QUEUE`` on, the
+order and payment paths hand their writes to one thread per process instead
+of each request waiting on the file lock: the thread runs whatever is
+queued in one ``BEGIN IMMEDIATE`` transaction, each write in its own
+savepoint, and commits once. A failing write only rolls back its savepoint
+and its exception is raised in the caller.
+
+With the queue off (the default, and in tests), ``write`` simply runs the
+function in a transaction on the caller's connection.
+"""
+import asyncio
+import logging
+import queue
+import threading
+from concurrent.futures import Future
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import transaction
+
+logger = logging.getLogger(__name__)
+
+# Writes committed together at most; keeps the lock short for other processes.
+BATCH_SIZE = 50
+
+
+class WriteQueue:
+    def __init__(self, batch_size=BATCH_SIZE):
+        self.batch_size = batch_size
+        self.jobs = queue.SimpleQueue()
+        self.thread = None
+        self.lock = threading.Lock()
+
+    def submit(self, func, *args, **kwargs):
+        """Queue ``func(*args, **kwargs)``; returns a ``Future`` set after the commit."""
+        self.start()
+        future = Future()
+        self.jobs.put((future, func, args, kwargs))
+        return future
+
+    def start(self):
+        if self.thread is None:
+            with self.lock:
+                if self.thread is None:
+                    self.thread = threading.Thread(target=self.run, name='sqlite-writer', daemon=True)
+                    self.thread.start()
+
+    def run(self):
+        while True:
+            batch = [self.jobs.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.jobs.get_nowait())
+                except queue.Empty:
+                    break
+            self.commit(batch)
+
+    def commit(self, batch):
+        results = []
+        try:
+            with transaction.atomic():
+                for future, func, args, kwargs in batch:
+                    try:
+                        with transaction.atomic():
+                            results.append((future, func(*args, **kwargs), None))
+                    except Exception as e:
+                        results.append((future, None, e))
+        except Exception as e:
+            # The commit itself failed; none of the writes happened.
+            logger.exception("Queued write batch of %s failed", len(batch))
+            results = [(future, None, e) for future, *_ in batch]
+
+        for future, result, error in results:
+            if error is None:
+                future.set_result(result)
+            else:
+                future.set_exception(error)
+
+
+_queue = WriteQueue()
+
+
+def write(func, *args, **kwargs):
+    """Run ``func`` as a database write, through the queue when enabled."""
+    if not settings.SQLITE_WRITE_QUEUE:
+        with transaction.atomic():
+            return func(*args, **kwargs)
+    return _queue.submit(func, *args, **kwargs).result()
+
+
+async def awrite(func, *args, **kwargs):
+    if not settings.SQLITE_WRITE_QUEUE:
+        return await sync_to_async(write)(func, *args, **kwargs)
+    return await asyncio.wrap_future(_queue.submit(func, *args, **kwargs))
@@ -0,0 +1,216 @@
+"""
+Helpers for the admin export actions.
+
+Rows are read with ``values_list`` over the joins the export needs and
+fetched in chunks, so an export runs a single query and never holds the
+whole result set or the whole file in memory. Excel files are written with
+openpyxl's write-only workbook; selections above
+``settings.EXPORT_BACKGROUND_THRESHOLD`` rows are handed to an ``ExportJob``,
+which stores the selected primary keys and the ordering as JSON.
+"""
+import csv
+import datetime
+import logging
+import tempfile
+import threading
+
+from django.conf import settings
+from django.contrib import messages
+from django.core.files import File
+from django.db import connection, transaction
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.html import format_html
+from openpyxl import Workbook
+
+from .models import Order, Product, Purchase, ExportJob
+from .responses import FileStreamResponse, StreamingResponse
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 2000
+XLSX_CONTENT_TYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+
+class Export:
+    """Columns of one admin export."""
+
+    def __init__(self, name, model, title, headers, fields):
+        self.name = name
+        self.model = model
+        self.title = title
+        self.headers = headers
+        self.fields = fields
+
+    def rows(self, queryset, chunk_size=CHUNK_SIZE):
+        return export_rows(queryset, self.fields, chunk_size)
+
+
+ORDERS = Export(
+    'orders', Order, 'Orders',
+    ['Product', 'Full Name', 'Address', 'Phone Number', 'Comment', 'Quantity', 'Order Date', 'Is Paid'],
+    ('product__name', 'full_name', 'address', 'phone_number', 'comment', 'quantity', 'order_date', 'is_paid'),
+)
+PRODUCTS = Export(
+    'products', Product, 'Products',
+    ['Code', 'Name', 'Description', 'Quantity', 'Price', 'Date Added'],
+    ('code', 'name', 'description', 'quantity', 'price', 'date_added'),
+)
+PURCHASES = Export(
+    'purchases', Purchase, 'Purchases',
+    ['Product Name', 'Product Code', 'Product Brand', 'Quantity Purchased', 'Purchase Date'],
+    ('product__name', 'product__code', 'product__brand__name', 'quantity_purchased', 'purchase_date'),
+)
+EXPORTS = {export.name: export for export in (ORDERS, PRODUCTS, PURCHASES)}
+
+
+class Echo:
+    """File-like object that returns what ``csv.writer`` writes to it."""
+
+    def write(self, value):
+        return value
+
+
+def export_rows(queryset, fields, chunk_size=CHUNK_SIZE):
+    return queryset.values_list(*fields).iterator(chunk_size=chunk_size)
+
+
+def stream_csv(filename, headers, rows, lines_per_chunk=500):
+    writer = csv.writer(Echo())
+
+    def generate():
+        yield writer.writerow(headers)
+        lines = []
+        for row in rows:
+            lines.append(writer.writerow(row))
+            if len(lines) >= lines_per_chunk:
+                yield ''.join(lines)
+                lines = []
+        if lines:
+            yield ''.join(lines)
+
+    response = StreamingResponse(generate(), content_type='text/csv')
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+
+def write_xlsx(target, title, headers, rows):
+    """
+    Write ``rows`` to ``target`` with a write-only workbook, which flushes
+    each row to disk instead of keeping a cell object per value.
+    Returns the number of data rows written.
+    """
+    workbook = Workbook(write_only=True)
+    worksheet = workbook.create_sheet(title)
+    worksheet.append(headers)
+
+    count = 0
+    for row in rows:
+        # Excel has no time zones, so datetimes are written naive.
+        worksheet.append([
+            value.replace(tzinfo=None) if isinstance(value, datetime.datetime) else value
+            for value in row
+        ])
+        count += 1
+
+    workbook.save(target)
+    return count
+
+
+def export_csv(queryset, export):
+    return stream_csv(f'{export.name}.csv', export.headers, export.rows(queryset))
+
+
+def export_excel(request, queryset, export):
+    """
+    Return the Excel file for ``queryset``, or queue an ``ExportJob`` and
+    tell the admin where to pick it up when the selection is large.
+    """
+    if queryset.count() > settings.EXPORT_BACKGROUND_THRESHOLD:
+        job = start_export_job(queryset, export, request.user)
+        url = reverse('admin:shop_exportjob_changelist')
+        messages.info(request, format_html(
+            'The export is being generated in the background. '
+            'Download it from <a href="{}">Exports</a> when it is ready (job #{}).', url, job.pk
+        ))
+        return None
+
+    # The temporary file is deleted when the response closes it.
+    target = tempfile.TemporaryFile()
+    write_xlsx(target, export.title, export.headers, export.rows(queryset))
+    target.seek(0)
+    return FileStreamResponse(
+        target, as_attachment=True, filename=f'{export.name}.xlsx', content_type=XLSX_CONTENT_TYPE
+    )
+
+
+def selection(queryset):
+    """What an ``ExportJob`` needs to export ``queryset``'s rows again, as JSON."""
+    ordering = [
+        field for field in (queryset.query.order_by or queryset.model._meta.ordering) if isinstance(field, str)
+    ]
+    return {'ids': list(queryset.values_list('pk', flat=True)), 'ordering': ordering}
+
+
+def selected_rows(export, selection, batch_size=CHUNK_SIZE):
+    """``export``'s rows for a stored ``selection``, in its order, one query per batch of ids."""
+    ids = selection['ids']
+    ordering = selection['ordering'] or ['pk']
+    for start in range(0, len(ids), batch_size):
+        batch = export.model.objects.filter(pk__in=ids[start:start + batch_size]).order_by(*ordering)
+        yield from export.rows(batch)
+
+
+def start_export_job(queryset, export, user=None):
+    job = ExportJob.objects.create(
+        kind=export.name,
+        selection=selection(queryset),
+        requested_by=user if user and user.is_authenticated else None,
+    )
+    transaction.on_commit(lambda: threading.Thread(target=run_export_job, args=(job.pk,), daemon=True).start())
+    return job
+
+
+def run_export_job(job_id):
+    """
+    Generate the file for ``job_id``. Runs in a background thread, or from
+    ``manage.py run_export_jobs`` for jobs a restarted worker left behind.
+    """
+    try:
+        claimed = ExportJob.objects.filter(pk=job_id, status=ExportJob.STATUS_PENDING).update(
+            status=ExportJob.STATUS_RUNNING
+        )
+        if not claimed:
+            return
+        job = ExportJob.objects.get(pk=job_id)
+        export = EXPORTS[job.kind]
+
+        try:
+            with tempfile.TemporaryFile() as target:
+                job.row_count = write_xlsx(target, export.title, export.headers, selected_rows(export, job.selection))
+                target.seek(0)
+                job.file.save(f'{export.name}-{job.pk}.xlsx', File(target), save=False)
+        except Exception as e:
+            logger.exception("Export job %s failed", job_id)
+            job.status = ExportJob.STATUS_FAILED
+            job.error = str(e)
+        else:
+            job.status = ExportJob.STATUS_DONE
+        job.date_finished = timezone.now()
+        job.save()
+    finally:
+        if threading.current_thread() is not threading.main_thread():
+            connection.close()
+
+
+def fail_interrupted_jobs():
+    """
+    Mark jobs that were pending or running when the web workers stopped as
+    failed: their threads died with the workers. Run at startup, before
+    any worker can start a job. Returns the number of jobs.
+    """
+    return ExportJob.objects.filter(status__in=[ExportJob.STATUS_PENDING, ExportJob.STATUS_RUNNING]).update(
+        status=ExportJob.STATUS_FAILED,
+        error="Interrupted by a server restart; run the export again.",
+        date_finished=timezone.now(),
+    )
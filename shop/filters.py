@@ -0,0 +1,77 @@
+"""
+Query parameter filters for the API viewsets.
+
+A viewset lists its filters in ``query_filters`` as
+``{param: (lookup, parser)}``; a parser turns the raw string into the value
+for the lookup or raises ``ValueError``.
+"""
+from datetime import datetime, time
+from decimal import Decimal, InvalidOperation
+
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from rest_framework.exceptions import ValidationError
+from rest_framework.filters import BaseFilterBackend
+
+
+def parse_bool(value):
+    lowered = value.lower()
+    if lowered in ('1', 'true', 'yes'):
+        return True
+    if lowered in ('0', 'false', 'no'):
+        return False
+    raise ValueError(value)
+
+
+def parse_decimal(value):
+    try:
+        return Decimal(value)
+    except InvalidOperation:
+        raise ValueError(value)
+
+
+def parse_moment(value):
+    """Accept an ISO date (start of that day) or datetime, in local time if naive."""
+    moment = parse_datetime(value)
+    if moment is None:
+        day = parse_date(value)
+        if day is None:
+            raise ValueError(value)
+        moment = datetime.combine(day, time.min)
+    if timezone.is_naive(moment):
+        moment = timezone.make_aware(moment)
+    return moment
+
+
+def parse_day(value):
+    day = parse_date(value)
+    if day is None:
+        raise ValueError(value)
+    return day
+
+
+def choice_parser(choices):
+    allowed = {key for key, _ in choices}
+
+    def parse(value):
+        if value not in allowed:
+            raise ValueError(value)
+        return value
+    return parse
+
+
+class QueryParamFilter(BaseFilterBackend):
+    def filter_queryset(self, request, queryset, view):
+        conditions = {}
+        errors = {}
+        for param, (lookup, parser) in getattr(view, 'query_filters', {}).items():
+            value = request.query_params.get(param)
+            if value in (None, ''):
+                continue
+            try:
+                conditions[lookup] = parser(value)
+            except (TypeError, ValueError):
+                errors[param] = [f"Invalid value: {value!r}."]
+        if errors:
+            raise ValidationError(errors)
+        return queryset.filter(**conditions) if conditions else queryset
@@ -14,4 +14,9 @@ class ReceiptUploadForm(forms.ModelForm):
         fields = ['payment_method', 'payment_ref']
         widgets = {
             'payment_method': forms.RadioSelect(choices=Order.PAYMENT_METHODS),
-        }
\ No newline at end of file
+        }
+
+class CatalogImportForm(forms.Form):
+    file = forms.FileField(help_text="CSV or XLSX with code, name, description, category, subcategory, "
+                                     "brand, model, quantity and price columns.")
+    dry_run = forms.BooleanField(required=False, help_text="Only check the file.")
@@ -0,0 +1,140 @@
+"""
+Resized variants of product images.
+
+Uploads are phone photos of several megabytes. After a product's image
+changes, ``schedule`` generates the ``VARIANTS`` below on a background
+thread once the transaction commits, stores them in a directory of the
+product's own and records them in ``Product.image_variants``; ``manage.py
+generate_image_variants`` does the same for images uploaded before, or
+missed by a restarted worker. Until a variant exists, ``variant_url`` and
+``variant_name`` fall back to the original.
+"""
+import io
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connection, transaction
+from django.utils import timezone
+from PIL import Image, ImageOps
+
+from .cache import invalidate_products
+from .models import Product
+
+logger = logging.getLogger(__name__)
+
+# name -> (longest side in pixels, format, save options)
+VARIANTS = {
+    # ProductAdmin's 50px preview, sharp on high-density screens.
+    'thumb': (100, 'WEBP', {'quality': 80, 'method': 6}),
+    # The mini-app's product card, full width on a phone.
+    'card': (800, 'WEBP', {'quality': 75, 'method': 6}),
+    # Telegram shows photos at up to 1280px and re-encodes them as JPEG.
+    'telegram': (1280, 'JPEG', {'quality': 85, 'optimize': True, 'progressive': True}),
+}
+EXTENSIONS = {'WEBP': 'webp', 'JPEG': 'jpg'}
+DIRECTORY = 'product_images/variants'
+
+# Resizing is CPU-bound; two threads keep a bulk upload from starving requests.
+_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='image-variants')
+
+
+def is_current(product):
+    """True if ``product``'s variants were made from its current image."""
+    return bool(product.image) and product.image_variants.get('source') == product.image.name
+
+
+def variant_name(product, variant):
+    """Storage name of ``variant`` of the product's image, or of the original."""
+    if is_current(product) and variant in product.image_variants:
+        return product.image_variants[variant]['name']
+    return product.image.name if product.image else None
+
+
+def variant_url(product, variant):
+    name = variant_name(product, variant)
+    return default_storage.url(name) if name else None
+
+
+def render(image, size, image_format, options):
+    variant = image.copy()
+    variant.thumbnail((size, size), Image.Resampling.LANCZOS)
+    if image_format == 'JPEG' and variant.mode != 'RGB':
+        variant = variant.convert('RGB')
+    target = io.BytesIO()
+    variant.save(target, image_format, **options)
+    return variant.size, target.getvalue()
+
+
+def generate(product):
+    """
+    Write every variant of ``product``'s current image and record them.
+    Returns the new ``image_variants``, or ``None`` if there is no image
+    or it changed meanwhile.
+    """
+    source = product.image.name if product.image else None
+    if not source:
+        return None
+    with default_storage.open(source, 'rb') as f:
+        image = Image.open(f)
+        image = ImageOps.exif_transpose(image)
+        image.load()
+    if image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA' if image.has_transparency_data else 'RGB')
+
+    stem = os.path.splitext(os.path.basename(source))[0]
+    variants = {'source': source}
+    for name, (size, image_format, options) in VARIANTS.items():
+        (width, height), data = render(image, size, image_format, options)
+        # Never overwritten: if the name is taken, storage picks a new one,
+        # so a regenerated variant also gets a new URL.
+        path = f'{directory(product)}/{stem}-{name}.{EXTENSIONS[image_format]}'
+        variants[name] = {
+            'name': default_storage.save(path, ContentFile(data)),
+            'width': width,
+            'height': height,
+            'bytes': len(data),
+        }
+
+    # Only if the image is still the one resized. date_updated changes the
+    # catalog API's ETags, so clients fetch the new URLs.
+    updated = Product.objects.filter(pk=product.pk, image=source).update(
+        image_variants=variants, date_updated=timezone.now()
+    )
+    if not updated:
+        return None
+    remove_stale(product, product.image_variants, variants)
+    product.image_variants = variants
+    invalidate_products(product.pk)
+    return variants
+
+
+def directory(product):
+    """Where ``product``'s variants go; no other product writes there."""
+    return f'{DIRECTORY}/{product.pk}'
+
+
+def remove_stale(product, old, new):
+    kept = {variant['name'] for key, variant in new.items() if key != 'source'}
+    owned = directory(product) + '/'
+    for key, variant in old.items():
+        if key != 'source' and variant['name'] not in kept and variant['name'].startswith(owned):
+            default_storage.delete(variant['name'])
+
+
+def generate_in_background(product_id):
+    try:
+        product = Product.objects.filter(pk=product_id).first()
+        if product is not None and product.image and not is_current(product):
+            generate(product)
+    except Exception:
+        logger.exception("Generating image variants of product %s failed", product_id)
+    finally:
+        connection.close()
+
+
+def schedule(product):
+    """Generate ``product``'s variants after the current transaction commits."""
+    transaction.on_commit(lambda: _executor.submit(generate_in_background, product.pk))
@@ -0,0 +1,324 @@
+"""
+Bulk catalog import from CSV or XLSX supplier sheets.
+
+``Product.save`` costs five or more queries per product (validation,
+re-reading the old row, a Purchase, the Stock). ``CatalogImporter`` does
+the same bookkeeping for a whole batch at once: the category hierarchy is
+resolved in memory, products are matched by code, and Products, Purchases
+and Stocks are written with ``bulk_create`` and batched UPDATEs.
+
+As with ``Product.save``, a row's quantity is the product's new total;
+any increase is recorded as a Purchase and added to its stock, and every
+stock change is written to the stock ledger.
+"""
+import csv
+import io
+import os
+from decimal import Decimal, InvalidOperation
+from itertools import islice
+
+from django.db import connection, transaction
+from django.utils import timezone
+from openpyxl import load_workbook
+
+from .cache import invalidate_products
+from .models import Category, Subcategory, Brand, ProductModel, Product, Purchase, Stock, StockMovement
+
+HIERARCHY = ('category', 'subcategory', 'brand', 'model')
+UPDATED_FIELDS = ['name', 'description', 'category', 'subcategory', 'brand', 'model', 'quantity', 'price', 'date_updated']
+MAX_PRICE = Decimal('99999999.99')
+
+
+def update_rows(model, objects, fields):
+    """
+    Save ``fields`` of ``objects`` with one parametrised UPDATE run through
+    ``executemany``. ``bulk_update`` builds a CASE expression per field and
+    row, which takes seconds per thousand rows just to compile.
+    """
+    if not objects:
+        return
+    quote = connection.ops.quote_name
+    columns = [model._meta.get_field(name) for name in fields]
+    sql = 'UPDATE {} SET {} WHERE {} = %s'.format(
+        quote(model._meta.db_table),
+        ', '.join(f'{quote(field.column)} = %s' for field in columns),
+        quote(model._meta.pk.column),
+    )
+    params = [
+        [field.get_db_prep_save(getattr(obj, field.attname), connection) for field in columns] + [obj.pk]
+        for obj in objects
+    ]
+    with connection.cursor() as cursor:
+        cursor.executemany(sql, params)
+
+
+class RowError(ValueError):
+    pass
+
+
+class ImportResult:
+    def __init__(self):
+        self.rows = 0
+        self.created = 0
+        self.updated = 0
+        self.unchanged = 0
+        self.errors = []  # (line, message)
+
+    def __str__(self):
+        return (
+            f"{self.rows} rows: {self.created} products created, {self.updated} updated, "
+            f"{self.unchanged} unchanged, {len(self.errors)} rows with errors."
+        )
+
+
+def header_key(value):
+    return str(value or '').strip().lower().replace(' ', '_')
+
+
+def read_rows(file, filename):
+    """
+    Yield ``(line, row)`` from a CSV or XLSX file, where ``row`` maps the
+    lower-cased header names to the cell values.
+    """
+    extension = os.path.splitext(filename)[1].lower()
+    if extension == '.xlsx':
+        workbook = load_workbook(file, read_only=True, data_only=True)
+        try:
+            lines = workbook.active.iter_rows(values_only=True)
+            header = [header_key(cell) for cell in next(lines, ())]
+            for line, values in enumerate(lines, start=2):
+                if any(value not in (None, '') for value in values):
+                    yield line, dict(zip(header, values))
+        finally:
+            workbook.close()
+    elif extension == '.csv':
+        text = io.TextIOWrapper(file, encoding='utf-8-sig', newline='') if isinstance(file.read(0), bytes) else file
+        reader = csv.reader(text)
+        header = [header_key(cell) for cell in next(reader, [])]
+        for values in reader:
+            if any(value.strip() for value in values):
+                yield reader.line_num, dict(zip(header, values))
+    else:
+        raise ValueError(f"Unsupported file type {extension or filename!r}; upload a .csv or .xlsx file.")
+
+
+def text(row, column, max_length=None):
+    value = row.get(column)
+    value = '' if value is None else str(value).strip()
+    if max_length and len(value) > max_length:
+        raise RowError(f"{column} is longer than {max_length} characters.")
+    return value
+
+
+def parse_quantity(value):
+    try:
+        quantity = Decimal(str(value).strip())
+    except InvalidOperation:
+        raise RowError(f"Invalid quantity {value!r}.")
+    if quantity != quantity.to_integral_value() or quantity < 0:
+        raise RowError(f"Quantity must be a whole number of zero or more, not {value!r}.")
+    return int(quantity)
+
+
+def parse_price(value):
+    try:
+        price = Decimal(str(value).strip()).quantize(Decimal('0.01'))
+    except InvalidOperation:
+        raise RowError(f"Invalid price {value!r}.")
+    if not Decimal(0) <= price <= MAX_PRICE:
+        raise RowError(f"Price must be between 0 and {MAX_PRICE}, not {value!r}.")
+    return price
+
+
+class Hierarchy:
+    """
+    Categories, subcategories, brands and models by name, loaded once.
+    Missing entries are created the first time a row names them.
+    """
+
+    def __init__(self):
+        self.categories = {c.name.casefold(): c for c in Category.objects.all()}
+        self.subcategories = {(s.category_id, s.name.casefold()): s for s in Subcategory.objects.all()}
+        self.brands = {(b.subcategory_id, b.name.casefold()): b for b in Brand.objects.all()}
+        self.models = {(m.brand_id, m.name.casefold()): m for m in ProductModel.objects.all()}
+
+    def get(self, cache, key, create):
+        if key not in cache:
+            cache[key] = create()
+        return cache[key]
+
+    def resolve(self, category, subcategory, brand, model):
+        category = self.get(self.categories, category.casefold(), lambda: Category.objects.create(name=category))
+        subcategory = self.get(
+            self.subcategories, (category.pk, subcategory.casefold()),
+            lambda: Subcategory.objects.create(name=subcategory, category=category),
+        )
+        brand = self.get(
+            self.brands, (subcategory.pk, brand.casefold()),
+            lambda: Brand.objects.create(name=brand, subcategory=subcategory),
+        )
+        model = self.get(
+            self.models, (brand.pk, model.casefold()),
+            lambda: ProductModel.objects.create(name=model, brand=brand, subcategory=subcategory),
+        )
+        return category, subcategory, brand, model
+
+
+class CatalogImporter:
+    def __init__(self, user=None, batch_size=1000, progress=None):
+        self.user = user
+        self.batch_size = batch_size
+        self.progress = progress
+        self.result = ImportResult()
+        self.seen_codes = {}
+
+    def run(self, rows, dry_run=False):
+        """Import ``(line, row)`` pairs, as produced by ``read_rows``."""
+        rows = iter(rows)
+        with transaction.atomic():
+            self.hierarchy = Hierarchy()
+            while batch := list(islice(rows, self.batch_size)):
+                self.import_batch(batch)
+                if self.progress:
+                    self.progress(self.result)
+            if dry_run:
+                transaction.set_rollback(True)
+        return self.result
+
+    def parse(self, line, row):
+        code = text(row, 'code', 50) or None
+        if code is not None:
+            if code in self.seen_codes:
+                raise RowError(f"Code {code!r} already appears on line {self.seen_codes[code]}.")
+            self.seen_codes[code] = line
+
+        fields = {'code': code, 'name': text(row, 'name', 255), 'description': text(row, 'description') or None}
+        if row.get('quantity') not in (None, ''):
+            fields['quantity'] = parse_quantity(row['quantity'])
+        if row.get('price') not in (None, ''):
+            fields['price'] = parse_price(row['price'])
+
+        names = [text(row, column, 255) for column in HIERARCHY]
+        if any(names):
+            if not all(names):
+                raise RowError("Category, subcategory, brand and model must all be given.")
+            fields.update(zip(HIERARCHY, self.hierarchy.resolve(*names)))
+        return fields
+
+    @staticmethod
+    def apply(product, fields):
+        """Copy the given (non-empty) fields onto ``product``; True if any changed."""
+        changed = False
+        for field, value in fields.items():
+            if value is None or value == '':
+                continue
+            if field in HIERARCHY:
+                field, value = f'{field}_id', value.pk
+            if getattr(product, field) != value:
+                setattr(product, field, value)
+                changed = True
+        return changed
+
+    def import_batch(self, batch):
+        parsed = []
+        for line, row in batch:
+            self.result.rows += 1
+            try:
+                parsed.append((line, self.parse(line, row)))
+            except RowError as e:
+                self.result.errors.append((line, str(e)))
+
+        codes = [fields['code'] for _, fields in parsed if fields['code']]
+        existing = Product.objects.in_bulk(codes, field_name='code') if codes else {}
+
+        new, changed, purchases, stock_changes = [], [], [], {}
+        now = timezone.now()
+        for line, fields in parsed:
+            product = existing.get(fields['code'])
+            if product is None:
+                missing = [f for f in ('name', 'price', *HIERARCHY) if not fields.get(f)]
+                if missing:
+                    self.result.errors.append((line, f"New products need {', '.join(missing)}."))
+                    continue
+                new.append(Product(date_added=now, **fields))
+                continue
+
+            old_quantity = product.quantity
+            if not self.apply(product, fields):
+                self.result.unchanged += 1
+                continue
+            product.date_updated = now
+            changed.append(product)
+            added = product.quantity - old_quantity
+            if added:
+                stock_changes[product.pk] = added
+            if added > 0:
+                purchases.append(Purchase(product=product, quantity_purchased=added, added_by=self.user))
+
+        Product.objects.bulk_create(new)
+        purchases += [
+            Purchase(product=product, quantity_purchased=product.quantity, added_by=self.user)
+            for product in new if product.quantity > 0
+        ]
+        stocks = [Stock(product=product, quantity_in_stock=product.quantity) for product in new]
+        moved = [(product, product.quantity) for product in new]
+
+        if changed:
+            update_rows(Product, changed, UPDATED_FIELDS)
+            missing, adjusted = self.adjust_stock(changed, stock_changes, now)
+            stocks += missing
+            moved += [(stock.product, stock.quantity_in_stock) for stock in missing] + adjusted
+            invalidate_products(*[product.pk for product in changed])
+
+        Purchase.objects.bulk_create(purchases)
+        Stock.objects.bulk_create(stocks)
+        self.record_movements(moved, purchases, now)
+        self.result.created += len(new)
+        self.result.updated += len(changed)
+
+    def adjust_stock(self, products, changes, now):
+        """
+        Apply quantity changes to each product's first stock row, as
+        ``Product.save`` does. Returns the Stock rows still to be created
+        and the ``(product, units)`` actually added to existing rows.
+        """
+        first = {}
+        for stock in Stock.objects.filter(product__in=products).order_by('-pk'):
+            first[stock.product_id] = stock
+
+        updated, missing, adjusted = [], [], []
+        for product in products:
+            stock = first.get(product.pk)
+            if stock is None:
+                missing.append(Stock(product=product, quantity_in_stock=product.quantity))
+            elif product.pk in changes:
+                before = stock.quantity_in_stock
+                stock.quantity_in_stock = max(0, before + changes[product.pk])
+                stock.date_updated = now
+                updated.append(stock)
+                adjusted.append((product, stock.quantity_in_stock - before))
+        update_rows(Stock, updated, ['quantity_in_stock', 'date_updated'])
+        return missing, adjusted
+
+    def record_movements(self, moved, purchases, now):
+        """Write the stock ledger entries of ``(product, units)``, as ``Product.save`` does."""
+        purchased = {purchase.product_id: purchase for purchase in purchases}
+        movements = []
+        for product, quantity in moved:
+            if not quantity:
+                continue
+            purchase = purchased.get(product.pk)
+            if purchase is not None and purchase.quantity_purchased != quantity:
+                purchase = None
+            movements.append(StockMovement(
+                product=product,
+                product_pk=product.pk,
+                product_code=product.code,
+                kind=StockMovement.KIND_PURCHASE if purchase else StockMovement.KIND_ADJUSTMENT,
+                quantity=quantity,
+                unit_price=product.price,
+                date=now,
+                purchase=purchase,
+                user=self.user,
+            ))
+        StockMovement.objects.bulk_create(movements)
@@ -0,0 +1,106 @@
+"""
+Stock history: an append-only ledger of movements plus periodic snapshots.
+
+Every write path that changes ``Stock.quantity_in_stock`` also records a
+``StockMovement`` in the same transaction (``record``): ``Product.save``,
+payments (``reduce_stock_on_payment``), the stock admin and the catalog
+importer. ``take_snapshot`` (``manage.py snapshot_stock``, run daily from
+cron) stores every product's level together with the last movement it
+includes.
+
+``inventory_at`` answers "what did we hold at ``moment``" from the latest
+snapshot before it and the movements recorded between the two, so its cost
+is bounded by the snapshot interval rather than the length of the history.
+"""
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Max, Sum
+from django.utils import timezone
+
+from .models import Stock, StockMovement, StockSnapshot, StockSnapshotItem
+
+
+def record(product, kind, quantity, **fields):
+    """Record a change of ``quantity`` units (negative for removals) of ``product``'s stock."""
+    if quantity:
+        return StockMovement.objects.create(
+            product=product, kind=kind, quantity=quantity, unit_price=product.price, **fields
+        )
+
+
+def take_snapshot():
+    """Store every product's current stock level; returns the snapshot."""
+    with transaction.atomic():
+        # Write first: on SQLite this takes the write lock, so no movement
+        # can commit between reading the last movement and the stock.
+        snapshot = StockSnapshot.objects.create()
+        snapshot.last_movement_id = StockMovement.objects.aggregate(last=Max('pk'))['last'] or 0
+        snapshot.save(update_fields=['last_movement_id'])
+        levels = Stock.objects.values('product', 'product__code', 'product__price').annotate(
+            quantity=Sum('quantity_in_stock')
+        )
+        StockSnapshotItem.objects.bulk_create(
+            [
+                StockSnapshotItem(
+                    snapshot=snapshot, product_id=level['product'], product_pk=level['product'],
+                    product_code=level['product__code'], quantity=level['quantity'],
+                    unit_price=level['product__price'],
+                )
+                for level in levels.order_by().iterator()
+            ],
+            batch_size=1000,
+        )
+    return snapshot
+
+
+class Holding:
+    def __init__(self, quantity, unit_price):
+        self.quantity = quantity
+        self.unit_price = unit_price
+
+    def __repr__(self):
+        return f'Holding({self.quantity}, {self.unit_price})'
+
+    @property
+    def value(self):
+        return self.quantity * self.unit_price
+
+
+def inventory_at(moment=None, products=None):
+    """
+    ``{product_id: Holding}`` of the stock at ``moment`` (default now), for
+    all products or those in ``products`` (ids). Holdings are valued at the
+    product's price at that time. Raises ``ValueError`` for moments before
+    the first snapshot, from when there is no history.
+    """
+    moment = moment or timezone.now()
+    snapshot = StockSnapshot.objects.filter(taken_at__lte=moment).order_by('-taken_at').first()
+    if snapshot is None:
+        raise ValueError(f"No stock history before {moment}.")
+    items = snapshot.items.all()
+    movements = StockMovement.objects.filter(pk__gt=snapshot.last_movement_id, date__lte=moment)
+    if products is not None:
+        items = items.filter(product_pk__in=products)
+        movements = movements.filter(product_pk__in=products)
+
+    # By product_pk, so products deleted since still count at that time.
+    holdings = {
+        product_id: Holding(quantity, unit_price)
+        for product_id, quantity, unit_price in items.values_list('product_pk', 'quantity', 'unit_price')
+    }
+    fields = ('product_pk', 'quantity', 'unit_price')
+    for product_id, quantity, unit_price in movements.order_by('pk').values_list(*fields):
+        holding = holdings.setdefault(product_id, Holding(0, unit_price))
+        holding.quantity += quantity
+        holding.unit_price = unit_price
+    return holdings
+
+
+def valuation_at(moment=None, products=None):
+    """Total units and value of the stock at ``moment``."""
+    holdings = inventory_at(moment, products).values()
+    return {
+        'quantity': sum(holding.quantity for holding in holdings),
+        'value': sum((holding.value for holding in holdings), Decimal(0)),
+    }
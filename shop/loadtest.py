@@ -0,0 +1,178 @@
+"""
+HTTP load tests of the order funnel and the catalog API.
+
+``run()`` drives a running server with ``concurrency`` parallel clients
+per scenario and summarises latency percentiles, throughput and, when the
+server sets ``QUERY_COUNT_HEADER``, queries per request. ``compare()``
+checks two such summaries for regressions.
+"""
+import asyncio
+import itertools
+import math
+import re
+import time
+from itertools import cycle
+
+import httpx
+
+SCENARIOS = ['products', 'orders', 'webapp', 'order', 'payment']
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of ``values``, or ``None`` if empty."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(pct / 100 * len(ordered)) - 1)]
+
+
+def summarize(latencies, queries, errors, elapsed):
+    milliseconds = [latency * 1000 for latency in latencies]
+    return {
+        'requests': len(latencies) + errors,
+        'errors': errors,
+        'error_rate': errors / (len(latencies) + errors) if latencies or errors else 0.0,
+        'seconds': elapsed,
+        'throughput_rps': len(latencies) / elapsed if elapsed else 0.0,
+        'mean_ms': sum(milliseconds) / len(milliseconds) if milliseconds else None,
+        'p50_ms': percentile(milliseconds, 50),
+        'p95_ms': percentile(milliseconds, 95),
+        'p99_ms': percentile(milliseconds, 99),
+        'queries_mean': sum(queries) / len(queries) if queries else None,
+        'queries_max': max(queries) if queries else None,
+    }
+
+
+class Funnel:
+    """Requests of each scenario, cycling over existing products and orders."""
+
+    def __init__(self, client, product_ids, order_ids):
+        self.client = client
+        self.product_ids, self.order_ids = product_ids, order_ids
+        self.products = cycle(product_ids)
+        self.orders = cycle(order_ids)
+        self.phone_numbers = itertools.count()
+        # CSRF_COOKIE_SECURE keeps the client from sending the cookie over
+        # plain HTTP, so it is passed explicitly.
+        self.csrf_token = client.cookies.get('csrftoken', '')
+
+    @classmethod
+    async def discover(cls, client, sample=200):
+        products = (await client.get('/api/products/', params={'page_size': sample})).raise_for_status()
+        orders = (await client.get('/api/orders/', params={'page_size': sample})).raise_for_status()
+        products, orders = products.json()['results'], orders.json()['results']
+        if not products:
+            raise ValueError("The catalog is empty; run seed_benchmark first.")
+        # The order form needs the CSRF cookie set by the product page.
+        await client.get('/api/webapp/', params={'tgWebAppStartParam': f"product-{products[0]['id']}"})
+        return cls(client, [p['id'] for p in products], [o['id'] for o in orders])
+
+    def products_page(self):
+        return self.client.get('/api/products/')
+
+    def orders_page(self):
+        return self.client.get('/api/orders/')
+
+    def webapp(self):
+        return self.client.get('/api/webapp/', params={'tgWebAppStartParam': f'product-{next(self.products)}'})
+
+    def order(self):
+        return self.client.post(
+            '/api/webapp/',
+            params={'tgWebAppStartParam': f'product-{next(self.products)}'},
+            data={
+                'full_name': 'Load test', 'address': 'Bole', 'quantity': 1, 'payment_method': 'cbe',
+                'phone_number': f'09{next(self.phone_numbers) % 10 ** 8:08d}',
+            },
+            headers={'X-CSRFToken': self.csrf_token, 'Cookie': f'csrftoken={self.csrf_token}'},
+        )
+
+    def payment(self):
+        return self.client.get(f'/api/payment/{next(self.orders)}/')
+
+    def request(self, scenario):
+        return {
+            'products': self.products_page, 'orders': self.orders_page, 'webapp': self.webapp,
+            'order': self.order, 'payment': self.payment,
+        }[scenario]()
+
+
+async def run_scenario(funnel, scenario, requests, concurrency):
+    latencies, queries = [], []
+    errors = 0
+    remaining = itertools.count(requests, -1)
+
+    async def worker():
+        nonlocal errors
+        while next(remaining) > 0:
+            start = time.perf_counter()
+            try:
+                response = await funnel.request(scenario)
+            except httpx.HTTPError:
+                errors += 1
+                continue
+            if response.status_code >= 400:
+                errors += 1
+                continue
+            latencies.append(time.perf_counter() - start)
+            if 'X-Query-Count' in response.headers:
+                queries.append(int(response.headers['X-Query-Count']))
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return summarize(latencies, queries, errors, time.perf_counter() - start)
+
+
+async def run(base_url, scenarios=SCENARIOS, requests=500, concurrency=10, timeout=30.0):
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=timeout) as client:
+        funnel = await Funnel.discover(client)
+        if 'payment' in scenarios and not funnel.order_ids:
+            raise ValueError("There are no orders to pay; seed some or run the 'order' scenario first.")
+        results = {}
+        for scenario in scenarios:
+            results[scenario] = await run_scenario(funnel, scenario, requests, concurrency)
+        return results
+
+
+# Metric -> the direction in which it gets worse.
+METRICS = {
+    'p50_ms': 'up',
+    'p95_ms': 'up',
+    'p99_ms': 'up',
+    'throughput_rps': 'down',
+    'queries_mean': 'up',
+    'error_rate': 'up',
+}
+# Compared as absolute differences, and any increase is a regression.
+ABSOLUTE_METRICS = ('queries_mean', 'error_rate')
+
+
+def compare(before, after, threshold=0.10):
+    """
+    Return ``(scenario, metric, before, after, change, regressed)`` rows for
+    the scenarios in both runs. Query counts and error rates regress on any
+    increase (``change`` is then absolute); the timings only beyond
+    ``threshold`` (a fraction) to allow for noise.
+    """
+    rows = []
+    for scenario in sorted(set(before) & set(after)):
+        for metric, worse in METRICS.items():
+            old, new = before[scenario].get(metric), after[scenario].get(metric)
+            if old is None or new is None:
+                continue
+            if metric in ABSOLUTE_METRICS:
+                change, allowed = new - old, 0.0
+            else:
+                change, allowed = (new - old) / old if old else 0.0, threshold
+            regressed = change > allowed if worse == 'up' else change < -allowed
+            rows.append((scenario, metric, old, new, change, regressed))
+    return rows
+
+
+def parse_size(value):
+    """``'1k'`` -> 1000, ``'1m'`` -> 1000000, ``'2500'`` -> 2500."""
+    match = re.fullmatch(r'(\d+)([km]?)', value.strip().lower())
+    if not match:
+        raise ValueError(f"Invalid size: {value!r}")
+    return int(match.group(1)) * {'': 1, 'k': 1000, 'm': 1000000}[match.group(2)]
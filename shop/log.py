@@ -0,0 +1,108 @@
+"""
+Logging helpers for the production profile in ``settings.LOGGING``.
+
+``QueueHandler`` returns as soon as a record is queued; a background thread
+formats it and writes it to the target handler (a rotating file). Records
+are formatted only there, so a request pays for creating the record and
+nothing else. ``SamplingFilter`` keeps a fraction of high-volume, low-level
+messages, and ``JsonFormatter`` writes one JSON object per line, including
+any ``extra`` fields.
+"""
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+from datetime import datetime, timezone
+
+from django.utils.module_loading import import_string
+
+# Attributes every LogRecord has; anything else came from ``extra``.
+RECORD_ATTRIBUTES = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in RECORD_ATTRIBUTES and not key.startswith('_'):
+                entry[key] = value
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        if record.stack_info:
+            entry['stack'] = self.formatStack(record.stack_info)
+        return json.dumps(entry, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Pass a ``rate`` fraction of the records below ``level``; records at or
+    above it always pass. Kept records carry ``sample_rate`` so counts can
+    be scaled back up.
+    """
+
+    def __init__(self, rate=0.1, level='WARNING'):
+        super().__init__()
+        self.rate = float(rate)
+        self.level = logging.getLevelName(level) if isinstance(level, str) else level
+
+    def filter(self, record):
+        if record.levelno >= self.level:
+            return True
+        if random.random() >= self.rate:
+            return False
+        record.sample_rate = self.rate
+        return True
+
+
+class QueueHandler(logging.handlers.QueueHandler):
+    """
+    Queue records for ``target``, a handler built from a dictConfig-style
+    dict (``class`` plus its arguments) and run by a ``QueueListener``
+    thread. When the queue is full, records are dropped rather than
+    blocking the caller; the next record written says how many.
+    """
+
+    def __init__(self, target, maxsize=10000):
+        super().__init__(queue.Queue(maxsize))
+        target = dict(target)
+        filename = target.get('filename')
+        if filename:
+            os.makedirs(os.path.dirname(os.path.abspath(filename)), exist_ok=True)
+        self.target = import_string(target.pop('class'))(**target)
+        self.dropped = 0
+        self.listener = logging.handlers.QueueListener(self.queue, self.target, respect_handler_level=True)
+        self.listener.start()
+        atexit.register(self.close)
+
+    def setFormatter(self, fmt):
+        # Formatting happens in the listener thread, on the target.
+        self.target.setFormatter(fmt)
+
+    def prepare(self, record):
+        # The base class formats the record here, on the caller's thread.
+        return record
+
+    def enqueue(self, record):
+        if self.dropped:
+            record.dropped_before = self.dropped
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+        else:
+            self.dropped = 0
+
+    def close(self):
+        if self.listener is not None:
+            self.listener.stop()
+            self.listener = None
+            self.target.close()
+        super().close()
@@ -0,0 +1,38 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from shop import loadtest
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare two benchmark_http results and fail if the second regressed: latency or throughput "
+        "worse by more than the threshold, or more queries per request."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('before')
+        parser.add_argument('after')
+        parser.add_argument('--threshold', type=float, default=10.0, help="Allowed timing change, in percent.")
+
+    def handle(self, *args, **options):
+        before, after = (self.load(options[name]) for name in ('before', 'after'))
+        rows = loadtest.compare(before['scenarios'], after['scenarios'], options['threshold'] / 100)
+
+        for scenario, metric, old, new, change, regressed in rows:
+            shown = f"{change:+8.2f}" if metric in loadtest.ABSOLUTE_METRICS else f"{change:+8.1%}"
+            line = f"{scenario:<10} {metric:<15} {old:10.2f} -> {new:10.2f}  {shown}"
+            self.stdout.write(self.style.ERROR(f"{line}  REGRESSION") if regressed else line)
+
+        regressions = [row for row in rows if row[-1]]
+        if regressions:
+            raise CommandError(f"{len(regressions)} regression(s) between {options['before']} and {options['after']}.")
+        self.stdout.write(self.style.SUCCESS("No regressions."))
+
+    def load(self, path):
+        try:
+            with open(path) as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            raise CommandError(f"Cannot read {path}: {e}")
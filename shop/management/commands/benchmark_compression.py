@@ -0,0 +1,65 @@
+import json
+import statistics
+import time
+
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.test import Client
+
+from shop.bench import rolled_back, seed_catalog
+
+# name -> Accept-Encoding
+ENCODINGS = {'identity': '', 'gzip': 'gzip', 'br': 'br, gzip'}
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure bytes on the wire and CPU per request of the product list for each encoding, "
+        "compressing every request (cold) and from the compressed-body cache (warm). "
+        "Seeded rows are rolled back."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=1000)
+        parser.add_argument('--page-size', type=int, action='append', help="Page size (repeatable). Default 50, 200.")
+        parser.add_argument('--repeat', type=int, default=20)
+        parser.add_argument('--json', help="Also write the results to this file.")
+
+    def handle(self, *args, **options):
+        client = Client(HTTP_HOST='localhost')
+        results = []
+        with rolled_back():
+            seed_catalog(options['products'])
+            self.stdout.write(f"{'page':>5} {'encoding':<9} {'bytes':>8} {'ratio':>6} {'cold cpu ms':>12} {'warm cpu ms':>12}")
+            for page_size in options['page_size'] or [50, 200]:
+                path = f'/api/products/?page_size={page_size}'
+                plain = None
+                for name, accept in ENCODINGS.items():
+                    cold = self.cpu_per_request(client, path, accept, options['repeat'], clear=True)
+                    warm = self.cpu_per_request(client, path, accept, options['repeat'], clear=False)
+                    size = len(client.get(path, HTTP_ACCEPT_ENCODING=accept).content)
+                    plain = plain or size
+                    results.append({
+                        'page_size': page_size, 'encoding': name, 'bytes': size,
+                        'cold_cpu_ms': cold, 'warm_cpu_ms': warm,
+                    })
+                    self.stdout.write(
+                        f"{page_size:>5} {name:<9} {size:>8} {size / plain:>6.2f} {cold:>12.2f} {warm:>12.2f}"
+                    )
+        cache.clear()
+
+        if options['json']:
+            with open(options['json'], 'w') as f:
+                json.dump(results, f, indent=2)
+
+    def cpu_per_request(self, client, path, accept, repeat, clear):
+        """Median CPU milliseconds of this process per request."""
+        timings = []
+        client.get(path, HTTP_ACCEPT_ENCODING=accept)
+        for _ in range(repeat):
+            if clear:
+                cache.clear()
+            start = time.process_time()
+            client.get(path, HTTP_ACCEPT_ENCODING=accept)
+            timings.append(time.process_time() - start)
+        return statistics.median(timings) * 1000
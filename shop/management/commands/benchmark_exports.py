@@ -0,0 +1,74 @@
+import json
+import tempfile
+
+from django.core.management.base import BaseCommand
+from openpyxl import Workbook
+
+from shop import exports
+from shop.bench import format_bytes, measure, rolled_back, seed_catalog, seed_orders
+from shop.models import Order
+
+
+def legacy_excel(queryset, target):
+    """The export as it used to be written: full Workbook, one lookup per row."""
+    workbook = Workbook()
+    worksheet = workbook.active
+    worksheet.title = 'Orders'
+    worksheet.append(exports.ORDERS.headers)
+    for order in queryset:
+        worksheet.append([
+            order.product.name, order.full_name, order.address, order.phone_number, order.comment,
+            order.quantity, order.order_date.replace(tzinfo=None), order.is_paid,
+        ])
+    workbook.save(target)
+
+
+def streamed_excel(queryset, target):
+    exports.write_xlsx(target, exports.ORDERS.title, exports.ORDERS.headers, exports.ORDERS.rows(queryset))
+
+
+def streamed_csv(queryset, target):
+    for chunk in exports.export_csv(queryset, exports.ORDERS).streaming_content:
+        target.write(chunk)
+
+
+class Command(BaseCommand):
+    help = "Measure time, queries and peak memory of the order exports. Seeded rows are rolled back."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, nargs='+', default=[10000, 100000, 500000])
+        parser.add_argument('--products', type=int, default=500)
+        parser.add_argument(
+            '--legacy-max-rows', type=int, default=100000,
+            help="Skip the old in-memory Excel export above this many rows.",
+        )
+        parser.add_argument('--no-memory', action='store_true', help="Skip tracemalloc (faster, no peak memory).")
+        parser.add_argument('--json', help="Also write the results to this file.")
+
+    def handle(self, *args, **options):
+        results = []
+        for rows in options['rows']:
+            with rolled_back():
+                self.stdout.write(f"Seeding {rows} orders...")
+                seed_orders(rows, seed_catalog(options['products']))
+                queryset = Order.objects.all()
+
+                cases = [('csv (streamed)', streamed_csv), ('excel (write-only)', streamed_excel)]
+                if rows <= options['legacy_max_rows']:
+                    cases.append(('excel (legacy)', legacy_excel))
+
+                for name, func in cases:
+                    with tempfile.TemporaryFile() as target:
+                        _, stats = measure(func, queryset, target, trace_memory=not options['no_memory'])
+                        stats['file_bytes'] = target.tell()
+                    stats.update(export=name, rows=rows)
+                    results.append(stats)
+                    self.stdout.write(
+                        f"{rows:>8} rows  {name:<20} {stats['seconds']:8.2f}s  "
+                        f"{stats['queries']:>7} queries  peak {format_bytes(stats['peak_bytes']):>11}  "
+                        f"file {format_bytes(stats['file_bytes'])}"
+                    )
+
+        if options['json']:
+            with open(options['json'], 'w') as f:
+                json.dump(results, f, indent=2)
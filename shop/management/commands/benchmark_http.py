@@ -0,0 +1,99 @@
+import json
+import os
+import subprocess
+import sys
+import time
+from urllib.parse import urlsplit
+
+import httpx
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from shop import loadtest
+from shop.models import Order, Product
+
+
+class Command(BaseCommand):
+    help = (
+        "Load-test the order funnel and catalog API over HTTP and record p50/p95/p99 latency, "
+        "throughput and queries per request. Seed data with seed_benchmark first."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--base-url', default='http://localhost:8000')
+        parser.add_argument('--scenario', action='append', choices=loadtest.SCENARIOS,
+                            help="Scenario to run (repeatable). Defaults to all of them.")
+        parser.add_argument('--requests', type=int, default=500, help="Requests per scenario.")
+        parser.add_argument('--concurrency', type=int, default=10)
+        parser.add_argument('--start-server', action='store_true',
+                            help="Start a server on the --base-url port, with query count headers, for the run.")
+        parser.add_argument('--server', choices=['runserver', 'wsgi', 'asgi'], default='runserver',
+                            help="What --start-server runs; wsgi and asgi use the start.sh profiles.")
+        parser.add_argument('--workers', type=int, default=2, help="Worker processes for --server wsgi/asgi.")
+        parser.add_argument('--label', default='', help="Free text stored with the results, e.g. a commit.")
+        parser.add_argument('--json', help="Write the results to this file.")
+
+    def handle(self, *args, **options):
+        server = None
+        if options['start_server']:
+            server = self.start_server(options['base_url'], options['server'], options['workers'])
+        try:
+            results = async_to_sync(loadtest.run)(
+                options['base_url'], options['scenario'] or loadtest.SCENARIOS,
+                options['requests'], options['concurrency'],
+            )
+        except (ValueError, httpx.HTTPError) as e:
+            raise CommandError(e)
+        finally:
+            if server:
+                server.terminate()
+                server.wait()
+
+        self.stdout.write(f"{'scenario':<10} {'req/s':>8} {'p50':>8} {'p95':>8} {'p99':>8} {'queries':>8} {'errors':>6}")
+        for scenario, stats in results.items():
+            self.stdout.write(
+                f"{scenario:<10} {stats['throughput_rps']:8.1f} {column(stats['p50_ms'])} {column(stats['p95_ms'])} "
+                f"{column(stats['p99_ms'])} {column(stats['queries_mean'])} {stats['errors']:>6}"
+            )
+
+        if options['json']:
+            report = {
+                'label': options['label'],
+                'date': timezone.now().isoformat(),
+                'base_url': options['base_url'],
+                'requests': options['requests'],
+                'concurrency': options['concurrency'],
+                'server': options['server'] if options['start_server'] else None,
+                'products': Product.objects.count(),
+                'orders': Order.objects.count(),
+                'scenarios': results,
+            }
+            with open(options['json'], 'w') as f:
+                json.dump(report, f, indent=2)
+
+    def start_server(self, base_url, kind, workers):
+        address = urlsplit(base_url).netloc
+        env = dict(os.environ, QUERY_COUNT_HEADER='1')
+        if kind == 'runserver':
+            command = [sys.executable, os.path.join(settings.BASE_DIR, 'manage.py'), 'runserver', '--noreload', address]
+        else:
+            command = [os.path.join(settings.BASE_DIR, 'start.sh')]
+            env.update(SERVER=kind, BIND=address, WEB_CONCURRENCY=str(workers))
+        server = subprocess.Popen(
+            command, cwd=settings.BASE_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        )
+        deadline = time.monotonic() + 30
+        while time.monotonic() < deadline:
+            try:
+                httpx.get(f'{base_url}/api/products/', params={'page_size': 1})
+                return server
+            except httpx.TransportError:
+                time.sleep(0.2)
+        server.terminate()
+        raise CommandError(f"The server at {base_url} did not start.")
+
+
+def column(value):
+    return f"{value:8.1f}" if value is not None else f"{'-':>8}"
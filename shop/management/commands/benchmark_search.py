@@ -0,0 +1,75 @@
+import json
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+
+from shop import search
+from shop.bench import rolled_back, seed_catalog
+from shop.models import Product
+
+QUERIES = ['phone', 'ultra charger', 'titanium watch', 'air earb', 'BENCH-4242', 'pink power bank 12']
+
+
+def like_search(query):
+    """What the admin did before: every word icontains any search field."""
+    condition = Q()
+    for term in query.split():
+        condition &= Q(code__icontains=term) | Q(name__icontains=term) | Q(price__icontains=term) \
+            | Q(date_added__icontains=term)
+    return list(Product.objects.filter(condition).values_list('pk', flat=True)[:20])
+
+
+def fts_search(query):
+    return search.ranked_ids(query, 20)
+
+
+def fts_filter_count(query):
+    return search.filter_products(Product.objects.all(), query).count()
+
+
+def like_filter_count(query):
+    condition = Q()
+    for term in query.split():
+        condition &= Q(code__icontains=term) | Q(name__icontains=term) | Q(price__icontains=term) \
+            | Q(date_added__icontains=term)
+    return Product.objects.filter(condition).count()
+
+
+class Command(BaseCommand):
+    help = "Compare full-text product search with the old LIKE search. Seeded rows are rolled back."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=100000)
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--query', action='append', help="Query to time (repeatable).")
+        parser.add_argument('--json', help="Also write the results to this file.")
+
+    def handle(self, *args, **options):
+        if not search.is_available():
+            self.stderr.write("The FTS5 index is not available on this database; run migrations on SQLite.")
+            return
+
+        results = []
+        with rolled_back():
+            self.stdout.write(f"Seeding {options['products']} products...")
+            seed_catalog(options['products'])
+
+            for query in options['query'] or QUERIES:
+                for name, func in [
+                    ('like top 20', like_search), ('fts top 20', fts_search),
+                    ('like count', like_filter_count), ('fts count', fts_filter_count),
+                ]:
+                    timings = []
+                    for _ in range(options['repeat']):
+                        start = time.perf_counter()
+                        func(query)
+                        timings.append(time.perf_counter() - start)
+                    median = statistics.median(timings) * 1000
+                    results.append({'query': query, 'method': name, 'median_ms': median})
+                    self.stdout.write(f"{query!r:<24} {name:<12} {median:9.2f} ms")
+
+        if options['json']:
+            with open(options['json'], 'w') as f:
+                json.dump(results, f, indent=2)
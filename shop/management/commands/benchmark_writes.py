@@ -0,0 +1,146 @@
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError, connection
+
+from shop import db, loadtest
+from shop.bench import seed_catalog
+from shop.models import Order, Product
+
+# name -> (SQLITE_PROFILE, SQLITE_WRITE_QUEUE)
+PROFILES = {
+    'default': ('default', '0'),
+    'production': ('production', '0'),
+    'production+queue': ('production', '1'),
+}
+
+
+def pay(pk):
+    # As the admin does: read the order, then save it, in one transaction.
+    order = Order.objects.select_related('product').get(pk=pk)
+    order.is_paid = True
+    order.save()
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure orders/sec with several processes creating and paying orders at once, "
+        "under each SQLite profile. Runs on scratch copies of a fresh database."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--profile', action='append', choices=PROFILES,
+                            help="Profile to run (repeatable). Defaults to all of them.")
+        parser.add_argument('--processes', type=int, default=4, help="Worker processes, like gunicorn workers.")
+        parser.add_argument('--threads', type=int, default=4, help="Concurrent clients per process.")
+        parser.add_argument('--orders', type=int, default=100, help="Orders each client creates and pays.")
+        parser.add_argument('--json', help="Write the results to this file.")
+        # Internal: run one worker process against the database in SQLITE_PATH.
+        parser.add_argument('--worker', action='store_true', help="(internal)")
+        parser.add_argument('--prepare', action='store_true', help="(internal)")
+        parser.add_argument('--start-at', type=float, help="(internal)")
+
+    def handle(self, *args, **options):
+        if options['prepare']:
+            call_command('migrate', verbosity=0)
+            seed_catalog(20, stock=10 ** 9)
+            return
+        if options['worker']:
+            return self.work(options)
+
+        workdir = tempfile.mkdtemp(prefix='benchmark_writes-')
+        try:
+            template = os.path.join(workdir, 'template.sqlite3')
+            self.spawn(['--prepare'], template, 'default', '0').check_returncode()
+            results = {}
+            for name in options['profile'] or PROFILES:
+                path = os.path.join(workdir, f'{name}.sqlite3')
+                shutil.copy(template, path)
+                results[name] = self.run_profile(path, *PROFILES[name], options)
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+        clients = options['processes'] * options['threads']
+        self.stdout.write(f"{clients} clients, {clients * options['orders']} orders created and paid per profile.")
+        self.stdout.write(f"{'profile':<18} {'orders/s':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'locked':>7}")
+        for name, stats in results.items():
+            self.stdout.write(
+                f"{name:<18} {stats['throughput_rps']:9.1f} {stats['p50_ms'] or 0:8.1f} "
+                f"{stats['p95_ms'] or 0:8.1f} {stats['p99_ms'] or 0:8.1f} {stats['errors']:>7}"
+            )
+        if options['json']:
+            with open(options['json'], 'w') as f:
+                json.dump({'options': {k: options[k] for k in ('processes', 'threads', 'orders')},
+                           'profiles': results}, f, indent=2)
+
+    def spawn(self, arguments, path, profile, write_queue, capture=False):
+        command = [sys.executable, os.path.join(settings.BASE_DIR, 'manage.py'), 'benchmark_writes', *arguments]
+        env = dict(
+            os.environ, SQLITE_PATH=path, SQLITE_PROFILE=profile, SQLITE_WRITE_QUEUE=write_queue,
+            PYTHONWARNINGS='ignore',
+        )
+        if capture:
+            return subprocess.Popen(command, env=env, stdout=subprocess.PIPE, text=True)
+        return subprocess.run(command, env=env)
+
+    def run_profile(self, path, profile, write_queue, options):
+        start_at = time.time() + 2 + options['processes'] * 0.5  # time for every process to start
+        arguments = ['--worker', '--threads', str(options['threads']), '--orders', str(options['orders']),
+                     '--start-at', str(start_at)]
+        workers = [self.spawn(arguments, path, profile, write_queue, capture=True) for _ in range(options['processes'])]
+        latencies, errors, finished = [], 0, start_at
+        for worker in workers:
+            output, _ = worker.communicate()
+            if worker.returncode:
+                raise CommandError(f"A worker process failed ({profile}, queue={write_queue}).")
+            report = json.loads(output)
+            latencies += report['latencies']
+            errors += report['errors']
+            finished = max(finished, report['finished'])
+        return loadtest.summarize(latencies, [], errors, finished - start_at)
+
+    def work(self, options):
+        product_ids = list(Product.objects.values_list('pk', flat=True))
+        connection.close()
+        latencies, errors = [], 0
+        lock = threading.Lock()
+
+        def client(number):
+            nonlocal errors
+            product = Product.objects.get(pk=product_ids[number % len(product_ids)])
+            time.sleep(max(0.0, options['start_at'] - time.time()))
+            for i in range(options['orders']):
+                start = time.perf_counter()
+                try:
+                    order = Order(
+                        product=product, order_type='online', full_name='Benchmark', address='Bole',
+                        phone_number='0911000000', quantity=1, total_price=Decimal(0), payment_method='cbe',
+                    )
+                    db.write(order.save)
+                    db.write(pay, order.pk)
+                except OperationalError:
+                    with lock:
+                        errors += 1
+                    continue
+                with lock:
+                    latencies.append(time.perf_counter() - start)
+            connection.close()
+
+        threads = [
+            threading.Thread(target=client, args=(os.getpid() * 100 + n,)) for n in range(options['threads'])
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.stdout.write(json.dumps({'latencies': latencies, 'errors': errors, 'finished': time.time()}))
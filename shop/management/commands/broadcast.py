@@ -0,0 +1,73 @@
+import asyncio
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from shop.broadcast import BroadcastWorker, create_broadcast
+from shop.models import Broadcast, BroadcastDelivery, BroadcastTarget, Product
+from shop.telegram import TelegramClient
+
+
+class Command(BaseCommand):
+    help = (
+        "Announce products to the subscribed chats, or resume unfinished broadcasts, "
+        "and wait until every post is delivered or has failed."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--product', type=int, action='append', default=[], help="Product id; repeat for more.")
+        parser.add_argument('--chat', action='append', default=[], help="Only send to this chat id; repeat for more.")
+        parser.add_argument('--concurrency', type=int, default=30, help="Parallel Bot API requests.")
+        parser.add_argument('--max-attempts', type=int, default=8, help="Attempts before a post is marked failed.")
+
+    def handle(self, *args, **options):
+        broadcasts = list(Broadcast.objects.filter(date_finished__isnull=True))
+        if options['product']:
+            broadcasts.append(self.create(options))
+        if not broadcasts:
+            self.stdout.write("No unfinished broadcasts; pass --product to start one.")
+            return
+
+        for broadcast in broadcasts:
+            self.stdout.write(f"{broadcast}: {broadcast.deliveries.count()} posts.")
+        try:
+            asyncio.run(self.work(broadcasts, options))
+        except KeyboardInterrupt:
+            self.stdout.write("Interrupted; run the command again to resume.")
+
+        for broadcast in broadcasts:
+            counts = broadcast.counts()
+            self.stdout.write(
+                f"{broadcast}: {counts['sent']} delivered, {counts['failed']} failed, {counts['pending']} pending."
+            )
+
+    def create(self, options):
+        products = Product.objects.filter(pk__in=options['product'])
+        missing = set(options['product']) - set(products.values_list('pk', flat=True))
+        if missing:
+            raise CommandError(f"Unknown product ids: {', '.join(map(str, sorted(missing)))}")
+        targets = None
+        if options['chat']:
+            targets = [
+                BroadcastTarget.objects.get_or_create(chat_id=chat_id)[0] for chat_id in options['chat']
+            ]
+        return create_broadcast(products, targets, requested_by='manage.py broadcast')
+
+    async def work(self, broadcasts, options):
+        client = TelegramClient(max_connections=options['concurrency'])
+        worker = BroadcastWorker(client, concurrency=options['concurrency'], max_attempts=options['max_attempts'])
+        pending = BroadcastDelivery.objects.filter(
+            broadcast__in=broadcasts, status=BroadcastDelivery.STATUS_PENDING
+        )
+        try:
+            while True:
+                await worker.drain()
+                # Throttled and retried posts are due later; sleep until then.
+                upcoming = await pending.order_by('next_attempt_at').afirst()
+                if upcoming is None:
+                    return
+                delay = (upcoming.next_attempt_at - timezone.now()).total_seconds()
+                self.stdout.write(f"{await pending.acount()} posts left.")
+                await asyncio.sleep(min(max(delay, 0.5), 60))
+        finally:
+            await client.aclose()
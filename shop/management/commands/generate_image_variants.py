@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+
+from shop import images
+from shop.models import Product
+
+
+class Command(BaseCommand):
+    help = (
+        "Generate resized variants of product images that have none or outdated ones "
+        "(e.g. images uploaded before variants existed)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help="Regenerate every product's variants.")
+
+    def handle(self, *args, **options):
+        products = Product.objects.exclude(image='').exclude(image__isnull=True).order_by('pk')
+        done = failed = 0
+        for product in products.iterator(chunk_size=200):
+            if images.is_current(product) and not options['all']:
+                continue
+            try:
+                images.generate(product)
+            except Exception as e:
+                failed += 1
+                self.stderr.write(f"Product {product.pk} ({product.image.name}): {e}")
+            else:
+                done += 1
+        self.stdout.write(f"Generated variants for {done} products; {failed} failed.")
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from shop.importer import CatalogImporter, read_rows
+
+
+class Command(BaseCommand):
+    help = "Create or update products from a CSV or XLSX sheet, matched by code."
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--dry-run', action='store_true', help="Validate and report, then roll back.")
+
+    def handle(self, *args, **options):
+        importer = CatalogImporter(batch_size=options['batch_size'], progress=self.report_progress)
+        try:
+            with open(options['path'], 'rb') as f:
+                result = importer.run(read_rows(f, options['path']), dry_run=options['dry_run'])
+        except (OSError, ValueError) as e:
+            raise CommandError(e)
+
+        for line, message in result.errors:
+            self.stderr.write(f"Line {line}: {message}")
+        prefix = "Dry run, nothing saved. " if options['dry_run'] else ""
+        style = self.style.WARNING if result.errors else self.style.SUCCESS
+        self.stdout.write(style(f"{prefix}{result}"))
+
+    def report_progress(self, result):
+        self.stdout.write(f"{result.rows} rows processed...")
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+
+from shop.exports import fail_interrupted_jobs, run_export_job
+from shop.models import ExportJob
+
+
+class Command(BaseCommand):
+    help = "Generate pending background exports (e.g. ones a restarted web worker left behind)."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--requeue-running', action='store_true',
+            help="Also restart jobs stuck in 'running'. Only use when no web worker is generating exports.",
+        )
+        parser.add_argument(
+            '--fail-interrupted', action='store_true',
+            help="Only mark pending and running jobs as failed, as start.sh does before starting the workers.",
+        )
+
+    def handle(self, *args, **options):
+        if options['fail_interrupted']:
+            self.stdout.write(f"Marked {fail_interrupted_jobs()} interrupted export jobs as failed.")
+            return
+        if options['requeue_running']:
+            ExportJob.objects.filter(status=ExportJob.STATUS_RUNNING).update(status=ExportJob.STATUS_PENDING)
+
+        job_ids = list(ExportJob.objects.filter(status=ExportJob.STATUS_PENDING).values_list('pk', flat=True))
+        for job_id in job_ids:
+            run_export_job(job_id)
+            job = ExportJob.objects.get(pk=job_id)
+            self.stdout.write(f"Job {job_id}: {job.status} ({job.row_count} rows)")
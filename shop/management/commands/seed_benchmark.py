@@ -0,0 +1,44 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from shop.bench import seed_catalog, seed_orders
+from shop.loadtest import parse_size
+from shop.models import Category, Order, Product, Stock
+
+
+class Command(BaseCommand):
+    help = (
+        "Seed a benchmark catalog and order book for the load tests (committed, unlike the other "
+        "benchmarks). Sizes accept k/m suffixes: 1k, 100k, 1m."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', default='1k')
+        parser.add_argument('--orders', help="Defaults to the number of products.")
+        parser.add_argument('--clear', action='store_true', help="Remove previously seeded benchmark data first.")
+
+    def handle(self, *args, **options):
+        try:
+            products = parse_size(options['products'])
+            orders = parse_size(options['orders']) if options['orders'] else products
+        except ValueError as e:
+            raise CommandError(e)
+
+        benchmark = Category.objects.filter(name='Benchmark')
+        if options['clear']:
+            with transaction.atomic():
+                for queryset in (
+                    Order.objects.filter(product__category__in=benchmark),
+                    Stock.objects.filter(product__category__in=benchmark),
+                    Product.objects.filter(category__in=benchmark),
+                ):
+                    deleted, _ = queryset.delete()
+                    self.stdout.write(f"Deleted {deleted} {queryset.model._meta.verbose_name_plural}.")
+                benchmark.delete()
+        elif benchmark.exists():
+            raise CommandError("Benchmark data already exists; pass --clear to replace it.")
+
+        with transaction.atomic():
+            self.stdout.write(f"Seeding {products} products and {orders} orders...")
+            seed_orders(orders, seed_catalog(products))
+        self.stdout.write(self.style.SUCCESS("Done."))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from shop.inventory import take_snapshot
+
+
+class Command(BaseCommand):
+    help = (
+        "Store every product's current stock level. Run it regularly (e.g. daily from cron): "
+        "point-in-time inventory reads the latest snapshot plus the movements since."
+    )
+
+    def handle(self, *args, **options):
+        snapshot = take_snapshot()
+        self.stdout.write(f"{snapshot}: {snapshot.items.count()} products.")
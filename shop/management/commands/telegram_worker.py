@@ -0,0 +1,41 @@
+import asyncio
+
+from django.core.management.base import BaseCommand
+
+from shop.outbox import OutboxWorker
+from shop.telegram import TelegramClient
+
+
+class Command(BaseCommand):
+    help = "Deliver queued Telegram posts from the outbox."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help="Drain the due entries and exit.")
+        parser.add_argument('--concurrency', type=int, default=5, help="Parallel Bot API requests.")
+        parser.add_argument('--batch-size', type=int, default=50, help="Entries claimed per round.")
+        parser.add_argument('--poll-interval', type=float, default=2.0, help="Seconds to sleep when idle.")
+        parser.add_argument('--max-attempts', type=int, default=8, help="Attempts before an entry is marked failed.")
+
+    def handle(self, *args, **options):
+        try:
+            asyncio.run(self.work(options))
+        except KeyboardInterrupt:
+            pass
+
+    async def work(self, options):
+        client = TelegramClient(max_connections=options['concurrency'])
+        worker = OutboxWorker(
+            client,
+            concurrency=options['concurrency'],
+            batch_size=options['batch_size'],
+            max_attempts=options['max_attempts'],
+        )
+        try:
+            if options['once']:
+                handled = await worker.drain()
+                self.stdout.write(f"Handled {handled} outbox entries.")
+            else:
+                self.stdout.write("Telegram worker started.")
+                await worker.run(poll_interval=options['poll_interval'])
+        finally:
+            await client.aclose()
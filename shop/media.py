@@ -0,0 +1,149 @@
+"""
+Serving uploaded files (``MEDIA_ROOT``) in production.
+
+``serve`` answers from a ``stat`` of the file: ``ETag`` and
+``Last-Modified`` (in nginx's format, so they match whichever serves the
+file), ``Cache-Control`` for ``MEDIA_CACHE_MAX_AGE`` seconds, 304s for
+revalidations and single byte ranges (``Range``/``If-Range``). How the
+body is sent depends on the server:
+
+- gunicorn sync workers (``SERVER=wsgi``) send it with ``sendfile(2)``,
+  straight from the file to the socket, via ``wsgi.file_wrapper``;
+- uvicorn workers (``SERVER=asgi``, the default) have no sendfile: the file
+  is read and sent in 64 KB chunks from a thread (``FileStreamResponse``),
+  so memory stays bounded but the worker does the copying.
+
+With ``MEDIA_ACCEL_REDIRECT`` set, the response carries no body but an
+``X-Accel-Redirect`` to that prefix instead, and nginx sends the file
+itself, so image traffic never occupies a worker past the ``stat``. That
+is the setup to use in production under either server.
+"""
+import mimetypes
+import os
+import posixpath
+import re
+from stat import S_ISREG
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import Http404, HttpResponse
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, parse_http_date_safe
+
+from .responses import FileStreamResponse
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+class RangeFile:
+    """
+    Reads ``length`` bytes of ``file`` from ``start``. It has a descriptor
+    but no ``tell``, so ``FileResponse`` leaves ``Content-Length`` to the
+    caller. gunicorn's sendfile starts at the descriptor's offset and stops
+    after ``Content-Length`` bytes; everywhere else ``read`` stops there.
+    """
+
+    def __init__(self, file, start, length):
+        file.seek(start)
+        self.file = file
+        self.name = file.name
+        self.remaining = length
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def fileno(self):
+        return self.file.fileno()
+
+    def close(self):
+        self.file.close()
+
+
+def resolve(path):
+    """``path`` normalized, and the absolute path it names under ``MEDIA_ROOT``."""
+    path = posixpath.normpath(path).lstrip('/')
+    try:
+        fullpath = safe_join(settings.MEDIA_ROOT, path)
+    except SuspiciousFileOperation:
+        raise Http404('Not found.')
+    return path, fullpath
+
+
+def byte_range(request, size, etag, last_modified):
+    """
+    ``(start, end)`` (inclusive) of the single range requested, ``None``
+    to send the whole file, or ``False`` if the range cannot be satisfied.
+    Several ranges are answered with the whole file, which RFC 9110 allows.
+    """
+    match = RANGE_RE.match(request.headers.get('Range', '').replace(' ', ''))
+    if not match or not any(match.groups()):
+        return None
+    if_range = request.headers.get('If-Range')
+    if if_range and if_range != etag and parse_http_date_safe(if_range) != int(last_modified):
+        return None
+    first, last = match.groups()
+    if not first:
+        # The last ``last`` bytes.
+        start, end = max(size - int(last), 0), size - 1
+    else:
+        start, end = int(first), min(int(last), size - 1) if last else size - 1
+    if start > end or start >= size:
+        return False
+    return start, end
+
+
+def serve(request, path):
+    path, fullpath = resolve(path)
+    try:
+        stat = os.stat(fullpath)
+    except OSError:
+        raise Http404('Not found.')
+    if not S_ISREG(stat.st_mode):
+        raise Http404('Not found.')
+
+    etag = f'"{int(stat.st_mtime):x}-{stat.st_size:x}"'
+    response = HttpResponse()
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(stat.st_mtime)
+    response['Accept-Ranges'] = 'bytes'
+    patch_cache_control(response, public=True, max_age=settings.MEDIA_CACHE_MAX_AGE)
+    # A 304 (or 412) with these headers, or ``response`` itself if the
+    # client's copy is missing or stale.
+    conditional = get_conditional_response(request, etag=etag, last_modified=int(stat.st_mtime), response=response)
+    if conditional is not response:
+        return conditional
+
+    content_type = mimetypes.guess_type(fullpath)[0] or 'application/octet-stream'
+    if settings.MEDIA_ACCEL_REDIRECT:
+        # nginx sends the file, ranges included, and keeps these headers.
+        response['Content-Type'] = content_type
+        response['X-Accel-Redirect'] = settings.MEDIA_ACCEL_REDIRECT.rstrip('/') + '/' + path
+        return response
+
+    if request.method == 'HEAD':
+        # Range applies to GET only.
+        response['Content-Type'] = content_type
+        response['Content-Length'] = str(stat.st_size)
+        return response
+    span = byte_range(request, stat.st_size, etag, stat.st_mtime)
+    if span is False:
+        response.status_code = 416
+        response['Content-Range'] = f'bytes */{stat.st_size}'
+        return response
+    if span:
+        start, end = span
+        body = FileStreamResponse(
+            RangeFile(open(fullpath, 'rb'), start, end - start + 1), content_type=content_type, status=206
+        )
+        body['Content-Range'] = f'bytes {start}-{end}/{stat.st_size}'
+        body['Content-Length'] = str(end - start + 1)
+    else:
+        body = FileStreamResponse(open(fullpath, 'rb'), content_type=content_type)
+    for header in ('ETag', 'Last-Modified', 'Accept-Ranges', 'Cache-Control'):
+        body[header] = response[header]
+    return body
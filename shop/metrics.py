@@ -0,0 +1,249 @@
+"""
+Per-route request metrics in the Prometheus text format.
+
+``MetricsMiddleware`` records each request into this process's registry:
+a latency histogram, a histogram of database queries, database time,
+response bytes and status codes, per route and method. Queries are counted
+by an execute wrapper installed on every connection, which adds them to the
+request's ``QueryCounter`` found through a context variable, so async views
+are counted without extra thread hops.
+
+Each process writes its totals to ``METRICS_DIR/<pid>-<start>.json`` at most every
+``METRICS_FLUSH_INTERVAL`` seconds; ``render()`` adds up the files of all
+gunicorn workers. Totals of processes that have exited are folded into
+``exited.json`` so the directory does not keep growing and counters never
+go down.
+"""
+import atexit
+import contextvars
+import fcntl
+import json
+import os
+import threading
+import time
+
+from django.conf import settings
+
+from .cache import product_cache_stats
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+EXITED = 'exited.json'
+# Other methods are counted as 'other', so clients cannot add series.
+METHODS = {'GET', 'HEAD', 'POST', 'PUT', 'PATCH', 'DELETE', 'OPTIONS'}
+
+current_queries = contextvars.ContextVar('current_queries', default=None)
+
+
+def count_queries(execute, sql, params, many, context):
+    """Execute wrapper adding the query to the current request's counter."""
+    counter = current_queries.get()
+    if counter is None:
+        return execute(sql, params, many, context)
+    return counter(execute, sql, params, many, context)
+
+
+def install(connection, **kwargs):
+    if count_queries not in connection.execute_wrappers:
+        connection.execute_wrappers.append(count_queries)
+
+
+def new_series():
+    return {
+        'count': 0,
+        'duration': [0] * (len(DURATION_BUCKETS) + 1),
+        'duration_sum': 0.0,
+        'queries': [0] * (len(QUERY_BUCKETS) + 1),
+        'queries_sum': 0,
+        'db_seconds': 0.0,
+        'response_bytes': 0,
+        'statuses': {},
+    }
+
+
+def bucket(buckets, value):
+    for i, bound in enumerate(buckets):
+        if value <= bound:
+            return i
+    return len(buckets)
+
+
+class Registry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.series = {}  # 'route method' -> series
+        self.last_flush = 0.0
+        self.pid = self.filename = None
+
+    def record(self, route, method, status, duration, queries, db_seconds, response_bytes):
+        key = f"{route} {method if method in METHODS else 'other'}"
+        with self.lock:
+            series = self.series.get(key)
+            if series is None:
+                series = self.series[key] = new_series()
+            series['count'] += 1
+            series['duration'][bucket(DURATION_BUCKETS, duration)] += 1
+            series['duration_sum'] += duration
+            series['queries'][bucket(QUERY_BUCKETS, queries)] += 1
+            series['queries_sum'] += queries
+            series['db_seconds'] += db_seconds
+            series['response_bytes'] += response_bytes
+            status = str(status)
+            series['statuses'][status] = series['statuses'].get(status, 0) + 1
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                'series': json.loads(json.dumps(self.series)),
+                'cache': product_cache_stats(),
+            }
+
+    def maybe_flush(self):
+        if settings.METRICS_DIR and time.monotonic() - self.last_flush >= settings.METRICS_FLUSH_INTERVAL:
+            self.flush()
+
+    def flush(self):
+        """Write this process's totals to its file in ``METRICS_DIR``."""
+        if not settings.METRICS_DIR:
+            return
+        if self.pid != os.getpid():
+            # The start time keeps a reused pid from overwriting an old file.
+            self.pid = os.getpid()
+            self.filename = f'{self.pid}-{time.time_ns()}.json'
+        self.last_flush = time.monotonic()
+        os.makedirs(settings.METRICS_DIR, exist_ok=True)
+        write_json(os.path.join(settings.METRICS_DIR, self.filename), self.snapshot())
+
+
+registry = Registry()
+atexit.register(registry.flush)
+
+
+def write_json(path, data):
+    temporary = f'{path}.tmp'
+    with open(temporary, 'w') as f:
+        json.dump(data, f)
+    os.replace(temporary, path)
+
+
+def read_json(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def is_running(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def merge(total, snapshot):
+    for key, series in snapshot.get('series', {}).items():
+        into = total['series'].setdefault(key, new_series())
+        for name in ('count', 'duration_sum', 'queries_sum', 'db_seconds', 'response_bytes'):
+            into[name] += series[name]
+        for name in ('duration', 'queries'):
+            into[name] = [a + b for a, b in zip(into[name], series[name])]
+        for status, count in series['statuses'].items():
+            into['statuses'][status] = into['statuses'].get(status, 0) + count
+    for name, count in snapshot.get('cache', {}).items():
+        total['cache'][name] = total['cache'].get(name, 0) + count
+    return total
+
+
+def collect():
+    """Totals of every process sharing ``METRICS_DIR`` (or just this one)."""
+    if not settings.METRICS_DIR:
+        return registry.snapshot()
+    registry.flush()
+    directory = settings.METRICS_DIR
+    with open(os.path.join(directory, '.lock'), 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        total = read_json(os.path.join(directory, EXITED)) or {'series': {}, 'cache': {}}
+        exited = []
+        for name in os.listdir(directory):
+            pid = name.split('-')[0]
+            if not name.endswith('.json') or not pid.isdigit():
+                continue
+            snapshot = read_json(os.path.join(directory, name))
+            if snapshot is None:
+                continue
+            merge(total, snapshot)
+            if not is_running(int(pid)):
+                exited.append(name)
+        if exited:
+            archived = read_json(os.path.join(directory, EXITED)) or {'series': {}, 'cache': {}}
+            for name in exited:
+                merge(archived, read_json(os.path.join(directory, name)))
+            write_json(os.path.join(directory, EXITED), archived)
+            for name in exited:
+                os.remove(os.path.join(directory, name))
+    return total
+
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def labels(**values):
+    return ','.join(f'{name}="{escape(value)}"' for name, value in values.items())
+
+
+def histogram_lines(name, route, method, buckets, counts, total, count):
+    cumulative = 0
+    for bound, bucket_count in zip([*buckets, '+Inf'], counts):
+        cumulative += bucket_count
+        yield f'{name}_bucket{{{labels(route=route, method=method, le=bound)}}} {cumulative}'
+    yield f'{name}_sum{{{labels(route=route, method=method)}}} {total}'
+    yield f'{name}_count{{{labels(route=route, method=method)}}} {count}'
+
+
+def render(totals=None):
+    totals = collect() if totals is None else totals
+    series = sorted((key.rsplit(' ', 1), value) for key, value in totals['series'].items())
+    lines = [
+        '# HELP shop_http_requests_total Requests by route, method and status.',
+        '# TYPE shop_http_requests_total counter',
+    ]
+    for (route, method), s in series:
+        for status, count in sorted(s['statuses'].items()):
+            lines.append(f'shop_http_requests_total{{{labels(route=route, method=method, status=status)}}} {count}')
+
+    lines += [
+        '# HELP shop_http_request_duration_seconds Time from the first middleware to the response.',
+        '# TYPE shop_http_request_duration_seconds histogram',
+    ]
+    for (route, method), s in series:
+        lines += histogram_lines('shop_http_request_duration_seconds', route, method, DURATION_BUCKETS,
+                                 s['duration'], s['duration_sum'], s['count'])
+
+    lines += [
+        '# HELP shop_db_queries Database queries per request.',
+        '# TYPE shop_db_queries histogram',
+    ]
+    for (route, method), s in series:
+        lines += histogram_lines('shop_db_queries', route, method, QUERY_BUCKETS,
+                                 s['queries'], s['queries_sum'], s['count'])
+
+    for name, key, help_text in (
+        ('shop_db_query_seconds_total', 'db_seconds', 'Time spent in database queries.'),
+        ('shop_http_response_bytes_total', 'response_bytes', 'Bytes of response bodies.'),
+    ):
+        lines += [f'# HELP {name} {help_text}', f'# TYPE {name} counter']
+        for (route, method), s in series:
+            lines.append(f'{name}{{{labels(route=route, method=method)}}} {s[key]}')
+
+    lines += [
+        '# HELP shop_product_cache_requests_total Product cache lookups by result.',
+        '# TYPE shop_product_cache_requests_total counter',
+    ]
+    for result, count in sorted(totals['cache'].items()):
+        lines.append(f'shop_product_cache_requests_total{{{labels(result=result)}}} {count}')
+    return '\n'.join(lines) + '\n'
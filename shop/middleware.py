@@ -0,0 +1,157 @@
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connection
+from whitenoise.middleware import WhiteNoiseMiddleware
+
+from . import compression, metrics
+from .bench import QueryCounter
+
+
+class QueryCountMiddleware:
+    """
+    Report the number and time of database queries of each response in
+    ``X-Query-Count`` and ``X-Query-Time`` headers, for the load tests.
+    Only installed when ``QUERY_COUNT_HEADER`` is set.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.QUERY_COUNT_HEADER:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        counter = QueryCounter()
+        with connection.execute_wrapper(counter):
+            response = self.get_response(request)
+        return self.add_headers(response, counter)
+
+    async def __acall__(self, request):
+        # Queries run in the request's sync thread, which has its own
+        # connection; install the wrapper there.
+        counter = QueryCounter()
+        await sync_to_async(lambda: connection.execute_wrappers.append(counter))()
+        try:
+            response = await self.get_response(request)
+        finally:
+            await sync_to_async(lambda: connection.execute_wrappers.remove(counter))()
+        return self.add_headers(response, counter)
+
+    def add_headers(self, response, counter):
+        response['X-Query-Count'] = str(counter.count)
+        response['X-Query-Time'] = f'{counter.duration * 1000:.2f}'
+        return response
+
+
+class MetricsMiddleware:
+    """
+    Record every request's latency, queries, response size and status in
+    ``metrics.registry``, served by ``/metrics``. Queries are counted by the
+    wrapper ``metrics.install`` puts on each connection, so this adds no
+    thread hops to async requests. Off when ``METRICS_ENABLED`` is unset.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.METRICS_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        counter = QueryCounter()
+        token = metrics.current_queries.set(counter)
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            metrics.current_queries.reset(token)
+        self.record(request, response, time.perf_counter() - start, counter)
+        return response
+
+    async def __acall__(self, request):
+        counter = QueryCounter()
+        token = metrics.current_queries.set(counter)
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            metrics.current_queries.reset(token)
+        self.record(request, response, time.perf_counter() - start, counter)
+        return response
+
+    def record(self, request, response, duration, counter):
+        match = request.resolver_match
+        if response.streaming:
+            size = int(response.get('Content-Length') or 0)
+        else:
+            size = len(response.content)
+        metrics.registry.record(
+            match.view_name if match else 'unmatched', request.method, response.status_code,
+            duration, counter.count, counter.duration, size,
+        )
+        metrics.registry.maybe_flush()
+
+
+class CompressionMiddleware:
+    """
+    Brotli or gzip for text and JSON responses, by the request's
+    ``Accept-Encoding`` (see ``shop.compression``). Static files are
+    precompressed by WhiteNoise, which answers before this runs.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        return compression.compress_response(request, self.get_response(request))
+
+    async def __acall__(self, request):
+        return compression.compress_response(request, await self.get_response(request))
+
+
+class StaticFilesMiddleware(WhiteNoiseMiddleware):
+    """
+    WhiteNoise that can also run async. WhiteNoise 6.7 is sync-only, so
+    under ASGI Django ran every request's middleware chain in a thread
+    around it, and the async checkout views gained nothing.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response=None, settings=settings):
+        super().__init__(get_response, settings)
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        return super().__call__(request)
+
+    async def __acall__(self, request):
+        if self.autorefresh:
+            static_file = await sync_to_async(self.find_file)(request.path_info)
+        else:
+            static_file = self.files.get(request.path_info)
+        if static_file is not None:
+            return await sync_to_async(self.serve)(static_file, request)
+        return await self.get_response(request)
@@ -0,0 +1,26 @@
+# Generated by Django 5.1.1 on 2026-10-18 00:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0007_telegramoutbox'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TelegramMedia',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('path', models.CharField(max_length=255, unique=True)),
+                ('file_id', models.CharField(max_length=255)),
+                ('date_uploaded', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Telegram Media',
+                'verbose_name_plural': 'Telegram Media',
+            },
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.1.1 on 2026-10-18 01:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0010_api_list_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='stock',
+            name='date_updated',
+            field=models.DateTimeField(auto_now=True, db_index=True),
+        ),
+        migrations.AlterField(
+            model_name='product',
+            name='date_updated',
+            field=models.DateTimeField(auto_now=True, db_index=True),
+        ),
+    ]
@@ -0,0 +1,14 @@
+from django.db import migrations
+
+from shop.migrations import _search_index_0012 as search_index
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0011_catalog_date_updated'),
+    ]
+
+    operations = [
+        migrations.RunPython(search_index.run(search_index.CREATE_SQL), search_index.run(search_index.DROP_SQL)),
+    ]
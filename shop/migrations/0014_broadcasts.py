@@ -0,0 +1,62 @@
+# Generated by Django 5.1.1 on 2026-10-18 01:35
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0013_hot_query_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BroadcastTarget',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('chat_id', models.CharField(max_length=64, unique=True)),
+                ('kind', models.CharField(choices=[('channel', 'Channel'), ('group', 'Group'), ('user', 'User')], default='user', max_length=10)),
+                ('title', models.CharField(blank=True, max_length=255)),
+                ('is_active', models.BooleanField(default=True, help_text='Inactive chats are skipped by new broadcasts.')),
+                ('date_added', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'ordering': ['kind', 'title'],
+            },
+        ),
+        migrations.CreateModel(
+            name='Broadcast',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('requested_by', models.CharField(blank=True, max_length=255)),
+                ('date_created', models.DateTimeField(auto_now_add=True)),
+                ('date_finished', models.DateTimeField(blank=True, null=True)),
+                ('products', models.ManyToManyField(related_name='broadcasts', to='shop.product')),
+            ],
+            options={
+                'ordering': ['-date_created'],
+            },
+        ),
+        migrations.CreateModel(
+            name='BroadcastDelivery',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('sent', 'Sent'), ('failed', 'Failed')], default='pending', max_length=10)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('next_attempt_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('last_error', models.TextField(blank=True, null=True)),
+                ('date_sent', models.DateTimeField(blank=True, null=True)),
+                ('broadcast', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='deliveries', to='shop.broadcast')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='broadcast_deliveries', to='shop.product')),
+                ('target', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='deliveries', to='shop.broadcasttarget')),
+            ],
+            options={
+                'verbose_name_plural': 'Broadcast deliveries',
+                'ordering': ['next_attempt_at', 'id'],
+                'indexes': [models.Index(fields=['status', 'next_attempt_at', 'id'], name='shop_broadc_status_7bebbf_idx')],
+                'constraints': [models.UniqueConstraint(fields=('broadcast', 'target', 'product'), name='unique_broadcast_delivery')],
+            },
+        ),
+    ]
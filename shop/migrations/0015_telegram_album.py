@@ -0,0 +1,19 @@
+# Generated by Django 5.1.1 on 2026-10-18 01:43
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0014_broadcasts'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='telegram',
+            name='album',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='album_posts', to='shop.telegramoutbox'),
+        ),
+    ]
@@ -0,0 +1,94 @@
+# Generated by Django 5.1.1 on 2026-10-18 02:07
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models.functions import TruncDate
+
+# Each rollup's key, in addition to the day.
+KEYS = {
+    'SalesRollup': ('product_id', 'payment_method', 'order_type', 'is_paid'),
+    'DailySales': ('payment_method', 'order_type', 'is_paid'),
+}
+
+
+def backfill(apps, schema_editor):
+    """Sum the existing orders into the new rollups, one row per day and key."""
+    Order = apps.get_model('shop', 'Order')
+    orders = Order.objects.annotate(day=TruncDate('order_date'))
+    for name, key in KEYS.items():
+        rollup = apps.get_model('shop', name)
+        groups = (
+            orders.values('day', *key)
+            .annotate(
+                order_count=models.Count('id'),
+                units=models.Sum('quantity'),
+                sales=models.Sum('total_price'),
+            )
+            .order_by()
+        )
+        rollup.objects.bulk_create(
+            [
+                rollup(
+                    day=group['day'],
+                    **{field: group[field] for field in key},
+                    orders=group['order_count'],
+                    quantity=group['units'],
+                    revenue=group['sales'],
+                )
+                for group in groups.iterator()
+            ],
+            batch_size=1000,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0015_telegram_album'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailySales',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('payment_method', models.CharField(choices=[('chapa', 'Chapa'), ('cbe', 'Commercial Bank of Ethiopia'), ('boa', 'Bank of Abyssinia'), ('awash', 'Awash Bank'), ('enat', 'Enat Bank'), ('dashen', 'Dashen Bank'), ('telebirr', 'Telebirr'), ('cash', 'Cash')], max_length=10)),
+                ('order_type', models.CharField(choices=[('manual', 'manual'), ('online', 'online')], max_length=10)),
+                ('is_paid', models.BooleanField()),
+                ('orders', models.IntegerField(default=0)),
+                ('quantity', models.IntegerField(default=0)),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+            ],
+            options={
+                'verbose_name': 'Daily sales',
+                'verbose_name_plural': 'Daily sales',
+                'ordering': ['-day'],
+                'abstract': False,
+                'constraints': [models.UniqueConstraint(fields=('day', 'payment_method', 'order_type', 'is_paid'), name='daily_sales_key')],
+            },
+        ),
+        migrations.CreateModel(
+            name='SalesRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('payment_method', models.CharField(choices=[('chapa', 'Chapa'), ('cbe', 'Commercial Bank of Ethiopia'), ('boa', 'Bank of Abyssinia'), ('awash', 'Awash Bank'), ('enat', 'Enat Bank'), ('dashen', 'Dashen Bank'), ('telebirr', 'Telebirr'), ('cash', 'Cash')], max_length=10)),
+                ('order_type', models.CharField(choices=[('manual', 'manual'), ('online', 'online')], max_length=10)),
+                ('is_paid', models.BooleanField()),
+                ('orders', models.IntegerField(default=0)),
+                ('quantity', models.IntegerField(default=0)),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('product', models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='sales', to='shop.product')),
+            ],
+            options={
+                'verbose_name': 'Sales summary',
+                'verbose_name_plural': 'Sales summaries',
+                'ordering': ['-day'],
+                'abstract': False,
+                'indexes': [models.Index(fields=['product', 'day'], name='sales_rollup_product_day_idx')],
+                'constraints': [models.UniqueConstraint(fields=('day', 'product', 'payment_method', 'order_type', 'is_paid'), name='sales_rollup_key')],
+            },
+        ),
+        migrations.RunPython(backfill, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,80 @@
+# Generated by Django 5.1.1 on 2026-10-18 02:14
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+def opening_snapshot(apps, schema_editor):
+    # The ledger starts now: record the current levels as its opening balance.
+    Stock = apps.get_model('shop', 'Stock')
+    StockSnapshot = apps.get_model('shop', 'StockSnapshot')
+    StockSnapshotItem = apps.get_model('shop', 'StockSnapshotItem')
+    snapshot = StockSnapshot.objects.create()
+    levels = Stock.objects.values('product', 'product__price').annotate(quantity=models.Sum('quantity_in_stock'))
+    StockSnapshotItem.objects.bulk_create(
+        [
+            StockSnapshotItem(
+                snapshot=snapshot, product_id=level['product'], quantity=level['quantity'],
+                unit_price=level['product__price'],
+            )
+            for level in levels.order_by()
+        ],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0016_sales_rollup'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('taken_at', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+                ('last_movement_id', models.BigIntegerField(default=0)),
+            ],
+            options={
+                'verbose_name': 'Stock snapshot',
+                'verbose_name_plural': 'Stock snapshots',
+                'ordering': ['-taken_at'],
+            },
+        ),
+        migrations.CreateModel(
+            name='StockSnapshotItem',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantity', models.IntegerField()),
+                ('unit_price', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stock_snapshots', to='shop.product')),
+                ('snapshot', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='items', to='shop.stocksnapshot')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='StockMovement',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('purchase', 'Purchase'), ('sale', 'Sale'), ('restock', 'Manual restock'), ('adjustment', 'Adjustment')], max_length=10)),
+                ('quantity', models.IntegerField(help_text='Units added, or removed when negative')),
+                ('unit_price', models.DecimalField(decimal_places=2, help_text='Product price at the time', max_digits=10)),
+                ('date', models.DateTimeField(default=django.utils.timezone.now)),
+                ('order', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='stock_movements', to='shop.order')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stock_movements', to='shop.product')),
+                ('purchase', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='stock_movements', to='shop.purchase')),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Stock movement',
+                'verbose_name_plural': 'Stock movements',
+                'ordering': ['-id'],
+                'indexes': [models.Index(fields=['product', 'id'], name='stock_movement_product_idx'), models.Index(fields=['date'], name='stock_movement_date_idx')],
+            },
+        ),
+        migrations.RunPython(opening_snapshot, migrations.RunPython.noop),
+    ]
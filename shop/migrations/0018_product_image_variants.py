@@ -0,0 +1,24 @@
+# Generated by Django 5.1.1 on 2026-10-18 02:16
+
+from django.db import migrations, models
+
+from shop.migrations import _search_index_0012 as search_index
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0017_stock_ledger'),
+    ]
+
+    # SQLite adds the column by rebuilding shop_product, which the search
+    # index triggers refer to: drop the index and build it again afterwards.
+    operations = [
+        migrations.RunPython(search_index.run(search_index.DROP_SQL), search_index.run(search_index.CREATE_SQL)),
+        migrations.AddField(
+            model_name='product',
+            name='image_variants',
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+        migrations.RunPython(search_index.run(search_index.CREATE_SQL), search_index.run(search_index.DROP_SQL)),
+    ]
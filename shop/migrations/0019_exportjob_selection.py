@@ -0,0 +1,30 @@
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def fail_unfinished_jobs(apps, schema_editor):
+    # Their pickled queries are not carried over.
+    ExportJob = apps.get_model('shop', 'ExportJob')
+    ExportJob.objects.filter(status__in=['pending', 'running']).update(
+        status='failed', error="Interrupted by an upgrade; run the export again.", date_finished=timezone.now(),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0018_product_image_variants'),
+    ]
+
+    operations = [
+        migrations.RunPython(fail_unfinished_jobs, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='exportjob',
+            name='query',
+        ),
+        migrations.AddField(
+            model_name='exportjob',
+            name='selection',
+            field=models.JSONField(default=dict, help_text='Primary keys and ordering of the selected rows'),
+        ),
+    ]
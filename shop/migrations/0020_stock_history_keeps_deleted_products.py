@@ -0,0 +1,69 @@
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def copy_products(apps, schema_editor):
+    Product = apps.get_model('shop', 'Product')
+    code = Subquery(Product.objects.filter(pk=OuterRef('product_id')).values('code')[:1])
+    for name in ('StockMovement', 'StockSnapshotItem'):
+        apps.get_model('shop', name).objects.update(product_pk=models.F('product_id'), product_code=code)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0019_exportjob_selection'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='stockmovement',
+            name='product_pk',
+            field=models.BigIntegerField(null=True, help_text='Id of the product, kept after it is deleted'),
+        ),
+        migrations.AddField(
+            model_name='stockmovement',
+            name='product_code',
+            field=models.CharField(blank=True, max_length=50, null=True),
+        ),
+        migrations.AddField(
+            model_name='stocksnapshotitem',
+            name='product_pk',
+            field=models.BigIntegerField(null=True, help_text='Id of the product, kept after it is deleted'),
+        ),
+        migrations.AddField(
+            model_name='stocksnapshotitem',
+            name='product_code',
+            field=models.CharField(blank=True, max_length=50, null=True),
+        ),
+        migrations.RunPython(copy_products, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='stockmovement',
+            name='product_pk',
+            field=models.BigIntegerField(help_text='Id of the product, kept after it is deleted'),
+        ),
+        migrations.AlterField(
+            model_name='stocksnapshotitem',
+            name='product_pk',
+            field=models.BigIntegerField(help_text='Id of the product, kept after it is deleted'),
+        ),
+        migrations.AlterField(
+            model_name='stockmovement',
+            name='product',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='stock_movements', to='shop.product'),
+        ),
+        migrations.AlterField(
+            model_name='stocksnapshotitem',
+            name='product',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='stock_snapshots', to='shop.product'),
+        ),
+        migrations.RemoveIndex(
+            model_name='stockmovement',
+            name='stock_movement_product_idx',
+        ),
+        migrations.AddIndex(
+            model_name='stockmovement',
+            index=models.Index(fields=['product_pk', 'id'], name='stock_movement_product_idx'),
+        ),
+    ]
@@ -0,0 +1,97 @@
+"""
+The search index SQL as migration 0012 created it, for the migrations that
+create it and that drop and recreate it around a rebuild of ``shop_product``.
+
+Migrations must keep doing what they did when they were written, so this is
+a frozen copy: do not edit it. The index as the app currently expects it
+lives in ``shop.search_index``; a migration that changes it gets its own
+copy of the new SQL.
+"""
+
+PRODUCT_ROW = """
+    SELECT new.id, new.code, new.name, new.description,
+        (SELECT name FROM shop_brand WHERE id = new.brand_id),
+        (SELECT name FROM shop_productmodel WHERE id = new.model_id),
+        (SELECT name FROM shop_category WHERE id = new.category_id)
+"""
+
+CREATE_SQL = [
+    """
+    CREATE VIRTUAL TABLE shop_product_fts USING fts5(
+        code, name, description, brand, model, category,
+        tokenize = 'unicode61 remove_diacritics 2',
+        prefix = '2 3'
+    )
+    """,
+    """
+    INSERT INTO shop_product_fts (rowid, code, name, description, brand, model, category)
+    SELECT p.id, p.code, p.name, p.description, b.name, m.name, c.name
+    FROM shop_product p
+    LEFT JOIN shop_brand b ON b.id = p.brand_id
+    LEFT JOIN shop_productmodel m ON m.id = p.model_id
+    LEFT JOIN shop_category c ON c.id = p.category_id
+    """,
+    f"""
+    CREATE TRIGGER shop_product_fts_insert AFTER INSERT ON shop_product BEGIN
+        INSERT INTO shop_product_fts (rowid, code, name, description, brand, model, category) {PRODUCT_ROW};
+    END
+    """,
+    """
+    CREATE TRIGGER shop_product_fts_delete AFTER DELETE ON shop_product BEGIN
+        DELETE FROM shop_product_fts WHERE rowid = old.id;
+    END
+    """,
+    f"""
+    CREATE TRIGGER shop_product_fts_update AFTER UPDATE OF code, name, description, brand_id, model_id, category_id
+    ON shop_product
+    WHEN old.code IS NOT new.code OR old.name IS NOT new.name OR old.description IS NOT new.description
+        OR old.brand_id IS NOT new.brand_id OR old.model_id IS NOT new.model_id
+        OR old.category_id IS NOT new.category_id
+    BEGIN
+        DELETE FROM shop_product_fts WHERE rowid = old.id;
+        INSERT INTO shop_product_fts (rowid, code, name, description, brand, model, category) {PRODUCT_ROW};
+    END
+    """,
+    """
+    CREATE TRIGGER shop_brand_fts_update AFTER UPDATE OF name ON shop_brand
+    WHEN old.name IS NOT new.name BEGIN
+        UPDATE shop_product_fts SET brand = new.name
+        WHERE rowid IN (SELECT id FROM shop_product WHERE brand_id = new.id);
+    END
+    """,
+    """
+    CREATE TRIGGER shop_productmodel_fts_update AFTER UPDATE OF name ON shop_productmodel
+    WHEN old.name IS NOT new.name BEGIN
+        UPDATE shop_product_fts SET model = new.name
+        WHERE rowid IN (SELECT id FROM shop_product WHERE model_id = new.id);
+    END
+    """,
+    """
+    CREATE TRIGGER shop_category_fts_update AFTER UPDATE OF name ON shop_category
+    WHEN old.name IS NOT new.name BEGIN
+        UPDATE shop_product_fts SET category = new.name
+        WHERE rowid IN (SELECT id FROM shop_product WHERE category_id = new.id);
+    END
+    """,
+]
+
+DROP_SQL = [
+    "DROP TRIGGER IF EXISTS shop_category_fts_update",
+    "DROP TRIGGER IF EXISTS shop_productmodel_fts_update",
+    "DROP TRIGGER IF EXISTS shop_brand_fts_update",
+    "DROP TRIGGER IF EXISTS shop_product_fts_update",
+    "DROP TRIGGER IF EXISTS shop_product_fts_delete",
+    "DROP TRIGGER IF EXISTS shop_product_fts_insert",
+    "DROP TABLE IF EXISTS shop_product_fts",
+]
+
+
+
+def run(statements):
+    """A ``RunPython`` function executing ``statements`` on SQLite only."""
+    def apply(apps, schema_editor):
+        if schema_editor.connection.vendor != 'sqlite':
+            return
+        for statement in statements:
+            schema_editor.execute(statement)
+    return apply
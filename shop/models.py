@@ -1,7 +1,13 @@
+import os
+
 from django.db import models, transaction
+from django.db.models.functions import Coalesce
+from django.utils import timezone
 from datetime import datetime
 from django.contrib.auth.models import User
 from django.core.exceptions import ValidationError
+from django.core.files.storage import FileSystemStorage
+from django.conf import settings
 
 
 # Category model
@@ -72,6 +78,18 @@ class ProductModel(models.Model):
         super(ProductModel, self).save(*args, **kwargs)
 
 
+class ProductQuerySet(models.QuerySet):
+    def with_available_stock(self):
+        """
+        Annotate ``available_stock`` (the product's stock quantity, 0 when it
+        has none) in the same query instead of one lookup per product.
+        """
+        stock = Stock.objects.filter(product=models.OuterRef('pk')).order_by('pk')
+        return self.annotate(
+            available_stock=Coalesce(models.Subquery(stock.values('quantity_in_stock')[:1]), 0)
+        )
+
+
 # Product model
 class Product(models.Model):
     name = models.CharField(max_length=255)
@@ -91,12 +109,22 @@ class Product(models.Model):
     quantity = models.PositiveIntegerField(default=1)
     description = models.TextField(blank=True, null=True)
     image = models.ImageField(upload_to='product_images/', blank=True, null=True)
+    # Resized copies of ``image``, written by images.py.
+    image_variants = models.JSONField(default=dict, blank=True, editable=False)
     price = models.DecimalField(max_digits=10, decimal_places=2)
     date_added = models.DateTimeField(default=datetime.now)
-    date_updated = models.DateTimeField(auto_now=True)
+    date_updated = models.DateTimeField(auto_now=True, db_index=True)
+
+    objects = ProductQuerySet.as_manager()
 
     class Meta:
         ordering = ['-date_added']
+        indexes = [
+            models.Index(fields=['-date_added', '-id'], name='product_date_added_idx'),
+            # The catalog API filters by category or brand and keeps the date ordering.
+            models.Index(fields=['category', '-date_added', '-id'], name='product_category_date_idx'),
+            models.Index(fields=['brand', '-date_added', '-id'], name='product_brand_date_idx'),
+        ]
 
     def __str__(self):
         return self.name
@@ -126,8 +154,9 @@ class Product(models.Model):
             added_quantity = self.quantity - old_quantity
 
             # Create a new Purchase entry for the added quantity (even if updated product)
+            purchase = None
             if added_quantity > 0:
-                Purchase.objects.create(
+                purchase = Purchase.objects.create(
                     product=self,
                     quantity_purchased=added_quantity,  # Track only the additional quantity
                     added_by=kwargs.get('user', None)  # Pass user if applicable
@@ -142,6 +171,19 @@ class Product(models.Model):
 
             stock.save()
 
+            # Record the change in the stock ledger
+            from .inventory import record  # inventory imports these models
+
+            moved = self.quantity if created else added_quantity
+            if purchase is None or moved != added_quantity:
+                purchase = None
+            record(
+                self,
+                StockMovement.KIND_PURCHASE if purchase else StockMovement.KIND_ADJUSTMENT,
+                moved,
+                purchase=purchase,
+            )
+
 
 class Order(models.Model):
     PAYMENT_METHODS = [
@@ -174,22 +216,107 @@ class Order(models.Model):
 
     class Meta:
         ordering = ['-order_date']
+        indexes = [
+            # Trailing -id matches the API's cursor ordering.
+            models.Index(fields=['-order_date', '-id'], name='order_date_idx'),
+            models.Index(fields=['is_paid', '-order_date', '-id'], name='order_paid_date_idx'),
+            models.Index(fields=['order_type', '-order_date', '-id'], name='order_type_date_idx'),
+            models.Index(fields=['product', '-order_date', '-id'], name='order_product_date_idx'),
+        ]
         verbose_name = "Sale"
         verbose_name_plural = "Sales"
 
     def save(self, *args, **kwargs):
         self.total_price = self.product.price * self.quantity
-        super(Order, self).save(*args, **kwargs)
+        with transaction.atomic():
+            # Claim the unpaid -> paid transition in the database, so stock is
+            # taken exactly once however often (or concurrently) the order is
+            # saved as paid. reduce_stock_on_payment acts on this flag.
+            self.paid_now = self.is_paid and (
+                self._state.adding
+                or Order.objects.filter(pk=self.pk, is_paid=False).update(is_paid=True) == 1
+            )
+            super(Order, self).save(*args, **kwargs)
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # What the sales rollup counted for this order; see sales.record_save.
+        instance.loaded_values = dict(zip(field_names, values))
+        return instance
+
+    def refresh_from_db(self, *args, **kwargs):
+        super().refresh_from_db(*args, **kwargs)
+        deferred = self.get_deferred_fields()
+        self.loaded_values = {
+            field.attname: getattr(self, field.attname)
+            for field in self._meta.concrete_fields if field.attname not in deferred
+        }
 
     def __str__(self):
         return f"{self.product} - {self.quantity} pcs"
 
 
+class SalesTotals(models.Model):
+    """Orders, units and revenue of one combination of the sales dimensions."""
+    day = models.DateField()
+    payment_method = models.CharField(max_length=10, choices=Order.PAYMENT_METHODS)
+    order_type = models.CharField(max_length=10, choices=Order.ORDER_TYPES)
+    is_paid = models.BooleanField()
+    orders = models.IntegerField(default=0)
+    quantity = models.IntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    class Meta:
+        abstract = True
+        ordering = ['-day']
+
+
+class SalesRollup(SalesTotals):
+    """
+    Sales per day, product, payment method, order type and paid state, kept
+    current by the order signals (see sales.py).
+    """
+    product = models.ForeignKey(Product, related_name='sales', on_delete=models.CASCADE, null=True)
+
+    class Meta(SalesTotals.Meta):
+        constraints = [
+            models.UniqueConstraint(
+                fields=['day', 'product', 'payment_method', 'order_type', 'is_paid'], name='sales_rollup_key',
+            ),
+        ]
+        indexes = [
+            models.Index(fields=['product', 'day'], name='sales_rollup_product_day_idx'),
+        ]
+        verbose_name = "Sales summary"
+        verbose_name_plural = "Sales summaries"
+
+    def __str__(self):
+        return f"{self.day} {self.product}"
+
+
+class DailySales(SalesTotals):
+    """``SalesRollup`` without the product: a few rows a day for date-only reports."""
+
+    class Meta(SalesTotals.Meta):
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'payment_method', 'order_type', 'is_paid'], name='daily_sales_key'),
+        ]
+        verbose_name = "Daily sales"
+        verbose_name_plural = "Daily sales"
+
+    def __str__(self):
+        return str(self.day)
+
+
 # Stock model for product inventory
 class Stock(models.Model):
     product = models.ForeignKey(Product, related_name='stocks', on_delete=models.CASCADE)
     quantity_in_stock = models.PositiveIntegerField()
     restock_date = models.DateTimeField(auto_now_add=True)
+    # Bumped on every change, including queryset updates, so the catalog
+    # API can tell when stock levels moved.
+    date_updated = models.DateTimeField(auto_now=True, db_index=True)
 
     def __str__(self):
         return f"Stock for {self.product.name} - {self.quantity_in_stock} units"
@@ -227,17 +354,299 @@ class Purchase(models.Model):
     purchase_date = models.DateTimeField(auto_now_add=True)
     added_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['-purchase_date', '-id'], name='purchase_date_idx'),
+            models.Index(fields=['product', '-purchase_date', '-id'], name='purchase_product_date_idx'),
+        ]
+
     def __str__(self):
         return f"Purchase of {self.product.name} - {self.quantity_purchased} units"
 
 
+class StockMovement(models.Model):
+    """
+    One change of a product's stock, positive or negative. Append-only:
+    the stock level at any time is a ``StockSnapshot`` plus the movements
+    after it (see inventory.py).
+    """
+    KIND_PURCHASE = 'purchase'
+    KIND_SALE = 'sale'
+    KIND_RESTOCK = 'restock'
+    KIND_ADJUSTMENT = 'adjustment'
+    KINDS = [
+        (KIND_PURCHASE, 'Purchase'),
+        (KIND_SALE, 'Sale'),
+        (KIND_RESTOCK, 'Manual restock'),
+        (KIND_ADJUSTMENT, 'Adjustment'),
+    ]
+
+    # Deleting a product keeps its history: the link goes, its id and code stay.
+    product = models.ForeignKey(
+        Product, related_name='stock_movements', on_delete=models.SET_NULL, null=True, blank=True
+    )
+    product_pk = models.BigIntegerField(help_text="Id of the product, kept after it is deleted")
+    product_code = models.CharField(max_length=50, blank=True, null=True)
+    kind = models.CharField(max_length=10, choices=KINDS)
+    quantity = models.IntegerField(help_text="Units added, or removed when negative")
+    unit_price = models.DecimalField(max_digits=10, decimal_places=2, help_text="Product price at the time")
+    date = models.DateTimeField(default=timezone.now)
+    order = models.ForeignKey(Order, related_name='stock_movements', on_delete=models.SET_NULL, null=True, blank=True)
+    purchase = models.ForeignKey(
+        Purchase, related_name='stock_movements', on_delete=models.SET_NULL, null=True, blank=True
+    )
+    user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
+
+    class Meta:
+        ordering = ['-id']
+        indexes = [
+            models.Index(fields=['product_pk', 'id'], name='stock_movement_product_idx'),
+            models.Index(fields=['date'], name='stock_movement_date_idx'),
+        ]
+        verbose_name = "Stock movement"
+        verbose_name_plural = "Stock movements"
+
+    def __str__(self):
+        return f"{self.get_kind_display()} of {self.quantity:+d} {self.product or self.product_code}"
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding:
+            raise ValidationError("Stock movements cannot be changed; record a new adjustment instead.")
+        if self.product_pk is None:
+            self.product_pk, self.product_code = self.product.pk, self.product.code
+        super().save(*args, **kwargs)
+
+
+class StockSnapshot(models.Model):
+    """
+    Every product's stock at ``taken_at``, which includes the movements up
+    to ``last_movement_id`` and none after it.
+    """
+    taken_at = models.DateTimeField(default=timezone.now, db_index=True)
+    last_movement_id = models.BigIntegerField(default=0)
+
+    class Meta:
+        ordering = ['-taken_at']
+        verbose_name = "Stock snapshot"
+        verbose_name_plural = "Stock snapshots"
+
+    def __str__(self):
+        return f"Stock on {self.taken_at:%Y-%m-%d %H:%M}"
+
+
+class StockSnapshotItem(models.Model):
+    snapshot = models.ForeignKey(StockSnapshot, related_name='items', on_delete=models.CASCADE)
+    product = models.ForeignKey(
+        Product, related_name='stock_snapshots', on_delete=models.SET_NULL, null=True, blank=True
+    )
+    product_pk = models.BigIntegerField(help_text="Id of the product, kept after it is deleted")
+    product_code = models.CharField(max_length=50, blank=True, null=True)
+    quantity = models.IntegerField()
+    unit_price = models.DecimalField(max_digits=10, decimal_places=2)
+
+    def __str__(self):
+        return f"{self.product or self.product_code} - {self.quantity} units"
+
+
 class Telegram(models.Model):
     stock = models.ForeignKey(Stock, on_delete=models.CASCADE, related_name='telegram_posts')
     date_posted = models.DateTimeField(auto_now_add=True)
+    # Set for posts sent together as one album (see ``outbox.enqueue_posts``).
+    album = models.ForeignKey(
+        'TelegramOutbox', related_name='album_posts', on_delete=models.SET_NULL, null=True, blank=True
+    )
 
     def __str__(self):
         return f"Telegram Post for {self.stock.product.name} - {self.date_posted}"
 
     class Meta:
         verbose_name = "Telegram Post"
-        verbose_name_plural = "Telegram Posts"
\ No newline at end of file
+        verbose_name_plural = "Telegram Posts"
+
+
+class TelegramOutbox(models.Model):
+    """
+    Bot API calls waiting to be delivered by the ``telegram_worker`` command.
+
+    Rows are written in the same transaction as the post that produced them,
+    so a post is never lost when Telegram is slow or the process restarts.
+    """
+    STATUS_PENDING = 'pending'
+    STATUS_SENT = 'sent'
+    STATUS_FAILED = 'failed'
+    STATUSES = [
+        (STATUS_PENDING, 'Pending'),
+        (STATUS_SENT, 'Sent'),
+        (STATUS_FAILED, 'Failed'),
+    ]
+
+    telegram = models.ForeignKey(
+        Telegram, related_name='outbox', on_delete=models.CASCADE, null=True, blank=True
+    )
+    method = models.CharField(max_length=32)
+    payload = models.JSONField(default=dict)
+    status = models.CharField(max_length=10, choices=STATUSES, default=STATUS_PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True, null=True)
+    date_created = models.DateTimeField(auto_now_add=True)
+    date_sent = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        ordering = ['next_attempt_at']
+        indexes = [models.Index(fields=['status', 'next_attempt_at'])]
+        verbose_name = "Telegram Outbox Entry"
+        verbose_name_plural = "Telegram Outbox"
+
+    def __str__(self):
+        return f"{self.method} ({self.status}, {self.attempts} attempts)"
+
+
+class BroadcastTarget(models.Model):
+    """
+    A chat that receives product announcements: a channel or group the bot
+    posts in, or a user who opted in with /subscribe.
+    """
+    KIND_CHANNEL = 'channel'
+    KIND_GROUP = 'group'
+    KIND_USER = 'user'
+    KINDS = [
+        (KIND_CHANNEL, 'Channel'),
+        (KIND_GROUP, 'Group'),
+        (KIND_USER, 'User'),
+    ]
+
+    chat_id = models.CharField(max_length=64, unique=True)
+    kind = models.CharField(max_length=10, choices=KINDS, default=KIND_USER)
+    title = models.CharField(max_length=255, blank=True)
+    is_active = models.BooleanField(default=True, help_text="Inactive chats are skipped by new broadcasts.")
+    date_added = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['kind', 'title']
+
+    def __str__(self):
+        return self.title or self.chat_id
+
+
+class Broadcast(models.Model):
+    """An announcement of ``products`` to every target listed in its deliveries."""
+    products = models.ManyToManyField(Product, related_name='broadcasts')
+    requested_by = models.CharField(max_length=255, blank=True)
+    date_created = models.DateTimeField(auto_now_add=True)
+    date_finished = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        ordering = ['-date_created']
+
+    def __str__(self):
+        return f"Broadcast #{self.pk}"
+
+    def counts(self):
+        """Deliveries per status, e.g. ``{'pending': 3, 'sent': 10, 'failed': 1}``."""
+        counts = dict.fromkeys(dict(BroadcastDelivery.STATUSES), 0)
+        rows = self.deliveries.order_by().values_list('status').annotate(count=models.Count('pk'))
+        counts.update(rows)
+        return counts
+
+
+class BroadcastDelivery(models.Model):
+    """
+    One product sent to one chat. Rows are claimed and retried exactly like
+    ``TelegramOutbox`` entries, so a crashed broadcast resumes where it stopped.
+    """
+    STATUS_PENDING = TelegramOutbox.STATUS_PENDING
+    STATUS_SENT = TelegramOutbox.STATUS_SENT
+    STATUS_FAILED = TelegramOutbox.STATUS_FAILED
+    STATUSES = TelegramOutbox.STATUSES
+
+    broadcast = models.ForeignKey(Broadcast, related_name='deliveries', on_delete=models.CASCADE)
+    target = models.ForeignKey(BroadcastTarget, related_name='deliveries', on_delete=models.CASCADE)
+    product = models.ForeignKey(Product, related_name='broadcast_deliveries', on_delete=models.CASCADE)
+    status = models.CharField(max_length=10, choices=STATUSES, default=STATUS_PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True, null=True)
+    date_sent = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        ordering = ['next_attempt_at', 'id']
+        indexes = [models.Index(fields=['status', 'next_attempt_at', 'id'])]
+        constraints = [
+            models.UniqueConstraint(fields=['broadcast', 'target', 'product'], name='unique_broadcast_delivery'),
+        ]
+        verbose_name_plural = "Broadcast deliveries"
+
+    def __str__(self):
+        return f"{self.product} to {self.target} ({self.status})"
+
+
+class TelegramMedia(models.Model):
+    """
+    ``file_id`` Telegram assigned to an uploaded image, keyed by storage path.
+
+    Reposting the same image sends the id instead of uploading the file again.
+    """
+    path = models.CharField(max_length=255, unique=True)
+    file_id = models.CharField(max_length=255)
+    date_uploaded = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = "Telegram Media"
+        verbose_name_plural = "Telegram Media"
+
+    def __str__(self):
+        return self.path
+
+
+class ExportStorage(FileSystemStorage):
+    """
+    Exports contain customer details, so they live in ``EXPORT_ROOT``,
+    outside MEDIA_ROOT, and are only served through the admin download view.
+    """
+
+    @property
+    def base_location(self):
+        return settings.EXPORT_ROOT
+
+    @property
+    def location(self):
+        return os.path.abspath(self.base_location)
+
+
+def export_storage():
+    return ExportStorage()
+
+
+class ExportJob(models.Model):
+    """
+    A large admin export generated in the background.
+    """
+    STATUS_PENDING = 'pending'
+    STATUS_RUNNING = 'running'
+    STATUS_DONE = 'done'
+    STATUS_FAILED = 'failed'
+    STATUSES = [
+        (STATUS_PENDING, 'Pending'),
+        (STATUS_RUNNING, 'Running'),
+        (STATUS_DONE, 'Done'),
+        (STATUS_FAILED, 'Failed'),
+    ]
+
+    kind = models.CharField(max_length=20)
+    selection = models.JSONField(default=dict, help_text="Primary keys and ordering of the selected rows")
+    status = models.CharField(max_length=10, choices=STATUSES, default=STATUS_PENDING)
+    row_count = models.PositiveIntegerField(default=0)
+    file = models.FileField(storage=export_storage, upload_to='', blank=True, null=True)
+    error = models.TextField(blank=True, null=True)
+    requested_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
+    date_created = models.DateTimeField(auto_now_add=True)
+    date_finished = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        ordering = ['-date_created']
+        verbose_name = "Export"
+        verbose_name_plural = "Exports"
+
+    def __str__(self):
+        return f"{self.kind} export ({self.status})"
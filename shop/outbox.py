@@ -0,0 +1,289 @@
+"""
+Delivery of queued Telegram posts.
+
+``enqueue`` is called from request handlers and only writes a row.
+``OutboxWorker`` (run by ``manage.py telegram_worker``) claims due rows,
+sends them concurrently and reschedules failures with exponential backoff.
+"""
+import asyncio
+import json
+import logging
+import math
+import mimetypes
+import os
+import random
+from datetime import timedelta
+
+from asgiref.sync import sync_to_async
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Telegram, TelegramOutbox, TelegramMedia
+from .telegram import ALBUM_SIZE, TelegramError, build_album, build_post
+
+logger = logging.getLogger(__name__)
+
+
+def enqueue(method, payload, telegram=None):
+    return TelegramOutbox.objects.create(telegram=telegram, method=method, payload=payload)
+
+
+def split_evenly(items, size):
+    """Split ``items`` into the fewest chunks of at most ``size``, as even as possible."""
+    count = math.ceil(len(items) / size)
+    return [items[i * len(items) // count:(i + 1) * len(items) // count] for i in range(count)]
+
+
+def enqueue_posts(stocks):
+    """
+    Queue a channel post for each stock in the ``stocks`` queryset, in bulk.
+    Stocks with an image go out as albums of up to ``ALBUM_SIZE``; the rest
+    as single posts. ``Telegram`` rows are created with ``bulk_create``, so
+    the per-post signal does not run. Returns the number of outbox entries.
+    """
+    stocks = list(stocks.select_related('product__brand', 'product__model', 'product__category'))
+    with_image = [stock for stock in stocks if stock.product.image]
+    albums = [group for group in split_evenly(with_image, ALBUM_SIZE) if len(group) > 1]
+    in_album = {stock.pk for group in albums for stock in group}
+    singles = [stock for stock in stocks if stock.pk not in in_album]
+
+    with transaction.atomic():
+        album_entries = TelegramOutbox.objects.bulk_create([
+            TelegramOutbox(method=method, payload=payload)
+            for method, payload in map(build_album, albums)
+        ])
+        album_of = {stock.pk: entry for group, entry in zip(albums, album_entries) for stock in group}
+        posts = Telegram.objects.bulk_create([Telegram(stock=stock, album=album_of.get(stock.pk)) for stock in stocks])
+        single_posts = [post for post in posts if post.album is None]
+        TelegramOutbox.objects.bulk_create([
+            TelegramOutbox(telegram=post, method=method, payload=payload)
+            for post, (method, payload) in zip(single_posts, map(build_post, singles))
+        ])
+    return len(album_entries) + len(singles)
+
+
+class OutboxWorker:
+    """
+    Drains ``TelegramOutbox``.
+
+    A row is claimed by pushing its ``next_attempt_at`` forward by ``lease``
+    seconds with a conditional UPDATE, so several workers can share the table
+    and a row held by a crashed worker simply becomes due again.
+
+    With a ``limiter`` (see ``shop.broadcast.RateLimiter``) sends are spaced
+    to Telegram's limits; a row whose chat is busy for longer than
+    ``max_throttle_wait`` seconds is put back with a later ``next_attempt_at``.
+    """
+    model = TelegramOutbox
+
+    def __init__(self, client, concurrency=5, batch_size=50, lease=120,
+                 max_attempts=8, backoff_base=5, backoff_cap=3600, limiter=None, max_throttle_wait=10):
+        self.client = client
+        self.limiter = limiter
+        self.max_throttle_wait = max_throttle_wait
+        self.concurrency = concurrency
+        self.batch_size = batch_size
+        self.lease = lease
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._paused_until = 0.0
+
+    async def run(self, poll_interval=2.0):
+        while True:
+            if not await self.drain():
+                await asyncio.sleep(poll_interval)
+
+    async def drain(self):
+        """Deliver every row that is currently due. Returns the number handled."""
+        handled = 0
+        while True:
+            batch = await self.claim()
+            if not batch:
+                return handled
+            await asyncio.gather(*(self.process(entry) for entry in batch))
+            handled += len(batch)
+
+    async def claim(self):
+        now = timezone.now()
+        lease_until = now + timedelta(seconds=self.lease)
+        due = self.due().filter(
+            status=self.model.STATUS_PENDING, next_attempt_at__lte=now
+        ).order_by('next_attempt_at', 'pk')[:self.batch_size]
+
+        claimed = []
+        async for entry in due:
+            updated = await self.model.objects.filter(
+                pk=entry.pk, status=self.model.STATUS_PENDING, next_attempt_at=entry.next_attempt_at
+            ).aupdate(next_attempt_at=lease_until)
+            if updated:
+                entry.next_attempt_at = lease_until
+                claimed.append(entry)
+        return claimed
+
+    def due(self):
+        return self.model.objects.all()
+
+    def chat_id(self, entry):
+        return entry.payload.get('chat_id')
+
+    async def process(self, entry):
+        async with self._semaphore:
+            await self._wait_if_paused()
+            if not await self._throttle(entry):
+                return
+            try:
+                await self.deliver(entry)
+            except TelegramError as e:
+                await self._failed(entry, e)
+            except Exception as e:
+                logger.exception("Unexpected error delivering outbox entry %s", entry.pk)
+                await self._failed(entry, TelegramError(repr(e)))
+            else:
+                await self._sent(entry)
+
+    async def deliver(self, entry):
+        return await self.send(entry.method, entry.payload)
+
+    async def send(self, method, payload):
+        if method == 'sendMediaGroup':
+            return await self.send_album(payload)
+        payload = dict(payload)
+        photo_path = payload.pop('photo_path', None)
+        if not photo_path:
+            return await self.client.call(method, data=payload)
+
+        media = await TelegramMedia.objects.filter(path=photo_path).afirst()
+        if media:
+            try:
+                return await self.client.call(method, data={**payload, 'photo': media.file_id})
+            except TelegramError as e:
+                if e.error_code != 400:
+                    raise
+                # The id is no longer accepted; forget it and upload the file.
+                logger.warning("Cached file_id for %s rejected: %s", photo_path, e)
+                await media.adelete()
+
+        return await self.upload(method, payload, photo_path)
+
+    async def upload(self, method, payload, photo_path):
+        """Send the image straight from storage."""
+        image = await self._open(photo_path)
+        try:
+            result = await self.client.call(method, data=payload, files={'photo': image})
+        finally:
+            image[1].close()
+        await self._remember(photo_path, result)
+        return result
+
+    async def send_album(self, payload):
+        """
+        Send a ``sendMediaGroup`` album, reusing cached ``file_id``s and
+        uploading the other images in the same request.
+        """
+        payload = dict(payload)
+        media = payload.pop('media')
+        paths = [item['photo_path'] for item in media]
+        cached = {m.path: m.file_id async for m in TelegramMedia.objects.filter(path__in=paths)}
+        if cached:
+            try:
+                return await self.upload_album(payload, media, cached)
+            except TelegramError as e:
+                if e.error_code != 400:
+                    raise
+                logger.warning("Cached file_ids of an album rejected: %s", e)
+                await TelegramMedia.objects.filter(path__in=cached).adelete()
+        return await self.upload_album(payload, media, {})
+
+    async def upload_album(self, payload, media, cached):
+        items, files = [], {}
+        try:
+            for i, item in enumerate(media):
+                item = dict(item)
+                path = item.pop('photo_path')
+                if path in cached:
+                    item['media'] = cached[path]
+                else:
+                    files[f'photo{i}'] = await self._open(path)
+                    item['media'] = f'attach://photo{i}'
+                items.append(item)
+            messages = await self.client.call(
+                'sendMediaGroup', data={**payload, 'media': json.dumps(items)}, files=files or None
+            )
+        finally:
+            for _, image, _ in files.values():
+                image.close()
+
+        for item, message in zip(media, messages):
+            if item['photo_path'] not in cached:
+                await self._remember(item['photo_path'], message)
+        return messages
+
+    async def _open(self, photo_path):
+        """
+        Open an image in storage as an upload. httpx reads the file in chunks
+        while writing the request, so the image is never held in memory.
+        """
+        image = await sync_to_async(default_storage.open, thread_sensitive=False)(photo_path, 'rb')
+        mime_type = mimetypes.guess_type(photo_path)[0] or 'application/octet-stream'
+        return os.path.basename(photo_path), image, mime_type
+
+    async def _remember(self, photo_path, message):
+        sizes = message.get('photo') or []
+        if sizes:
+            # Telegram lists the resized copies smallest first.
+            await TelegramMedia.objects.aupdate_or_create(
+                path=photo_path, defaults={'file_id': sizes[-1]['file_id']}
+            )
+
+    async def _wait_if_paused(self):
+        loop = asyncio.get_running_loop()
+        delay = self._paused_until - loop.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    async def _throttle(self, entry):
+        """Wait for the entry's turn; False if it was postponed instead."""
+        if self.limiter is None:
+            return True
+        chat_id = self.chat_id(entry)
+        while (wait := self.limiter.delay(chat_id)) > 0:
+            if wait > self.max_throttle_wait:
+                entry.next_attempt_at = timezone.now() + timedelta(seconds=wait)
+                await entry.asave(update_fields=['next_attempt_at'])
+                return False
+            await asyncio.sleep(wait)
+        await asyncio.sleep(self.limiter.reserve(chat_id))
+        return True
+
+    async def _sent(self, entry):
+        entry.status = entry.STATUS_SENT
+        entry.attempts += 1
+        entry.date_sent = timezone.now()
+        entry.last_error = None
+        await entry.asave(update_fields=['status', 'attempts', 'date_sent', 'last_error'])
+        logger.info("%s %s delivered", entry._meta.verbose_name, entry.pk)
+
+    async def _failed(self, entry, error):
+        entry.last_error = str(error)
+
+        if error.retry_after:
+            # Flood control applies to the whole bot, so hold every send back,
+            # and don't count it against the entry's attempts.
+            loop = asyncio.get_running_loop()
+            self._paused_until = max(self._paused_until, loop.time() + error.retry_after)
+            entry.next_attempt_at = timezone.now() + timedelta(seconds=error.retry_after)
+            logger.warning("Telegram flood control, retrying entry %s in %ss", entry.pk, error.retry_after)
+        else:
+            entry.attempts += 1
+            if not error.is_retryable or entry.attempts >= self.max_attempts:
+                entry.status = entry.STATUS_FAILED
+                logger.error("%s %s failed permanently: %s", entry._meta.verbose_name, entry.pk, error)
+            else:
+                delay = min(self.backoff_base * 2 ** (entry.attempts - 1), self.backoff_cap)
+                entry.next_attempt_at = timezone.now() + timedelta(seconds=delay * random.uniform(0.5, 1.0))
+                logger.warning("%s %s failed (attempt %s): %s", entry._meta.verbose_name, entry.pk, entry.attempts, error)
+
+        await entry.asave(update_fields=['status', 'attempts', 'next_attempt_at', 'last_error'])
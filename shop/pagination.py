@@ -0,0 +1,19 @@
+from rest_framework.pagination import CursorPagination
+
+
+class CatalogCursorPagination(CursorPagination):
+    """
+    Keyset pagination: every page is a range scan from the cursor, so deep
+    pages cost the same as the first one.
+    """
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 200
+
+
+class ProductCursorPagination(CatalogCursorPagination):
+    ordering = ('-date_added', '-id')
+
+
+class OrderCursorPagination(CatalogCursorPagination):
+    ordering = ('-order_date', '-id')
@@ -0,0 +1,35 @@
+"""
+Streaming responses that stream under ASGI too.
+
+Django's ASGI handler reads a synchronous ``StreamingHttpResponse`` or
+``FileResponse`` iterator into a list before sending any of it, so under
+uvicorn a CSV export or a large file is held in memory whole. These
+subclasses hand the iterator's chunks to the event loop one at a time from
+the request's thread instead. Under WSGI nothing changes: ``FileResponse``
+still goes through ``wsgi.file_wrapper``, which gunicorn's sync workers send
+with ``sendfile(2)``.
+"""
+from asgiref.sync import sync_to_async
+from django.http import FileResponse, StreamingHttpResponse
+
+
+class AsyncStreamingMixin:
+    async def __aiter__(self):
+        if self.is_async:
+            async for part in super().__aiter__():
+                yield part
+            return
+        chunks = iter(self.streaming_content)
+        # Thread-sensitive, like the view: the iterator may hold a cursor.
+        next_chunk = sync_to_async(next)
+        while (chunk := await next_chunk(chunks, None)) is not None:
+            yield chunk
+
+
+class StreamingResponse(AsyncStreamingMixin, StreamingHttpResponse):
+    pass
+
+
+class FileStreamResponse(AsyncStreamingMixin, FileResponse):
+    # Each chunk costs a thread hop under ASGI.
+    block_size = 64 * 1024
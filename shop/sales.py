@@ -0,0 +1,199 @@
+"""
+Sales reporting from rollup tables instead of the ``Order`` table.
+
+Two rollups hold order counts, units and revenue: ``SalesRollup`` per day
+and product (and payment method, order type and paid state), and
+``DailySales`` per day only, which stays a few rows a day however many
+products sell. The order signals keep both current: ``record_save`` moves
+an order's contribution from the rows it was counted in to the rows it
+belongs in now, and ``record_delete`` takes it out, with one statement per
+row in the order's own transaction, so a rolled back order never shows up
+in the totals. ``rebuild`` recomputes them from the orders, for backfills
+and for repairing drift after bulk ``Order`` updates, which skip signals
+(``manage.py rebuild_sales_rollup``).
+
+``report`` answers grouped totals from a rollup alone (plus the product and
+brand tables for names), so its cost depends on days and products, not on
+the number of orders.
+"""
+from datetime import datetime, time
+
+from django.db import connection, transaction
+from django.db.models import Count, F, Sum
+from django.db.models.functions import TruncDate, TruncMonth
+from django.utils import timezone
+
+from .models import DailySales, Order, SalesRollup
+
+ROLLUPS = (SalesRollup, DailySales)
+# The Order fields a rollup row depends on.
+FIELDS = ('order_date', 'product_id', 'payment_method', 'order_type', 'is_paid', 'quantity', 'total_price')
+
+# group_by name -> (value lookup, extra lookups returned with it)
+GROUPS = {
+    'day': ('day', ()),
+    'month': ('month', ()),
+    'product': ('product', ('product__name',)),
+    'brand': ('product__brand', ('product__brand__name',)),
+    'payment_method': ('payment_method', ()),
+    'order_type': ('order_type', ()),
+    'is_paid': ('is_paid', ()),
+}
+# Groups and filters only SalesRollup can answer.
+PRODUCT_GROUPS = {'product', 'brand'}
+# Annotation names may not clash with the models' fields.
+TOTALS = {f'total_{field}': Sum(field) for field in ('orders', 'quantity', 'revenue')}
+
+UPSERT_SQL = """
+    INSERT INTO {table} ({columns}) VALUES ({values})
+    ON CONFLICT ({key}) DO UPDATE SET
+        orders = orders + excluded.orders,
+        quantity = quantity + excluded.quantity,
+        revenue = revenue + excluded.revenue
+"""
+
+
+def key_fields(rollup):
+    return rollup._meta.constraints[0].fields
+
+
+def counted(values):
+    """``(key, quantity, revenue)`` an order with these field values adds to the rollups."""
+    key = {
+        'day': timezone.localdate(values['order_date']),
+        'product': values['product_id'],
+        'payment_method': values['payment_method'],
+        'order_type': values['order_type'],
+        'is_paid': values['is_paid'],
+    }
+    return key, values['quantity'], values['total_price']
+
+
+def add(key, quantity, revenue, sign=1):
+    for rollup in ROLLUPS:
+        rollup_key = {name: key[name] for name in key_fields(rollup)}
+        if sign < 0:
+            rollup.objects.filter(**rollup_key).update(
+                orders=F('orders') - 1, quantity=F('quantity') - quantity, revenue=F('revenue') - revenue,
+            )
+        else:
+            upsert(rollup, rollup_key, quantity, revenue)
+
+
+def upsert(rollup, key, quantity, revenue):
+    # One statement whether or not the row exists yet (SQLite 3.24+ and
+    # PostgreSQL); update-then-create would need a savepoint.
+    opts = rollup._meta
+    values = {**key, 'orders': 1, 'quantity': quantity, 'revenue': revenue}
+    fields = [opts.get_field(name) for name in values]
+    with connection.cursor() as cursor:
+        cursor.execute(
+            UPSERT_SQL.format(
+                table=opts.db_table,
+                columns=', '.join(field.column for field in fields),
+                values=', '.join(['%s'] * len(fields)),
+                key=', '.join(opts.get_field(name).column for name in key),
+            ),
+            [field.get_db_prep_save(values[field.name], connection) for field in fields],
+        )
+
+
+def record_save(order):
+    """
+    Count a saved order, moving it from what was counted when it was loaded.
+
+    Loaded values can be stale when two people edit the same order at once;
+    the paid state cannot, because ``Order.save`` claims the payment in the
+    database (``paid_now``). ``rebuild`` repairs the rest.
+    """
+    before = getattr(order, 'loaded_values', None)
+    if before is not None and not set(FIELDS) <= set(before):
+        # Loaded with deferred fields.
+        before = Order.objects.values(*FIELDS).get(pk=order.pk)
+    if before is not None and order.is_paid:
+        before = {**before, 'is_paid': not order.paid_now}
+
+    after = {field: getattr(order, field) for field in FIELDS}
+    order.loaded_values = after
+    if before is not None:
+        if counted(before) == counted(after):
+            return
+        add(*counted(before), sign=-1)
+    add(*counted(after))
+
+
+def record_delete(order):
+    loaded = getattr(order, 'loaded_values', None)
+    if loaded is None or not set(FIELDS) <= set(loaded):
+        loaded = {field: getattr(order, field) for field in FIELDS}
+    add(*counted(loaded), sign=-1)
+
+
+def rebuild(since=None):
+    """
+    Recompute the rollups from the orders, for every day or from the date
+    ``since``. Returns the number of rows written.
+    """
+    orders = Order.objects.annotate(day=TruncDate('order_date'))
+    if since is not None:
+        orders = orders.filter(order_date__gte=timezone.make_aware(datetime.combine(since, time.min)))
+    written = 0
+    with transaction.atomic():
+        for rollup in ROLLUPS:
+            rows = rollup.objects.all()
+            if since is not None:
+                rows = rows.filter(day__gte=since)
+            rows.delete()
+            fields = [rollup._meta.get_field(name) for name in key_fields(rollup)]
+            groups = (
+                orders.values(*(field.name for field in fields))
+                .annotate(order_count=Count('id'), units=Sum('quantity'), sales=Sum('total_price'))
+                .order_by()
+            )
+            written += len(rollup.objects.bulk_create(
+                [
+                    rollup(
+                        **{field.attname: group[field.name] for field in fields},
+                        orders=group['order_count'], quantity=group['units'], revenue=group['sales'],
+                    )
+                    for group in groups.iterator()
+                ],
+                batch_size=1000,
+            ))
+    return written
+
+
+def rollup_for(names):
+    """The smallest rollup that can group or filter by ``names``."""
+    return SalesRollup if PRODUCT_GROUPS.intersection(names) else DailySales
+
+
+def report(rows, group_by=('day',)):
+    """
+    Totals of the rollup queryset ``rows`` per combination of the
+    ``group_by`` names (keys of ``GROUPS``), with the overall totals.
+    """
+    unknown = set(group_by) - set(GROUPS)
+    if unknown:
+        raise ValueError(f"Unknown groups: {', '.join(sorted(unknown))}")
+    # Rows whose orders all moved elsewhere stay behind at zero.
+    rows = rows.filter(orders__gt=0)
+    if 'month' in group_by:
+        rows = rows.annotate(month=TruncMonth('day'))
+    lookups = [lookup for name in group_by for lookup in (GROUPS[name][0], *GROUPS[name][1])]
+    groups = rows.values(*lookups).annotate(**TOTALS).order_by(*(GROUPS[name][0] for name in group_by))
+    results = []
+    for group in groups:
+        result = {}
+        for name in group_by:
+            lookup, extra = GROUPS[name]
+            result[name] = group[lookup]
+            for field in extra:
+                result[f'{name}_name'] = group[field]
+        result.update(totals(group))
+        results.append(result)
+    return {'results': results, 'totals': totals(rows.aggregate(**TOTALS))}
+
+
+def totals(values):
+    return {name.removeprefix('total_'): values[name] or 0 for name in TOTALS}
@@ -0,0 +1,94 @@
+"""
+Product search backed by the SQLite FTS5 index of ``shop.search_index``.
+
+Every word of the query must match (as a prefix) one of the product's code,
+name, description, brand, model or category. Results are ranked with bm25,
+weighting code and name above the rest. On databases without the index the
+same matching is done with ``icontains``.
+"""
+import re
+
+from django.db import connection
+from django.db.models import Case, Q, When
+from django.db.models.expressions import RawSQL
+
+from .models import Product
+from .search_index import FTS_TABLE
+
+# bm25 weights, in column order: code, name, description, brand, model, category
+RANK = f'bm25({FTS_TABLE}, 8.0, 10.0, 1.0, 4.0, 4.0, 2.0)'
+FALLBACK_FIELDS = ('code', 'name', 'description', 'brand__name', 'model__name', 'category__name')
+
+_available = None
+
+
+def is_available():
+    global _available
+    if _available is None:
+        _available = (
+            connection.vendor == 'sqlite'
+            and FTS_TABLE in connection.introspection.table_names()
+        )
+    return _available
+
+
+def terms(query):
+    return re.findall(r'\w+', query or '')
+
+
+def match_expression(query):
+    """Turn free text into an FTS5 query: every word, quoted, as a prefix."""
+    return ' '.join(f'"{term}"*' for term in terms(query))
+
+
+def matching_ids(query):
+    """
+    Subquery of the ids of matching products, for ``pk__in`` filters.
+    """
+    return RawSQL(f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s', [match_expression(query)])
+
+
+def ranked_ids(query, limit=20):
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s ORDER BY {RANK} LIMIT %s',
+            [match_expression(query), limit],
+        )
+        return [row[0] for row in cursor.fetchall()]
+
+
+def fallback_filter(query):
+    condition = Q()
+    for term in terms(query):
+        term_condition = Q()
+        for field in FALLBACK_FIELDS:
+            term_condition |= Q(**{f'{field}__icontains': term})
+        condition &= term_condition
+    return condition
+
+
+def filter_products(queryset, query, path='pk'):
+    """
+    Restrict ``queryset`` to rows whose product (reached through ``path``)
+    matches ``query``.
+    """
+    if not terms(query):
+        return queryset.none()
+    if is_available():
+        return queryset.filter(**{f'{path}__in': matching_ids(query)})
+    product_ids = Product.objects.filter(fallback_filter(query)).values('pk')
+    return queryset.filter(**{f'{path}__in': product_ids})
+
+
+def search_products(query, queryset=None, limit=20):
+    """Best matches for ``query``, most relevant first."""
+    if queryset is None:
+        queryset = Product.objects.all()
+    if not terms(query):
+        return queryset.none()
+    if not is_available():
+        return queryset.filter(fallback_filter(query))[:limit]
+
+    ids = ranked_ids(query, limit)
+    order = Case(*[When(pk=pk, then=position) for position, pk in enumerate(ids)])
+    return queryset.filter(pk__in=ids).order_by(order) if ids else queryset.none()
@@ -0,0 +1,152 @@
+"""
+The SQLite FTS5 index behind ``shop.search``: a virtual table over products,
+kept in sync by triggers so that every write path (admin, API, bulk
+imports, raw SQL) updates it. Other databases have no index and search
+falls back to LIKE queries.
+
+SQLite alters some columns by rebuilding the table, which drops the
+triggers on it. ``ensure``, run after every ``migrate``, rebuilds the index
+from the SQL here if any of it is missing. Migrations do not use this
+module: they keep their own frozen copy in
+``shop/migrations/_search_index_0012.py``.
+"""
+import logging
+
+from django.db import transaction
+from django.db.migrations.recorder import MigrationRecorder
+
+logger = logging.getLogger(__name__)
+
+FTS_TABLE = 'shop_product_fts'
+TRIGGERS = (
+    'shop_product_fts_insert',
+    'shop_product_fts_delete',
+    'shop_product_fts_update',
+    'shop_brand_fts_update',
+    'shop_productmodel_fts_update',
+    'shop_category_fts_update',
+)
+# The migration that first creates the index.
+MIGRATION = ('shop', '0012_product_search_index')
+
+PRODUCT_ROW = """
+    SELECT new.id, new.code, new.name, new.description,
+        (SELECT name FROM shop_brand WHERE id = new.brand_id),
+        (SELECT name FROM shop_productmodel WHERE id = new.model_id),
+        (SELECT name FROM shop_category WHERE id = new.category_id)
+"""
+
+CREATE_SQL = [
+    """
+    CREATE VIRTUAL TABLE shop_product_fts USING fts5(
+        code, name, description, brand, model, category,
+        tokenize = 'unicode61 remove_diacritics 2',
+        prefix = '2 3'
+    )
+    """,
+    """
+    INSERT INTO shop_product_fts (rowid, code, name, description, brand, model, category)
+    SELECT p.id, p.code, p.name, p.description, b.name, m.name, c.name
+    FROM shop_product p
+    LEFT JOIN shop_brand b ON b.id = p.brand_id
+    LEFT JOIN shop_productmodel m ON m.id = p.model_id
+    LEFT JOIN shop_category c ON c.id = p.category_id
+    """,
+    f"""
+    CREATE TRIGGER shop_product_fts_insert AFTER INSERT ON shop_product BEGIN
+        INSERT INTO shop_product_fts (rowid, code, name, description, brand, model, category) {PRODUCT_ROW};
+    END
+    """,
+    """
+    CREATE TRIGGER shop_product_fts_delete AFTER DELETE ON shop_product BEGIN
+        DELETE FROM shop_product_fts WHERE rowid = old.id;
+    END
+    """,
+    f"""
+    CREATE TRIGGER shop_product_fts_update AFTER UPDATE OF code, name, description, brand_id, model_id, category_id
+    ON shop_product
+    WHEN old.code IS NOT new.code OR old.name IS NOT new.name OR old.description IS NOT new.description
+        OR old.brand_id IS NOT new.brand_id OR old.model_id IS NOT new.model_id
+        OR old.category_id IS NOT new.category_id
+    BEGIN
+        DELETE FROM shop_product_fts WHERE rowid = old.id;
+        INSERT INTO shop_product_fts (rowid, code, name, description, brand, model, category) {PRODUCT_ROW};
+    END
+    """,
+    """
+    CREATE TRIGGER shop_brand_fts_update AFTER UPDATE OF name ON shop_brand
+    WHEN old.name IS NOT new.name BEGIN
+        UPDATE shop_product_fts SET brand = new.name
+        WHERE rowid IN (SELECT id FROM shop_product WHERE brand_id = new.id);
+    END
+    """,
+    """
+    CREATE TRIGGER shop_productmodel_fts_update AFTER UPDATE OF name ON shop_productmodel
+    WHEN old.name IS NOT new.name BEGIN
+        UPDATE shop_product_fts SET model = new.name
+        WHERE rowid IN (SELECT id FROM shop_product WHERE model_id = new.id);
+    END
+    """,
+    """
+    CREATE TRIGGER shop_category_fts_update AFTER UPDATE OF name ON shop_category
+    WHEN old.name IS NOT new.name BEGIN
+        UPDATE shop_product_fts SET category = new.name
+        WHERE rowid IN (SELECT id FROM shop_product WHERE category_id = new.id);
+    END
+    """,
+]
+
+DROP_SQL = [
+    "DROP TRIGGER IF EXISTS shop_category_fts_update",
+    "DROP TRIGGER IF EXISTS shop_productmodel_fts_update",
+    "DROP TRIGGER IF EXISTS shop_brand_fts_update",
+    "DROP TRIGGER IF EXISTS shop_product_fts_update",
+    "DROP TRIGGER IF EXISTS shop_product_fts_delete",
+    "DROP TRIGGER IF EXISTS shop_product_fts_insert",
+    "DROP TABLE IF EXISTS shop_product_fts",
+]
+
+
+def execute(connection, statements):
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        for statement in statements:
+            cursor.execute(statement)
+
+
+def create(connection):
+    execute(connection, CREATE_SQL)
+
+
+def drop(connection):
+    execute(connection, DROP_SQL)
+
+
+def missing(connection):
+    """Names of the table and triggers of the index that do not exist."""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT name FROM sqlite_master WHERE type IN ('table', 'trigger') AND name IN (%s)"
+            % ', '.join(['%s'] * (len(TRIGGERS) + 1)),
+            [FTS_TABLE, *TRIGGERS],
+        )
+        existing = {row[0] for row in cursor.fetchall()}
+    return [name for name in (FTS_TABLE, *TRIGGERS) if name not in existing]
+
+
+def ensure(connection):
+    """
+    Rebuild the index if the database is migrated past its creation but
+    any of it is missing. Returns whether it was rebuilt.
+    """
+    if connection.vendor != 'sqlite' or MIGRATION not in MigrationRecorder(connection).applied_migrations():
+        return False
+    absent = missing(connection)
+    if not absent:
+        return False
+    logger.warning("Search index incomplete (missing %s), rebuilding it.", ', '.join(absent))
+    with transaction.atomic(using=connection.alias):
+        drop(connection)
+        create(connection)
+    return True
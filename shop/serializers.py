@@ -1,19 +1,49 @@
 from rest_framework import serializers
+from . import images
 from .models import Product, Order
 
 
+class ImageVariantsField(serializers.Field):
+    """
+    ``{variant: {url, width, height}}`` of the product's resized images, with
+    absolute URLs like the ``image`` field. Empty until they are generated.
+    """
+
+    def __init__(self, **kwargs):
+        super().__init__(source='*', read_only=True, **kwargs)
+
+    def to_representation(self, product):
+        if not images.is_current(product):
+            return {}
+        request = self.context.get('request')
+        result = {}
+        for name in images.VARIANTS:
+            variant = product.image_variants.get(name)
+            if variant:
+                url = images.variant_url(product, name)
+                result[name] = {
+                    'url': request.build_absolute_uri(url) if request else url,
+                    'width': variant['width'],
+                    'height': variant['height'],
+                }
+        return result
+
+
 class ProductSerializer(serializers.ModelSerializer):
     available_stock = serializers.SerializerMethodField()
+    image_variants = ImageVariantsField()
 
     class Meta:
         model = Product
         fields = '__all__'
 
     def get_available_stock(self, obj):
-        stocks = obj.stocks.all()
-        if stocks.exists():
-            return stocks.first().quantity_in_stock
-        return 0
+        # Querysets from Product.objects.with_available_stock() carry the value.
+        available_stock = getattr(obj, 'available_stock', None)
+        if available_stock is not None:
+            return available_stock
+        stock = obj.stocks.order_by('pk').first()
+        return stock.quantity_in_stock if stock else 0
 
 
 class OrderSerializer(serializers.ModelSerializer):
@@ -1,112 +1,96 @@
-import requests
-from django.db.models.signals import post_save
+from django.db.models import F, Subquery
+from django.db.backends.signals import connection_created
+from django.db import connections
+from django.db.models.signals import post_migrate, post_save, post_delete
 from django.dispatch import receiver
-from .models import Stock, Order, Telegram
-from django.conf import settings
-from io import BytesIO
-import mimetypes
+from django.utils import timezone
+from .models import Category, Subcategory, Brand, ProductModel, Product, Stock, StockMovement, Order, Telegram
 from django.core.exceptions import ValidationError
-import json
-
-
-# Your bot token and channel ID
-BOT_TOKEN = 'TOKEN'
-CHANNEL_ID = '-CHANNEL_ID'
+from . import images, inventory, metrics, outbox, sales, search, search_index, telegram
+from .cache import invalidate_products
 
 
 @receiver(post_save, sender=Telegram)
 def send_telegram_post(sender, instance, created, **kwargs):
+    """
+    Queue the channel post; ``manage.py telegram_worker`` delivers it.
+    """
     if created:
-        stock = instance.stock
-        product = stock.product
-
-        URL = settings.SITE_URL
-        image_url = URL + product.image.url if product.image else None
-
-        caption = (
-            f"<b>New Stock Added for {product.name}</b>\n\n"
-            f"<b>Brand:</b> {product.brand.name}\n"
-            f"<b>Model:</b> {product.model.name}\n"
-            f"<b>Category:</b> {product.category.name}\n"
-            f"<b>Quantity Available:</b> {stock.quantity_in_stock}\n"
-            f"<b>Price:</b> {product.price}\n\n"
-            f"<i>{product.description}</i>\n"
-        )
-
-        direct_link = f"https://t.me/StoreNowBot/mystore?startapp=product-{product.id}"
-
-        data = {
-            'chat_id': CHANNEL_ID,
-            'caption': caption,
-            'parse_mode': 'HTML',
-            'reply_markup': json.dumps({
-                'inline_keyboard': [
-                    [
-                        {
-                            'text': 'Order Now',
-                            'url': direct_link
-                        }
-                    ]
-                ]
-            })
-        }
-
-        try:
-            if image_url:
-                image_response = requests.get(image_url)
-                if image_response.status_code == 200:
-                    image_extension = product.image.url.split('.')[-1]
-                    mime_type, _ = mimetypes.guess_type(image_url)
-
-                    if not mime_type:
-                        mime_type = image_response.headers.get('Content-Type', 'application/octet-stream')
-
-                    image_data = BytesIO(image_response.content)
-
-                    files = {
-                        'photo': (f'image.{image_extension}', image_data, mime_type)
-                    }
-                    url = f'https://api.telegram.org/bot{BOT_TOKEN}/sendPhoto'
-                    response = requests.post(url, data=data, files=files)
-                else:
-                    print(f"Failed to download image: {image_response.status_code}")
-                    return
-            else:
-                url = f'https://api.telegram.org/bot{BOT_TOKEN}/sendMessage'
-                data['text'] = caption
-                response = requests.post(url, json=data)
-
-            if response.status_code == 200:
-                print(f"Post sent successfully to Telegram for product {product.name}")
-            else:
-                print(f"Failed to send message to Telegram: {response.text}")
-
-        except requests.exceptions.RequestException as e:
-            print(f"Request failed: {e}")
-
+        method, payload = telegram.build_post(instance.stock)
+        outbox.enqueue(method, payload, telegram=instance)
 
 
 @receiver(post_save, sender=Order)
 def reduce_stock_on_payment(sender, instance, **kwargs):
     """
     Signal to reduce stock when an order is marked as paid.
-    This will reduce the stock quantity based on the order quantity.
+
+    Runs once per order, when ``Order.save`` claims the paid transition, and
+    takes the stock with a single conditional UPDATE so concurrent payments
+    can never oversell. Raising rolls the whole save back.
     """
+    if not getattr(instance, 'paid_now', False):
+        return
+
+    stock = Stock.objects.filter(product=instance.product_id).order_by('pk')
+    updated = Stock.objects.filter(
+        pk=Subquery(stock.values('pk')[:1]), quantity_in_stock__gte=instance.quantity
+    ).update(quantity_in_stock=F('quantity_in_stock') - instance.quantity, date_updated=timezone.now())
+
+    invalidate_products(instance.product_id)
+
+    if not updated:
+        if stock.exists():
+            raise ValidationError("Not enough stock available.")
+        raise ValidationError(f"Stock entry for product '{instance.product}' does not exist.")
+    inventory.record(instance.product, StockMovement.KIND_SALE, -instance.quantity, order=instance)
+
 
-    if instance.is_paid:
-        try:
+@receiver(post_save, sender=Order)
+def count_order_in_sales(sender, instance, **kwargs):
+    sales.record_save(instance)
+
+
+@receiver(post_delete, sender=Order)
+def uncount_order_in_sales(sender, instance, **kwargs):
+    sales.record_delete(instance)
+
+
+@receiver([post_save, post_delete], sender=Product)
+def invalidate_cached_product(sender, instance, **kwargs):
+    invalidate_products(instance.pk)
 
-            stock = Stock.objects.get(product=instance.product)
 
+@receiver(post_save, sender=Product)
+def resize_product_image(sender, instance, **kwargs):
+    if instance.image and not images.is_current(instance):
+        images.schedule(instance)
 
-            if stock.quantity_in_stock >= instance.quantity:
 
-                stock.quantity_in_stock -= instance.quantity
-                stock.save()
-            else:
+@receiver([post_save, post_delete], sender=Stock)
+def invalidate_cached_product_stock(sender, instance, **kwargs):
+    invalidate_products(instance.product_id)
 
-                raise ValidationError("Not enough stock available.")
-        except Stock.DoesNotExist:
 
-            raise ValidationError(f"Stock entry for product '{instance.product}' does not exist.")
+@receiver([post_save, post_delete], sender=Category)
+@receiver([post_save, post_delete], sender=Subcategory)
+@receiver([post_save, post_delete], sender=Brand)
+@receiver([post_save, post_delete], sender=ProductModel)
+def invalidate_cached_products_of(sender, instance, **kwargs):
+    # Cached products carry their category, subcategory, brand and model.
+    field = {Category: 'category', Subcategory: 'subcategory', Brand: 'brand', ProductModel: 'model'}[sender]
+    invalidate_products(*Product.objects.filter(**{field: instance.pk}).values_list('pk', flat=True))
 
+
+# Count every connection's queries towards the request that made them.
+connection_created.connect(metrics.install, dispatch_uid='shop.metrics')
+
+
+@receiver(post_migrate)
+def repair_search_index(sender, using, **kwargs):
+    """
+    Put back the search index triggers a table rebuild dropped, whichever
+    migration did it.
+    """
+    if sender.name == 'shop' and search_index.ensure(connections[using]):
+        search._available = None
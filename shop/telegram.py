@@ -0,0 +1,141 @@
+"""
+Small async client for the Telegram Bot API plus the helpers that turn shop
+objects into Bot API payloads.
+
+Only the outbox worker talks to Telegram; request handlers just queue work.
+"""
+import json
+
+import httpx
+from django.conf import settings
+
+from . import images
+
+API_URL = 'https://api.telegram.org/bot{token}/{method}'
+# sendMediaGroup takes 2-10 items, each caption at most 1024 characters.
+ALBUM_SIZE = 10
+ALBUM_DESCRIPTION_LENGTH = 300
+
+
+class TelegramError(Exception):
+    """Raised when a Bot API call fails or returns ``ok: false``."""
+
+    def __init__(self, description, error_code=None, retry_after=None):
+        super().__init__(description)
+        self.description = description
+        self.error_code = error_code
+        self.retry_after = retry_after
+
+    @property
+    def is_retryable(self):
+        # Network problems, flood control and server errors are transient;
+        # 400/403 style errors will fail the same way next time.
+        return self.error_code is None or self.error_code == 429 or self.error_code >= 500
+
+
+class TelegramClient:
+    """
+    Bot API client sharing one pooled ``httpx.AsyncClient`` between calls.
+    """
+
+    def __init__(self, token=None, http_client=None, timeout=30.0, max_connections=10):
+        self.token = token or settings.TELEGRAM_BOT_TOKEN
+        self.http = http_client or httpx.AsyncClient(
+            timeout=httpx.Timeout(timeout, connect=10.0),
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+        )
+
+    async def call(self, method, data=None, files=None):
+        url = API_URL.format(token=self.token, method=method)
+        try:
+            response = await self.http.post(url, data=data, files=files)
+        except httpx.HTTPError as e:
+            raise TelegramError(f"Request failed: {e}") from e
+
+        try:
+            body = response.json()
+        except ValueError:
+            raise TelegramError(f"Unexpected response ({response.status_code})", error_code=response.status_code)
+
+        if not body.get('ok'):
+            parameters = body.get('parameters') or {}
+            raise TelegramError(
+                body.get('description', 'Unknown error'),
+                error_code=body.get('error_code', response.status_code),
+                retry_after=parameters.get('retry_after'),
+            )
+        return body['result']
+
+    async def aclose(self):
+        await self.http.aclose()
+
+
+def product_link(product):
+    return f"https://t.me/StoreNowBot/mystore?startapp=product-{product.id}"
+
+
+def build_caption(stock, description_length=None):
+    product = stock.product
+    description = product.description
+    if description and description_length and len(description) > description_length:
+        description = description[:description_length - 1].rstrip() + '…'
+    return (
+        f"<b>New Stock Added for {product.name}</b>\n\n"
+        f"<b>Brand:</b> {product.brand.name}\n"
+        f"<b>Model:</b> {product.model.name}\n"
+        f"<b>Category:</b> {product.category.name}\n"
+        f"<b>Quantity Available:</b> {stock.quantity_in_stock}\n"
+        f"<b>Price:</b> {product.price}\n\n"
+        f"<i>{description}</i>\n"
+    )
+
+
+def build_post(stock):
+    """
+    Return ``(method, payload)`` announcing ``stock`` in the channel.
+    """
+    product = stock.product
+    caption = build_caption(stock)
+    payload = {
+        'chat_id': settings.TELEGRAM_CHANNEL_ID,
+        'parse_mode': 'HTML',
+        'reply_markup': json.dumps({
+            'inline_keyboard': [
+                [
+                    {
+                        'text': 'Order Now',
+                        'url': product_link(product)
+                    }
+                ]
+            ]
+        })
+    }
+
+    if product.image:
+        payload['caption'] = caption
+        payload['photo_path'] = images.variant_name(product, 'telegram')
+        return 'sendPhoto', payload
+
+    payload['text'] = caption
+    return 'sendMessage', payload
+
+
+def build_album(stocks):
+    """
+    Return ``(method, payload)`` posting ``stocks`` (2 to ``ALBUM_SIZE``, all
+    with an image) as one album. Albums can't carry buttons, so each caption
+    ends with the order link instead.
+    """
+    media = [
+        {
+            'type': 'photo',
+            'photo_path': images.variant_name(stock.product, 'telegram'),
+            'caption': (
+                build_caption(stock, ALBUM_DESCRIPTION_LENGTH)
+                + f'\n<a href="{product_link(stock.product)}">Order Now</a>'
+            ),
+            'parse_mode': 'HTML',
+        }
+        for stock in stocks
+    ]
+    return 'sendMediaGroup', {'chat_id': settings.TELEGRAM_CHANNEL_ID, 'media': media}
@@ -0,0 +1,11 @@
+from django import template
+
+from shop import images
+
+register = template.Library()
+
+
+@register.simple_tag
+def product_image_url(product, variant='card'):
+    """URL of a resized variant of ``product``'s image (the original until it exists)."""
+    return images.variant_url(product, variant) or ''
@@ -1,3 +1,1737 @@
-from django.test import TestCase
+import asyncio
+import gzip
+import io
+import json
+import logging
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import timedelta
+from decimal import Decimal
 
-# Create your tests here.
+import brotli
+import httpx
+from asgiref.sync import async_to_sync, sync_to_async
+from django.contrib import admin
+from django.contrib.auth.models import User
+from django.contrib.messages.storage.fallback import FallbackStorage
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.handlers.asgi import ASGIHandler
+from django.core.management import call_command
+from django.core.management.sql import emit_post_migrate_signal
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from openpyxl import load_workbook
+from PIL import Image
+
+from .models import (
+    Category, Subcategory, Brand, ProductModel, Product, Stock, Order, Purchase, Telegram, TelegramOutbox,
+    TelegramMedia, ExportJob, BroadcastTarget, BroadcastDelivery, SalesRollup, DailySales, StockMovement,
+    StockSnapshot,
+)
+from .broadcast import BroadcastWorker, RateLimiter, TokenBucket, create_broadcast
+from . import cache as product_cache
+from .cache import aget_product, fill_lock_key, get_product, product_cache_key, product_cache_stats
+from . import compression, db, exports, images, inventory, metrics, sales, search_index
+from .exports import run_export_job
+from .importer import CatalogImporter, read_rows
+from .log import JsonFormatter, QueueHandler, SamplingFilter
+from . import loadtest
+from .outbox import OutboxWorker, enqueue_posts
+from .telegram import TelegramClient
+
+
+def create_product(name='Phone', quantity=10, price=Decimal('100.00'), **kwargs):
+    category = Category.objects.create(name='Phones')
+    subcategory = Subcategory.objects.create(name='Smart', category=category)
+    brand = Brand.objects.create(name='Acme', subcategory=subcategory)
+    model = ProductModel.objects.create(name='X1', brand=brand, subcategory=subcategory)
+    return Product.objects.create(
+        name=name, category=category, subcategory=subcategory, brand=brand, model=model,
+        quantity=quantity, price=price, description='A phone', **kwargs
+    )
+
+
+def bot_api(handler):
+    """Build a TelegramClient whose HTTP calls are answered by ``handler``."""
+    return TelegramClient(token='test', http_client=httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+
+
+@override_settings(TELEGRAM_CHANNEL_ID='@channel')
+class TelegramOutboxTests(TestCase):
+    def setUp(self):
+        self.product = create_product()
+        self.stock = Stock.objects.get(product=self.product)
+
+    def drain(self, handler, **kwargs):
+        client = bot_api(handler)
+        worker = OutboxWorker(client, **kwargs)
+
+        async def run():
+            try:
+                return await worker.drain()
+            finally:
+                await client.aclose()
+
+        return async_to_sync(run)()
+
+    def test_post_is_queued_without_calling_telegram(self):
+        post = Telegram.objects.create(stock=self.stock)
+
+        entry = TelegramOutbox.objects.get()
+        self.assertEqual(entry.telegram, post)
+        self.assertEqual(entry.method, 'sendMessage')
+        self.assertEqual(entry.status, TelegramOutbox.STATUS_PENDING)
+        self.assertEqual(entry.payload['chat_id'], '@channel')
+        self.assertIn(self.product.name, entry.payload['text'])
+
+    def test_worker_delivers_pending_entries(self):
+        Telegram.objects.create(stock=self.stock)
+        requests = []
+
+        def handler(request):
+            requests.append(request)
+            return httpx.Response(200, json={'ok': True, 'result': {'message_id': 1}})
+
+        self.assertEqual(self.drain(handler), 1)
+
+        entry = TelegramOutbox.objects.get()
+        self.assertEqual(entry.status, TelegramOutbox.STATUS_SENT)
+        self.assertIsNotNone(entry.date_sent)
+        self.assertEqual(len(requests), 1)
+        self.assertTrue(requests[0].url.path.endswith('/sendMessage'))
+
+    def test_flood_control_reschedules_without_counting_attempt(self):
+        Telegram.objects.create(stock=self.stock)
+
+        def handler(request):
+            return httpx.Response(429, json={
+                'ok': False, 'error_code': 429, 'description': 'Too Many Requests',
+                'parameters': {'retry_after': 30},
+            })
+
+        self.drain(handler)
+
+        entry = TelegramOutbox.objects.get()
+        self.assertEqual(entry.status, TelegramOutbox.STATUS_PENDING)
+        self.assertEqual(entry.attempts, 0)
+        self.assertGreater(entry.next_attempt_at, timezone.now() + timedelta(seconds=25))
+
+    def test_server_errors_back_off_then_fail(self):
+        Telegram.objects.create(stock=self.stock)
+
+        def handler(request):
+            return httpx.Response(502, text='Bad Gateway')
+
+        self.drain(handler, max_attempts=2)
+        entry = TelegramOutbox.objects.get()
+        self.assertEqual(entry.status, TelegramOutbox.STATUS_PENDING)
+        self.assertEqual(entry.attempts, 1)
+        self.assertGreater(entry.next_attempt_at, timezone.now())
+
+        TelegramOutbox.objects.update(next_attempt_at=timezone.now())
+        self.drain(handler, max_attempts=2)
+        entry.refresh_from_db()
+        self.assertEqual(entry.status, TelegramOutbox.STATUS_FAILED)
+        self.assertEqual(entry.attempts, 2)
+
+    def test_bad_request_is_not_retried(self):
+        Telegram.objects.create(stock=self.stock)
+
+        def handler(request):
+            return httpx.Response(400, json={'ok': False, 'error_code': 400, 'description': 'chat not found'})
+
+        self.drain(handler)
+        entry = TelegramOutbox.objects.get()
+        self.assertEqual(entry.status, TelegramOutbox.STATUS_FAILED)
+        self.assertEqual(entry.last_error, 'chat not found')
+
+    def test_leased_entries_are_not_claimed_twice(self):
+        Telegram.objects.create(stock=self.stock)
+        calls = []
+
+        def handler(request):
+            calls.append(request)
+            return httpx.Response(200, json={'ok': True, 'result': {}})
+
+        TelegramOutbox.objects.update(next_attempt_at=timezone.now() + timedelta(minutes=1))
+        self.assertEqual(self.drain(handler), 0)
+        self.assertEqual(calls, [])
+
+
+class TelegramPhotoTests(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        media_settings = override_settings(MEDIA_ROOT=self.media_root)
+        media_settings.enable()
+        self.addCleanup(media_settings.disable)
+        self.product = create_product(image=SimpleUploadedFile('phone.jpg', b'jpeg-bytes', content_type='image/jpeg'))
+        self.stock = Stock.objects.get(product=self.product)
+        self.requests = []
+
+    def handler(self, request):
+        self.requests.append((request.url.path, request.read()))
+        return httpx.Response(200, json={'ok': True, 'result': {
+            'photo': [{'file_id': 'small'}, {'file_id': 'large'}],
+        }})
+
+    def post(self):
+        Telegram.objects.create(stock=self.stock)
+        client = bot_api(self.handler)
+
+        async def run():
+            try:
+                return await OutboxWorker(client).drain()
+            finally:
+                await client.aclose()
+
+        async_to_sync(run)()
+
+    def test_photo_is_uploaded_from_storage(self):
+        self.post()
+
+        entry = TelegramOutbox.objects.get()
+        self.assertEqual(entry.method, 'sendPhoto')
+        self.assertEqual(entry.payload['photo_path'], self.product.image.name)
+        path, body = self.requests[0]
+        self.assertTrue(path.endswith('/sendPhoto'))
+        self.assertIn(b'jpeg-bytes', body)
+        self.assertEqual(TelegramMedia.objects.get(path=self.product.image.name).file_id, 'large')
+
+    def test_repost_sends_cached_file_id(self):
+        self.post()
+        self.post()
+
+        self.assertEqual(len(self.requests), 2)
+        path, body = self.requests[1]
+        self.assertNotIn(b'jpeg-bytes', body)
+        self.assertIn(b'photo=large', body)
+
+
+@override_settings(TELEGRAM_CHANNEL_ID='@channel')
+class TelegramAlbumTests(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        media_settings = override_settings(MEDIA_ROOT=self.media_root)
+        media_settings.enable()
+        self.addCleanup(media_settings.disable)
+        for i in range(12):
+            create_product(
+                name=f'Phone {i}', image=SimpleUploadedFile(f'phone{i}.jpg', b'jpeg-%d' % i, content_type='image/jpeg'),
+            )
+        create_product(name='Cable')
+        self.stocks = Stock.objects.select_related('product').order_by('pk')
+        self.requests = []
+
+    def handler(self, request):
+        body = request.read()
+        self.requests.append((request.url.path, body))
+        if request.url.path.endswith('/sendMediaGroup'):
+            if request.headers['content-type'].startswith('multipart/'):
+                media = re.search(rb'name="media"\r\n\r\n(.*?)\r\n', body).group(1)
+            else:
+                media = httpx.QueryParams(body.decode())['media']
+            media = json.loads(media)
+            return httpx.Response(200, json={'ok': True, 'result': [
+                {'message_id': i, 'photo': [{'file_id': f'small-{i}'}, {'file_id': f'file-{item["caption"][:20]}'}]}
+                for i, item in enumerate(media)
+            ]})
+        return httpx.Response(200, json={'ok': True, 'result': {'message_id': 1}})
+
+    def drain(self):
+        client = bot_api(self.handler)
+
+        async def run():
+            try:
+                return await OutboxWorker(client).drain()
+            finally:
+                await client.aclose()
+
+        return async_to_sync(run)()
+
+    def test_photos_are_grouped_into_even_albums(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(enqueue_posts(self.stocks), 3)
+        self.assertLessEqual(len(queries), 6)
+
+        self.assertEqual(Telegram.objects.count(), 13)
+        albums = TelegramOutbox.objects.filter(method='sendMediaGroup')
+        self.assertEqual([len(entry.payload['media']) for entry in albums], [6, 6])
+        self.assertEqual(Telegram.objects.filter(album__isnull=False).count(), 12)
+        single = TelegramOutbox.objects.get(method='sendMessage')
+        self.assertEqual(single.telegram.stock.product.name, 'Cable')
+
+    def test_albums_are_uploaded_in_one_call_each(self):
+        enqueue_posts(self.stocks)
+        self.assertEqual(self.drain(), 3)
+
+        self.assertEqual(len(self.requests), 3)
+        self.assertFalse(TelegramOutbox.objects.exclude(status=TelegramOutbox.STATUS_SENT).exists())
+        album_bodies = [body for path, body in self.requests if path.endswith('/sendMediaGroup')]
+        self.assertEqual(len(album_bodies), 2)
+        self.assertIn(b'attach://photo0', album_bodies[0])
+        self.assertEqual(TelegramMedia.objects.count(), 12)
+
+    def test_reposted_album_reuses_file_ids(self):
+        enqueue_posts(self.stocks.filter(product__image__gt='')[:3])
+        self.drain()
+        self.requests.clear()
+        enqueue_posts(self.stocks.filter(product__image__gt='')[:3])
+        self.drain()
+
+        path, body = self.requests[0]
+        self.assertNotIn(b'jpeg-', body)
+        self.assertIn(b'file-', body)
+
+    def test_single_photo_is_a_plain_post(self):
+        enqueue_posts(self.stocks.filter(product__image__gt='')[:1])
+        self.assertEqual(TelegramOutbox.objects.get().method, 'sendPhoto')
+
+
+class RateLimiterTests(TestCase):
+    def test_token_bucket_allows_a_burst_then_spaces_tokens(self):
+        bucket = TokenBucket(rate=2, capacity=3)
+        self.assertEqual([bucket.take(0.0) for _ in range(5)], [0.0, 0.0, 0.0, 0.5, 1.0])
+        self.assertEqual(bucket.delay(10.0), 0.0)
+
+    def test_per_chat_and_global_limits(self):
+        limiter = RateLimiter(global_rate=10)
+        self.assertEqual(limiter.reserve('1001', now=0.0), 0.0)
+        # Another user only waits for the global bucket...
+        self.assertAlmostEqual(limiter.reserve('1002', now=0.0), 0.1)
+        self.assertAlmostEqual(limiter.reserve('-100200', now=0.0), 0.2)
+        # ...the same user for a second, a group or channel for three.
+        self.assertAlmostEqual(limiter.delay('1001', now=0.0), 1.0)
+        self.assertAlmostEqual(limiter.delay('1002', now=0.5), 0.6)
+        self.assertAlmostEqual(limiter.delay('-100200', now=0.0), 3.2)
+        self.assertEqual(limiter.delay('1003', now=0.0), 0.0)
+
+
+class BroadcastTests(TestCase):
+    def setUp(self):
+        self.products = [create_product(name='Phone'), create_product(name='Tablet')]
+        self.targets = [
+            BroadcastTarget.objects.create(chat_id='1001', title='Abebe'),
+            BroadcastTarget.objects.create(chat_id='1002', title='Sara'),
+            BroadcastTarget.objects.create(chat_id='-100200', kind=BroadcastTarget.KIND_CHANNEL, title='Deals'),
+        ]
+        self.sent = []
+
+    def handler(self, request):
+        data = dict(httpx.QueryParams(request.read().decode()))
+        self.sent.append(data['chat_id'])
+        if data['chat_id'] == '1002':
+            return httpx.Response(403, json={
+                'ok': False, 'error_code': 403, 'description': 'Forbidden: bot was blocked by the user',
+            })
+        return httpx.Response(200, json={'ok': True, 'result': {'message_id': 1}})
+
+    def drain(self, **kwargs):
+        client = bot_api(self.handler)
+        kwargs.setdefault('limiter', RateLimiter(global_rate=1000, private_rate=1000, group_rate=1000))
+        worker = BroadcastWorker(client, **kwargs)
+
+        async def run():
+            try:
+                return await worker.drain()
+            finally:
+                await client.aclose()
+
+        return async_to_sync(run)()
+
+    def test_every_product_goes_to_every_active_target(self):
+        BroadcastTarget.objects.create(chat_id='1003', is_active=False)
+        broadcast = create_broadcast(Product.objects.all())
+
+        self.assertEqual(self.drain(), 6)
+
+        self.assertEqual(sorted(set(self.sent)), ['-100200', '1001', '1002'])
+        self.assertEqual(len(self.sent) - self.sent.count('1002'), 4)
+        self.assertEqual(broadcast.counts(), {'pending': 0, 'sent': 4, 'failed': 2})
+        broadcast.refresh_from_db()
+        self.assertIsNotNone(broadcast.date_finished)
+
+    def test_blocked_chat_is_deactivated(self):
+        broadcast = create_broadcast(Product.objects.all())
+        self.drain()
+
+        self.assertFalse(BroadcastTarget.objects.get(chat_id='1002').is_active)
+        failed = broadcast.deliveries.filter(status=BroadcastDelivery.STATUS_FAILED)
+        self.assertEqual({d.target.chat_id for d in failed}, {'1002'})
+        self.assertEqual(create_broadcast(Product.objects.all()).deliveries.count(), 4)
+
+    def test_resumes_with_the_unsent_deliveries(self):
+        broadcast = create_broadcast(Product.objects.all(), targets=self.targets[:1] + self.targets[2:])
+        done = broadcast.deliveries.order_by('pk')[:3]
+        BroadcastDelivery.objects.filter(pk__in=done).update(status=BroadcastDelivery.STATUS_SENT)
+
+        self.assertEqual(self.drain(), 1)
+        self.assertEqual(len(self.sent), 1)
+        self.assertEqual(broadcast.counts()['sent'], 4)
+
+    def test_busy_chat_is_postponed(self):
+        broadcast = create_broadcast(Product.objects.all(), targets=self.targets[2:])
+
+        self.drain(limiter=RateLimiter(), max_throttle_wait=1)
+
+        self.assertEqual(self.sent, ['-100200'])
+        postponed = broadcast.deliveries.get(status=BroadcastDelivery.STATUS_PENDING)
+        self.assertEqual(postponed.attempts, 0)
+        self.assertGreater(postponed.next_attempt_at, timezone.now() + timedelta(seconds=2))
+        broadcast.refresh_from_db()
+        self.assertIsNone(broadcast.date_finished)
+
+    def test_post_is_addressed_to_the_target(self):
+        create_broadcast(self.products[:1], targets=self.targets[:1])
+        requests = []
+
+        def handler(request):
+            requests.append(dict(httpx.QueryParams(request.read().decode())))
+            return httpx.Response(200, json={'ok': True, 'result': {}})
+
+        self.handler = handler
+        self.drain()
+        self.assertEqual(requests[0]['chat_id'], '1001')
+        self.assertIn('Phone', requests[0]['text'])
+
+    def test_post_shows_the_stock_on_hand(self):
+        # Both were bought 10 at a time; 6 phones sold since, the tablets are gone.
+        Stock.objects.filter(product=self.products[0]).update(quantity_in_stock=4)
+        Stock.objects.filter(product=self.products[1]).delete()
+        create_broadcast(self.products, targets=self.targets[:1])
+        requests = []
+
+        def handler(request):
+            requests.append(dict(httpx.QueryParams(request.read().decode())))
+            return httpx.Response(200, json={'ok': True, 'result': {}})
+
+        self.handler = handler
+        self.drain()
+        texts = {request['text'].split('</b>')[0]: request['text'] for request in requests}
+        self.assertIn('<b>Quantity Available:</b> 4\n', texts['<b>New Stock Added for Phone'])
+        self.assertIn('<b>Quantity Available:</b> 0\n', texts['<b>New Stock Added for Tablet'])
+
+
+class CsvExportTests(TestCase):
+    def setUp(self):
+        self.product = create_product()
+        for i in range(5):
+            Order.objects.create(product=self.product, address=f'Street {i}', phone_number='0911000000')
+        self.request = RequestFactory().get('/')
+
+    def export(self, model, queryset):
+        response = admin.site._registry[model].export_as_csv(self.request, queryset)
+        self.assertTrue(response.streaming)
+        return b''.join(response.streaming_content).decode().splitlines()
+
+    def test_order_export_uses_one_query(self):
+        with self.assertNumQueries(1):
+            lines = self.export(Order, Order.objects.all())
+
+        self.assertEqual(lines[0], 'Product,Full Name,Address,Phone Number,Comment,Quantity,Order Date,Is Paid')
+        self.assertEqual(len(lines), 6)
+        self.assertTrue(lines[1].startswith('Phone,,Street'))
+
+    def test_purchase_export_joins_brand(self):
+        with self.assertNumQueries(1):
+            lines = self.export(Purchase, Purchase.objects.all())
+
+        self.assertEqual(len(lines), 2)
+        self.assertTrue(lines[1].startswith('Phone,,Acme,10,'))
+
+    def test_export_streams_under_asgi(self):
+        # Django's ASGI handler would read a plain sync iterator whole first.
+        produced = []
+
+        def rows():
+            for i in range(2000):
+                produced.append(i)
+                yield [i, 'Phone']
+
+        sent = []
+
+        async def send(message):
+            if message['type'] == 'http.response.body':
+                sent.append((len(produced), message.get('body', b'')))
+
+        response = exports.stream_csv('big.csv', ['Id', 'Name'], rows())
+        async_to_sync(ASGIHandler().send_response)(response, send)
+
+        self.assertGreater(len(sent), 4)
+        self.assertLess(sent[0][0], 2000)  # sent before the rows were all produced
+        lines = b''.join(body for _, body in sent).decode().splitlines()
+        self.assertEqual((lines[0], lines[-1], len(lines)), ('Id,Name', '1999,Phone', 2001))
+
+        # Database-backed exports read their cursor in the request's thread.
+        sent.clear()
+        response = admin.site._registry[Order].export_as_csv(self.request, Order.objects.all())
+        async_to_sync(ASGIHandler().send_response)(response, send)
+        self.assertEqual(len(b''.join(body for _, body in sent).decode().splitlines()), 6)
+
+
+class ExcelExportTests(TestCase):
+    def setUp(self):
+        self.export_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.export_root)
+        export_settings = override_settings(EXPORT_ROOT=self.export_root, EXPORT_BACKGROUND_THRESHOLD=3)
+        export_settings.enable()
+        self.addCleanup(export_settings.disable)
+
+        self.product = create_product()
+        self.user = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.request = RequestFactory().post('/')
+        self.request.user = self.user
+        self.request.session = {}
+        self.request._messages = FallbackStorage(self.request)
+        self.order_admin = admin.site._registry[Order]
+
+    def create_orders(self, count):
+        for i in range(count):
+            Order.objects.create(product=self.product, address=f'Street {i}', phone_number='0911000000')
+
+    def test_small_selection_is_returned_directly(self):
+        self.create_orders(3)
+
+        with self.assertNumQueries(2):
+            response = self.order_admin.export_as_excel(self.request, Order.objects.all())
+            content = b''.join(response.streaming_content)
+
+        sheet = load_workbook(io.BytesIO(content)).active
+        rows = list(sheet.values)
+        self.assertEqual(rows[0][0], 'Product')
+        self.assertEqual(len(rows), 4)
+        self.assertEqual(rows[1][0], 'Phone')
+
+    def test_large_selection_runs_in_background(self):
+        self.create_orders(4)
+
+        with self.captureOnCommitCallbacks() as callbacks:
+            response = self.order_admin.export_as_excel(self.request, Order.objects.filter(quantity=1))
+
+        self.assertIsNone(response)
+        self.assertEqual(len(callbacks), 1)
+        job = ExportJob.objects.get()
+        self.assertEqual(job.status, ExportJob.STATUS_PENDING)
+        self.assertEqual(job.requested_by, self.user)
+        self.assertEqual(sorted(job.selection['ids']), sorted(Order.objects.values_list('pk', flat=True)))
+
+        run_export_job(job.pk)
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, ExportJob.STATUS_DONE)
+        self.assertEqual(job.row_count, 4)
+        with job.file.open('rb') as f:
+            self.assertEqual(len(list(load_workbook(f).active.values)), 5)
+
+        self.client.force_login(self.user)
+        response = self.client.get(f'/admin/shop/exportjob/{job.pk}/download/')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('attachment', response['Content-Disposition'])
+
+    def test_stored_selection_keeps_rows_and_order(self):
+        self.create_orders(5)
+        queryset = Order.objects.exclude(address='Street 2').order_by('-address')
+
+        rows = list(exports.selected_rows(exports.ORDERS, exports.selection(queryset), batch_size=2))
+
+        self.assertEqual([row[2] for row in rows], ['Street 4', 'Street 3', 'Street 1', 'Street 0'])
+
+    def test_jobs_interrupted_by_a_restart_fail(self):
+        pending = ExportJob.objects.create(kind='orders', selection={'ids': [], 'ordering': []})
+        done = ExportJob.objects.create(kind='orders', status=ExportJob.STATUS_DONE)
+
+        call_command('run_export_jobs', '--fail-interrupted', stdout=io.StringIO())
+
+        pending.refresh_from_db()
+        done.refresh_from_db()
+        self.assertEqual((pending.status, done.status), (ExportJob.STATUS_FAILED, ExportJob.STATUS_DONE))
+        self.assertIn('restart', pending.error)
+
+
+class ProductApiTests(TestCase):
+    def setUp(self):
+        self.product = create_product()
+
+    def test_list_query_count_does_not_grow_with_products(self):
+        for i in range(5):
+            Product.objects.create(
+                name=f'Phone {i}', category=self.product.category, subcategory=self.product.subcategory,
+                brand=self.product.brand, model=self.product.model, quantity=i + 1, price='10.00',
+            )
+
+        # Two catalog version aggregates for the ETag, then the page itself.
+        with self.assertNumQueries(3):
+            response = self.client.get('/api/products/')
+
+        self.assertEqual(response.status_code, 200)
+        stock = {item['id']: item['available_stock'] for item in response.json()['results']}
+        self.assertEqual(len(stock), 6)
+        self.assertEqual(stock[self.product.pk], 10)
+
+    def test_product_without_stock_reports_zero(self):
+        Stock.objects.filter(product=self.product).delete()
+
+        response = self.client.get(f'/api/products/{self.product.pk}/')
+
+        self.assertEqual(response.json()['available_stock'], 0)
+
+
+class PaymentStockTests(TestCase):
+    def setUp(self):
+        self.product = create_product(quantity=5)
+        self.order = Order.objects.create(
+            product=self.product, address='Bole', phone_number='0911000000', quantity=2
+        )
+
+    def stock(self):
+        return Stock.objects.get(product=self.product).quantity_in_stock
+
+    def test_paying_takes_stock_once(self):
+        self.order.is_paid = True
+        self.order.save()
+        self.assertEqual(self.stock(), 3)
+
+        self.order.address = 'Bole, corrected'
+        self.order.save()
+        self.assertEqual(self.stock(), 3)
+
+    def test_stale_copy_does_not_take_stock_again(self):
+        stale = Order.objects.get(pk=self.order.pk)
+        self.order.is_paid = True
+        self.order.save()
+
+        stale.is_paid = True
+        stale.save()
+
+        self.assertEqual(self.stock(), 3)
+
+    def test_payment_uses_no_select(self):
+        self.order.is_paid = True
+        with self.assertNumQueries(10):
+            # savepoint, claim, order update, stock update, stock movement,
+            # both sales rollups out of unpaid and into paid, release
+            self.order.save()
+
+    def test_insufficient_stock_rolls_back(self):
+        self.order.quantity = 6
+        self.order.is_paid = True
+
+        with self.assertRaisesMessage(ValidationError, "Not enough stock available."):
+            self.order.save()
+
+        self.assertEqual(self.stock(), 5)
+        self.assertFalse(Order.objects.get(pk=self.order.pk).is_paid)
+
+    def test_order_created_as_paid_takes_stock(self):
+        Order.objects.create(product=self.product, address='Bole', phone_number='0911000000', is_paid=True)
+        self.assertEqual(self.stock(), 4)
+
+
+class SalesRollupTests(TestCase):
+    def setUp(self):
+        self.product = create_product(price=Decimal('100.00'))
+
+    def order(self, **kwargs):
+        return Order.objects.create(
+            **{'product': self.product, 'address': 'Bole', 'phone_number': '0911000000', **kwargs}
+        )
+
+    def rollup(self, model=SalesRollup):
+        return sorted(model.objects.values_list(
+            *sales.key_fields(model), 'orders', 'quantity', 'revenue',
+        ))
+
+    def assertMatchesRebuild(self):
+        # Rows emptied by changes stay behind with zero orders.
+        incremental = {model: [row for row in self.rollup(model) if row[-3]] for model in sales.ROLLUPS}
+        sales.rebuild()
+        for model in sales.ROLLUPS:
+            self.assertEqual(incremental[model], self.rollup(model))
+
+    def test_orders_are_counted_as_they_change(self):
+        first = self.order(quantity=3)
+        self.order(quantity=1, order_type='online', payment_method='telebirr')
+        stale = Order.objects.get(pk=first.pk)
+        first.is_paid = True
+        first.save()
+        stale.is_paid = True
+        stale.save()  # loaded as unpaid, but the payment is only counted once
+        self.order(quantity=1).delete()
+
+        paid = SalesRollup.objects.get(is_paid=True)
+        self.assertEqual((paid.orders, paid.quantity, paid.revenue), (1, 3, Decimal('300.00')))
+        self.assertMatchesRebuild()
+
+    def test_failed_payment_leaves_the_rollup_alone(self):
+        order = self.order(quantity=20)
+        before = self.rollup()
+        order.is_paid = True
+        with self.assertRaises(ValidationError):
+            order.save()
+        self.assertEqual(self.rollup(), before)
+
+    def test_rebuild_since_keeps_earlier_days(self):
+        order = self.order()
+        Order.objects.filter(pk=order.pk).update(order_date=timezone.now() - timedelta(days=3))
+        self.order(quantity=2)
+        sales.rebuild()
+        SalesRollup.objects.update(orders=99)
+        DailySales.objects.update(orders=99)
+
+        sales.rebuild(since=timezone.localdate())
+
+        self.assertEqual(sorted(SalesRollup.objects.values_list('orders', flat=True)), [1, 99])
+        self.assertEqual(sorted(DailySales.objects.values_list('orders', flat=True)), [1, 99])
+
+    def test_api_groups_the_rollup(self):
+        self.order(quantity=2, is_paid=True)
+        self.order(quantity=1, payment_method='cash')
+        self.client.force_login(User.objects.create_user('staff', password='x', is_staff=True))
+
+        with self.assertNumQueries(4):  # session, user, groups, totals
+            response = self.client.get('/api/sales/', {'group_by': 'brand,is_paid', 'from': '2000-01-01'})
+
+        data = response.json()
+        self.assertEqual(data['totals'], {'orders': 2, 'quantity': 3, 'revenue': 300.0})
+        self.assertEqual(
+            [(row['brand_name'], row['is_paid'], row['orders']) for row in data['results']],
+            [('Acme', False, 1), ('Acme', True, 1)],
+        )
+        with self.assertNumQueries(4):
+            daily = self.client.get('/api/sales/', {'group_by': 'month', 'is_paid': 'true'}).json()
+        self.assertEqual(daily['totals'], {'orders': 1, 'quantity': 2, 'revenue': 200.0})
+        self.assertEqual(len(daily['results']), 1)
+        self.assertEqual(self.client.get('/api/sales/', {'group_by': 'colour'}).status_code, 400)
+        self.client.logout()
+        self.assertEqual(self.client.get('/api/sales/').status_code, 403)
+
+    def test_admin_shows_totals_of_the_filtered_rows(self):
+        self.order(quantity=2, is_paid=True)
+        self.order(quantity=5)
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'password'))
+
+        response = self.client.get('/admin/shop/dailysales/', {'is_paid__exact': '1'})
+
+        self.assertEqual(response.context['sales_totals'], {'orders': 1, 'quantity': 2, 'revenue': Decimal('200.00')})
+
+
+class StockLedgerTests(TestCase):
+    def setUp(self):
+        self.product = create_product(quantity=10)
+
+    def stock(self):
+        return Stock.objects.get(product=self.product).quantity_in_stock
+
+    def movements(self):
+        return list(StockMovement.objects.order_by('pk').values_list('kind', 'quantity'))
+
+    def test_every_stock_change_is_recorded(self):
+        self.product.quantity = 15
+        self.product.save()
+        self.product.quantity = 12
+        self.product.save()
+        Order.objects.create(product=self.product, address='Bole', phone_number='0911000000', quantity=2, is_paid=True)
+
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'password'))
+        stock = Stock.objects.get(product=self.product)
+        self.client.post('/admin/shop/stock/', {'action': 'restock_items', '_selected_action': [stock.pk]})
+        response = self.client.post(f'/admin/shop/stock/{stock.pk}/change/', {
+            'product': self.product.pk, 'quantity_in_stock': 11,
+        })
+        self.assertEqual(response.status_code, 302)
+
+        self.assertEqual(self.movements(), [
+            ('purchase', 10), ('purchase', 5), ('adjustment', -3), ('sale', -2), ('restock', 10), ('adjustment', -9),
+        ])
+        self.assertEqual(sum(quantity for _, quantity in self.movements()), self.stock())
+        sale = StockMovement.objects.get(kind='sale')
+        self.assertEqual((sale.order.quantity, sale.unit_price), (2, Decimal('100.00')))
+        self.assertEqual(StockMovement.objects.get(kind='restock').user.username, 'admin')
+
+    def test_import_is_recorded(self):
+        self.product.code = 'P-1'
+        self.product.save()
+        CatalogImporter().run(read_rows(io.BytesIO(
+            CatalogImportTests.HEADER.encode() + b'P-1,Phone,,,,,,14,100\nP-2,Case,,Phones,Smart,Acme,X1,3,20\n'
+        ), 'products.csv'))
+
+        self.assertEqual(self.movements(), [('purchase', 10), ('purchase', 3), ('purchase', 4)])
+        self.assertEqual(StockMovement.objects.filter(purchase__isnull=False).count(), 3)
+
+    def test_movements_are_append_only(self):
+        movement = StockMovement.objects.get()
+        movement.quantity = 100
+        with self.assertRaises(ValidationError):
+            movement.save()
+
+    def test_inventory_at_reads_a_snapshot_and_the_movements_after_it(self):
+        StockSnapshot.objects.all().delete()  # the migration's opening balance
+        with self.assertRaises(ValueError):
+            inventory.inventory_at()
+        inventory.take_snapshot()
+        order = Order.objects.create(product=self.product, address='Bole', phone_number='0911000000', quantity=3)
+        order.is_paid = True
+        order.save()
+        after_sale = timezone.now()
+        self.product.price = Decimal('120.00')
+        self.product.quantity = 14
+        self.product.save()
+        later = inventory.take_snapshot()
+        self.product.quantity = 20
+        self.product.save()
+
+        with self.assertNumQueries(3):  # snapshot, its items, the movements since
+            holding = inventory.inventory_at(after_sale)[self.product.pk]
+        self.assertEqual((holding.quantity, holding.value), (7, Decimal('700.00')))
+        self.assertEqual(inventory.inventory_at(later.taken_at)[self.product.pk].quantity, 11)
+        self.assertEqual(inventory.inventory_at()[self.product.pk].quantity, self.stock())
+        self.assertEqual(inventory.valuation_at(), {'quantity': 17, 'value': Decimal('2040.00')})
+
+    def test_deleting_a_product_keeps_its_history(self):
+        inventory.take_snapshot()
+        self.product.quantity = 4
+        self.product.save()
+        before_delete = timezone.now()
+        product_pk = self.product.pk
+        self.product.delete()
+
+        self.assertEqual(self.movements(), [('purchase', 10), ('adjustment', -6)])
+        movement = StockMovement.objects.first()
+        self.assertEqual((movement.product, movement.product_pk), (None, product_pk))
+        self.assertEqual(inventory.inventory_at(before_delete)[product_pk].quantity, 4)
+
+
+class ImageVariantTests(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        media_settings = override_settings(MEDIA_ROOT=self.media_root)
+        media_settings.enable()
+        self.addCleanup(media_settings.disable)
+        photo = io.BytesIO()
+        Image.new('RGB', (3000, 2000), 'red').save(photo, 'JPEG', quality=95)
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.product = create_product(image=SimpleUploadedFile('phone.jpg', photo.getvalue()))
+        self.scheduled = callbacks
+
+    def open_variant(self, variant):
+        return Image.open(os.path.join(self.media_root, images.variant_name(self.product, variant)))
+
+    def test_upload_schedules_variants_after_commit(self):
+        self.assertEqual(len(self.scheduled), 1)
+        images.generate(self.product)
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.product.name = 'Phone 2'
+            self.product.save()
+        self.assertEqual(callbacks, [])  # the variants are of the current image
+
+    def test_variants_are_resized_and_recorded(self):
+        images.generate(self.product)
+        self.product.refresh_from_db()
+
+        self.assertTrue(images.is_current(self.product))
+        for variant, (size, image_format) in {'thumb': (100, 'WEBP'), 'card': (800, 'WEBP'),
+                                              'telegram': (1280, 'JPEG')}.items():
+            with self.open_variant(variant) as image:
+                self.assertEqual((max(image.size), image.format), (size, image_format))
+            self.assertEqual(max(self.product.image_variants[variant]['width'],
+                                 self.product.image_variants[variant]['height']), size)
+        self.assertLess(self.product.image_variants['card']['bytes'], self.product.image.size)
+
+        # A new image makes the old variants stale until they are regenerated.
+        old_thumb = images.variant_name(self.product, 'thumb')
+        photo = io.BytesIO()
+        Image.new('RGB', (500, 500), 'blue').save(photo, 'PNG')
+        self.product.image = SimpleUploadedFile('other.png', photo.getvalue())
+        self.product.save()
+        self.assertEqual(images.variant_name(self.product, 'thumb'), self.product.image.name)
+        images.generate(self.product)
+        self.assertFalse(os.path.exists(os.path.join(self.media_root, old_thumb)))
+        with self.open_variant('card') as image:
+            self.assertEqual(image.size, (500, 500))  # never enlarged
+
+    def test_products_never_touch_each_others_variants(self):
+        photo = io.BytesIO()
+        Image.new('RGB', (400, 300), 'green').save(photo, 'JPEG')
+        for directory in ('2025', '2026'):
+            os.makedirs(os.path.join(self.media_root, directory))
+            with open(os.path.join(self.media_root, directory, 'photo.jpg'), 'wb') as f:
+                f.write(photo.getvalue())
+        first = Product.objects.get(pk=self.product.pk)
+        first.image = '2025/photo.jpg'
+        first.save()
+        second = create_product(name='Other', image='2026/photo.jpg')
+
+        images.generate(first)
+        images.generate(second)
+        names = {product.pk: images.variant_name(product, 'card') for product in (first, second)}
+        self.assertNotEqual(names[first.pk], names[second.pk])
+
+        images.generate(first)  # regenerating picks a new name and removes the old file
+        self.assertNotEqual(images.variant_name(first, 'card'), names[first.pk])
+        self.assertFalse(os.path.exists(os.path.join(self.media_root, names[first.pk])))
+        self.assertTrue(os.path.exists(os.path.join(self.media_root, names[second.pk])))
+
+    def test_variants_are_served_where_the_image_is_shown(self):
+        response = self.client.get(f'/api/products/{self.product.pk}/')
+        self.assertEqual(response.json()['image_variants'], {})
+
+        images.generate(self.product)
+        self.product.refresh_from_db()
+        response = self.client.get(f'/api/products/{self.product.pk}/')
+        card = response.json()['image_variants']['card']
+        self.assertEqual((card['width'], card['height']), (800, 533))
+        self.assertTrue(card['url'].endswith('-card.webp'))
+
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'password'))
+        response = self.client.get('/admin/shop/product/')
+        self.assertContains(response, '-thumb.webp')
+
+        Telegram.objects.create(stock=Stock.objects.get(product=self.product))
+        self.assertTrue(TelegramOutbox.objects.get().payload['photo_path'].endswith('-telegram.jpg'))
+
+
+class MediaServingTests(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        media_settings = override_settings(MEDIA_ROOT=self.media_root)
+        media_settings.enable()
+        self.addCleanup(media_settings.disable)
+        os.makedirs(os.path.join(self.media_root, 'product_images'))
+        self.data = bytes(range(256)) * 40
+        with open(os.path.join(self.media_root, 'product_images', 'phone.jpg'), 'wb') as f:
+            f.write(self.data)
+        self.url = '/media/product_images/phone.jpg'
+
+    def test_file_is_served_with_validators_and_cache_headers(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), self.data)
+        self.assertEqual((response['Content-Type'], response['Content-Length']), ('image/jpeg', str(len(self.data))))
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertIn('max-age=2592000', response['Cache-Control'])
+
+        cached = self.client.get(self.url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(cached.status_code, 304)
+        self.assertEqual(cached['ETag'], response['ETag'])
+        self.assertEqual(self.client.get(self.url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified']).status_code, 304)
+
+    def test_byte_ranges(self):
+        response = self.client.get(self.url, HTTP_RANGE='bytes=100-199')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(b''.join(response.streaming_content), self.data[100:200])
+        self.assertEqual(response['Content-Range'], f'bytes 100-199/{len(self.data)}')
+        self.assertEqual(response['Content-Length'], '100')
+
+        response = self.client.get(self.url, HTTP_RANGE='bytes=-10')
+        self.assertEqual(b''.join(response.streaming_content), self.data[-10:])
+        response = self.client.get(self.url, HTTP_RANGE='bytes=10000-')
+        self.assertEqual(b''.join(response.streaming_content), self.data[10000:])
+
+        response = self.client.get(self.url, HTTP_RANGE='bytes=20000-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], f'bytes */{len(self.data)}')
+        # The file changed since the client's partial copy: send all of it.
+        response = self.client.get(self.url, HTTP_RANGE='bytes=0-9', HTTP_IF_RANGE='"other"')
+        self.assertEqual(response.status_code, 200)
+
+    def test_files_stream_in_chunks_under_asgi(self):
+        with open(os.path.join(self.media_root, 'product_images', 'big.jpg'), 'wb') as f:
+            f.write(self.data * 20)
+        bodies = []
+
+        async def send(message):
+            if message['type'] == 'http.response.body':
+                bodies.append(message.get('body', b''))
+
+        for range_header, expected in [(None, self.data * 20), ('bytes=100-99999', (self.data * 20)[100:100000])]:
+            bodies.clear()
+            headers = {'HTTP_RANGE': range_header} if range_header else {}
+            response = self.client.get('/media/product_images/big.jpg', **headers)
+            async_to_sync(ASGIHandler().send_response)(response, send)
+            self.assertEqual(b''.join(bodies), expected)
+            self.assertGreater(len(bodies), 2)
+
+    def test_paths_outside_media_root_are_not_served(self):
+        for path in ('/media/../manage.py', '/media/%2e%2e/manage.py', '/media/product_images/', '/media/missing.jpg'):
+            self.assertEqual(self.client.get(path).status_code, 404, path)
+        self.assertEqual(self.client.post(self.url).status_code, 405)
+
+    @override_settings(MEDIA_ACCEL_REDIRECT='/protected-media/')
+    def test_accel_redirect_leaves_the_body_to_the_proxy(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response['X-Accel-Redirect'], '/protected-media/product_images/phone.jpg')
+        self.assertEqual(response.content, b'')
+        self.assertEqual(response['Content-Type'], 'image/jpeg')
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+
+
+class ConcurrentPaymentTests(TransactionTestCase):
+    def setUp(self):
+        self.product = create_product(quantity=150)
+
+    def confirm(self, order_id):
+        try:
+            order = Order.objects.get(pk=order_id)
+            order.is_paid = True
+            order.save()
+            return True
+        except ValidationError:
+            return False
+        finally:
+            connection.close()
+
+    def confirm_all(self, order_ids):
+        with ThreadPoolExecutor(max_workers=16) as pool:
+            return list(pool.map(self.confirm, order_ids))
+
+    def test_parallel_payments_never_oversell(self):
+        order_ids = [
+            Order.objects.create(product=self.product, address='Bole', phone_number='0911000000').pk
+            for _ in range(300)
+        ]
+
+        results = self.confirm_all(order_ids)
+
+        self.assertEqual(results.count(True), 150)
+        self.assertEqual(Stock.objects.get(product=self.product).quantity_in_stock, 0)
+        self.assertEqual(Order.objects.filter(is_paid=True).count(), 150)
+
+    def test_parallel_confirmations_of_one_order_take_stock_once(self):
+        order = Order.objects.create(product=self.product, address='Bole', phone_number='0911000000', quantity=3)
+
+        self.confirm_all([order.pk] * 200)
+
+        self.assertEqual(Stock.objects.get(product=self.product).quantity_in_stock, 147)
+
+
+class SqliteProfileTests(TestCase):
+    def test_connections_use_the_production_pragmas(self):
+        with connection.cursor() as cursor:
+            pragmas = {
+                name: cursor.execute(f'PRAGMA {name}').fetchone()[0]
+                for name in ('journal_mode', 'synchronous', 'busy_timeout')
+            }
+        self.assertEqual(pragmas, {'journal_mode': 'wal', 'synchronous': 1, 'busy_timeout': 20000})
+        self.assertEqual(connection.transaction_mode, 'IMMEDIATE')
+
+
+class WriteQueueTests(TransactionTestCase):
+    def setUp(self):
+        self.product = create_product(quantity=50)
+
+    def test_failed_write_only_rolls_back_itself(self):
+        def fail():
+            Order.objects.create(product=self.product, address='Bole', phone_number='0911000001')
+            raise ValidationError("Not enough stock available.")
+
+        order = Order(product=self.product, address='Bole', phone_number='0911000000')
+        futures = [Future(), Future()]
+        db.WriteQueue().commit([(futures[0], fail, (), {}), (futures[1], order.save, (), {})])
+
+        self.assertRaises(ValidationError, futures[0].result)
+        futures[1].result()
+        self.assertEqual(list(Order.objects.values_list('phone_number', flat=True)), ['0911000000'])
+
+    @override_settings(SQLITE_WRITE_QUEUE=True)
+    def test_concurrent_writes_go_through_one_thread(self):
+        threads = set()
+
+        def create(i):
+            threads.add(threading.current_thread().name)
+            Order.objects.create(product=self.product, address='Bole', phone_number=f'09110000{i:02d}')
+            return i
+
+        def client(i):
+            try:
+                return db.write(create, i)
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            self.assertEqual(list(pool.map(client, range(40))), list(range(40)))
+        self.assertEqual(Order.objects.count(), 40)
+        self.assertEqual(threads, {'sqlite-writer'})
+
+    @override_settings(SQLITE_WRITE_QUEUE=True)
+    def test_checkout_writes_through_the_queue(self):
+        response = async_to_sync(self.async_client.post)(
+            f'/api/webapp/?tgWebAppStartParam=product-{self.product.pk}',
+            {'full_name': 'Abebe', 'address': 'Bole', 'phone_number': '0911000000', 'quantity': 2},
+        )
+        order = Order.objects.get()
+        self.assertRedirects(response, f'/api/payment/{order.pk}/', fetch_redirect_response=False)
+        self.assertEqual(order.total_price, Decimal('200.00'))
+
+
+class LoggingTests(TestCase):
+    def record(self, msg='Order %s created', args=(7,), level=logging.INFO, **extra):
+        record = logging.LogRecord('shop.views', level, __file__, 1, msg, args, None)
+        record.__dict__.update(extra)
+        return record
+
+    def test_json_lines_carry_the_extra_fields(self):
+        line = json.loads(JsonFormatter().format(self.record(order_id=7)))
+        self.assertEqual(line['message'], 'Order 7 created')
+        self.assertEqual(line['level'], 'INFO')
+        self.assertEqual(line['order_id'], 7)
+        self.assertNotIn('args', line)
+
+    def test_sampling_keeps_warnings(self):
+        drop_all = SamplingFilter(rate=0)
+        self.assertFalse(drop_all.filter(self.record()))
+        self.assertTrue(drop_all.filter(self.record(level=logging.WARNING)))
+        kept = self.record()
+        self.assertTrue(SamplingFilter(rate=1).filter(kept))
+        self.assertEqual(kept.sample_rate, 1.0)
+
+    def test_queue_handler_formats_in_the_background(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'logs', 'app.log')
+        handler = QueueHandler({'class': 'logging.FileHandler', 'filename': path})
+        handler.setFormatter(JsonFormatter())
+        formatted_in = []
+
+        class Arg:
+            def __str__(self):
+                formatted_in.append(threading.current_thread())
+                return 'arg'
+
+        handler.handle(self.record('Value %s', (Arg(),)))
+        handler.close()
+
+        self.assertNotIn(threading.current_thread(), formatted_in)
+        with open(path) as f:
+            self.assertEqual(json.loads(f.read())['message'], 'Value arg')
+
+    def test_full_queue_drops_instead_of_blocking(self):
+        handler = QueueHandler({'class': 'logging.NullHandler'}, maxsize=1)
+        handler.listener.stop()
+        self.addCleanup(handler.target.close)
+        handler.listener = None
+        for _ in range(3):
+            handler.handle(self.record())
+        self.assertEqual(handler.dropped, 2)
+        handler.queue.get_nowait()
+        handler.handle(self.record())
+        self.assertEqual(handler.queue.get_nowait().dropped_before, 2)
+
+
+class MetricsTests(TestCase):
+    def setUp(self):
+        previous = metrics.registry
+        metrics.registry = metrics.Registry()
+        self.addCleanup(setattr, metrics, 'registry', previous)
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def test_requests_are_recorded_per_route(self):
+        product = create_product()
+        self.client.get('/api/products/')
+        self.client.get(f'/api/webapp/?tgWebAppStartParam=product-{product.pk}')
+        self.client.get('/no-such-page/')
+
+        series = metrics.registry.snapshot()['series']
+        listing = series['product-list GET']
+        self.assertEqual(listing['count'], 1)
+        self.assertEqual(listing['statuses'], {'200': 1})
+        self.assertGreater(listing['queries_sum'], 0)
+        self.assertGreater(listing['response_bytes'], 0)
+        self.assertGreater(series['webapp_view GET']['queries_sum'], 0)
+        self.assertEqual(series['unmatched GET']['statuses'], {'404': 1})
+
+    def test_render_writes_cumulative_histograms(self):
+        for duration in (0.002, 0.03, 20):
+            metrics.registry.record('product-list', 'GET', 200, duration, 1, 0.001, 10)
+
+        text = metrics.render(metrics.registry.snapshot())
+
+        self.assertIn('shop_http_requests_total{route="product-list",method="GET",status="200"} 3', text)
+        self.assertIn('shop_http_request_duration_seconds_bucket{route="product-list",method="GET",le="0.005"} 1', text)
+        self.assertIn('shop_http_request_duration_seconds_bucket{route="product-list",method="GET",le="0.05"} 2', text)
+        self.assertIn('shop_http_request_duration_seconds_bucket{route="product-list",method="GET",le="+Inf"} 3', text)
+        self.assertIn('shop_db_queries_count{route="product-list",method="GET"} 3', text)
+        self.assertIn('shop_http_response_bytes_total{route="product-list",method="GET"} 30', text)
+
+    def test_workers_are_added_up_and_exited_ones_kept(self):
+        exited = subprocess.run([sys.executable, '-c', 'import os; print(os.getpid())'],
+                                capture_output=True, text=True)
+        other = metrics.Registry()
+        other.record('product-list', 'GET', 200, 0.01, 2, 0.001, 100)
+        metrics.write_json(os.path.join(self.directory, f'{exited.stdout.strip()}-1.json'), other.snapshot())
+        metrics.registry.record('product-list', 'GET', 500, 0.01, 3, 0.001, 50)
+
+        with override_settings(METRICS_DIR=self.directory):
+            first = metrics.collect()
+            second = metrics.collect()
+
+        self.assertEqual(first, second)
+        listing = first['series']['product-list GET']
+        self.assertEqual(listing['count'], 2)
+        self.assertEqual(listing['statuses'], {'200': 1, '500': 1})
+        self.assertEqual(listing['queries_sum'], 5)
+        self.assertEqual(sorted(os.listdir(self.directory)),
+                         sorted(['.lock', metrics.EXITED, metrics.registry.filename]))
+
+    @override_settings(METRICS_TOKEN='secret')
+    def test_endpoint_needs_the_token(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+        response = self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer secret')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('# TYPE shop_http_request_duration_seconds histogram', response.content.decode())
+
+    def test_endpoint_without_token_is_for_staff_only(self):
+        self.assertEqual(self.client.get('/metrics', REMOTE_ADDR='127.0.0.1').status_code, 403)
+        self.assertEqual(self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer ').status_code, 403)
+        self.client.force_login(User.objects.create_user('staff', password='x', is_staff=True))
+        self.assertEqual(self.client.get('/metrics').status_code, 200)
+
+    def test_unknown_methods_share_one_series(self):
+        self.client.generic('BREW', '/api/products/')
+        self.client.generic('PURGE', '/api/products/')
+        self.client.get('/api/products/')
+
+        series = metrics.registry.snapshot()['series']
+        self.assertEqual(sorted(series), ['product-list GET', 'product-list other'])
+        self.assertEqual(series['product-list other']['count'], 2)
+
+
+class ApiPaginationTests(TestCase):
+    def setUp(self):
+        self.product = create_product()
+        now = timezone.now()
+        for i in range(7):
+            order = Order.objects.create(
+                product=self.product, address='Bole', phone_number='0911000000',
+                is_paid=i % 2 == 0, order_type='online' if i < 3 else 'manual',
+            )
+            Order.objects.filter(pk=order.pk).update(order_date=now - timedelta(days=i))
+
+    def test_orders_are_paged_with_a_cursor(self):
+        response = self.client.get('/api/orders/', {'page_size': 3})
+        page = response.json()
+        self.assertEqual(len(page['results']), 3)
+        self.assertIsNone(page['previous'])
+
+        seen = [order['id'] for order in page['results']]
+        while page['next']:
+            page = self.client.get(page['next']).json()
+            seen += [order['id'] for order in page['results']]
+
+        self.assertEqual(seen, list(Order.objects.order_by('-order_date', '-id').values_list('pk', flat=True)))
+
+    def test_orders_can_be_filtered(self):
+        response = self.client.get('/api/orders/', {'is_paid': 'true', 'order_type': 'online'})
+        self.assertEqual(len(response.json()['results']), 2)
+
+        since = (timezone.localdate() - timedelta(days=1)).isoformat()
+        response = self.client.get('/api/orders/', {'ordered_after': since})
+        self.assertEqual(len(response.json()['results']), 2)
+
+    def test_invalid_filter_is_rejected(self):
+        response = self.client.get('/api/orders/', {'is_paid': 'maybe', 'order_type': 'fax'})
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(set(response.json()), {'is_paid', 'order_type'})
+
+    def test_products_can_be_filtered_by_brand(self):
+        response = self.client.get('/api/products/', {'brand': self.product.brand_id})
+        self.assertEqual([p['id'] for p in response.json()['results']], [self.product.pk])
+
+        response = self.client.get('/api/products/', {'brand': self.product.brand_id + 1})
+        self.assertEqual(response.json()['results'], [])
+
+
+class ConditionalGetTests(TestCase):
+    def setUp(self):
+        self.product = create_product()
+
+    def test_unchanged_list_is_not_modified(self):
+        response = self.client.get('/api/products/')
+        etag = response['ETag']
+        self.assertTrue(response.has_header('Last-Modified'))
+
+        with self.assertNumQueries(2):
+            response = self.client.get('/api/products/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        response = self.client.get('/api/products/', {'brand': self.product.brand_id}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_stock_change_invalidates_list_and_detail(self):
+        list_etag = self.client.get('/api/products/')['ETag']
+        detail_etag = self.client.get(f'/api/products/{self.product.pk}/')['ETag']
+
+        order = Order.objects.create(product=self.product, address='Bole', phone_number='0911000000')
+        order.is_paid = True
+        order.save()
+
+        response = self.client.get('/api/products/', HTTP_IF_NONE_MATCH=list_etag)
+        self.assertEqual(response.status_code, 200)
+        response = self.client.get(f'/api/products/{self.product.pk}/', HTTP_IF_NONE_MATCH=detail_etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['available_stock'], 9)
+
+    def test_detail_honours_if_modified_since(self):
+        response = self.client.get(f'/api/products/{self.product.pk}/')
+
+        response = self.client.get(
+            f'/api/products/{self.product.pk}/', HTTP_IF_MODIFIED_SINCE=response['Last-Modified']
+        )
+        self.assertEqual(response.status_code, 304)
+
+    def test_missing_product_is_still_404(self):
+        self.assertEqual(self.client.get('/api/products/999/').status_code, 404)
+
+
+class CompressionTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.product = create_product()
+
+    def test_encoding_negotiation(self):
+        for header, encoding in [
+            ('gzip, deflate, br', 'br'), ('gzip', 'gzip'), ('br;q=0.5, gzip', 'gzip'), ('*', 'br'),
+            ('br;q=0, *;q=0.1', 'gzip'), ('identity', None), ('', None), ('gzip;q=0', None),
+        ]:
+            self.assertEqual(compression.choose_encoding(header), encoding, header)
+
+    def test_catalog_list_is_compressed_once_per_catalog_version(self):
+        response = self.client.get('/api/products/', HTTP_ACCEPT_ENCODING='gzip, br')
+        self.assertEqual(response['Content-Encoding'], 'br')
+        self.assertIn('Accept-Encoding', response['Vary'])
+        self.assertTrue(response['ETag'].startswith('W/"'))
+        body = json.loads(brotli.decompress(response.content))
+        self.assertEqual(body, self.client.get('/api/products/').json())
+        self.assertEqual(self.client.get('/api/products/').get('Content-Encoding'), None)
+
+        with self.assertNumQueries(2):  # the catalog version; nothing is serialized
+            cached = self.client.get('/api/products/', HTTP_ACCEPT_ENCODING='br')
+        self.assertEqual(cached.content, response.content)
+        self.assertEqual((cached['ETag'], cached['Content-Encoding']), (response['ETag'], 'br'))
+        self.assertIn('Accept-Encoding', cached['Vary'])
+        not_modified = self.client.get('/api/products/', HTTP_ACCEPT_ENCODING='br', HTTP_IF_NONE_MATCH=cached['ETag'])
+        self.assertEqual(not_modified.status_code, 304)
+
+        self.product.name = 'Renamed'
+        self.product.save()
+        response = self.client.get('/api/products/', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(json.loads(gzip.decompress(response.content))['results'][0]['name'], 'Renamed')
+
+    def test_cached_pages_are_per_host_and_keep_their_headers(self):
+        self.product.image = 'product_images/phone.jpg'
+        self.product.save()
+        first = self.client.get('/api/products/', HTTP_ACCEPT_ENCODING='br', HTTP_HOST='localhost')
+        self.assertIn(b'http://localhost/media/', brotli.decompress(first.content))
+
+        other = self.client.get('/api/products/', HTTP_ACCEPT_ENCODING='br', HTTP_HOST='apiorderbot.onrender.com')
+        self.assertIn(b'http://apiorderbot.onrender.com/media/', brotli.decompress(other.content))
+        self.assertNotEqual(first['ETag'], other['ETag'])
+
+        cached = self.client.get('/api/products/', HTTP_ACCEPT_ENCODING='br', HTTP_HOST='localhost')
+        self.assertEqual(cached.content, first.content)
+        for header in ('Content-Type', 'Allow'):
+            self.assertEqual(cached[header], first[header])
+        self.assertEqual(set(cached['Vary'].split(', ')), set(first['Vary'].split(', ')))
+        self.assertIn('Accept', cached['Vary'].split(', '))
+
+    def test_pages_and_small_responses(self):
+        response = self.client.get(
+            '/api/webapp/', {'tgWebAppStartParam': f'product-{self.product.pk}'}, HTTP_ACCEPT_ENCODING='gzip'
+        )
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertIn(b'<html', gzip.decompress(response.content).lower())
+
+        response = self.client.get('/api/products/999/', HTTP_ACCEPT_ENCODING='br')
+        self.assertEqual(response.status_code, 404)
+        self.assertFalse(response.has_header('Content-Encoding'))
+
+
+class WebappProductCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.product = create_product()
+        self.url = f'/api/webapp/?tgWebAppStartParam=product-{self.product.pk}'
+
+    def test_repeated_opens_read_the_product_once(self):
+        before = product_cache_stats()
+        with self.assertNumQueries(1):
+            for _ in range(5):
+                self.assertEqual(self.client.get(self.url).status_code, 200)
+
+        after = product_cache_stats()
+        self.assertEqual(after['misses'] - before['misses'], 1)
+        self.assertEqual(after['hits'] - before['hits'], 4)
+
+    def test_product_and_stock_saves_invalidate(self):
+        self.client.get(self.url)
+
+        self.product.price = Decimal('120.00')
+        self.product.save()
+        with self.assertNumQueries(1):
+            self.client.get(self.url)
+
+        Stock.objects.get(product=self.product).save()
+        with self.assertNumQueries(1):
+            self.client.get(self.url)
+
+        self.product.brand.name = 'Renamed'
+        self.product.brand.save()
+        response = self.client.get(self.url)
+        self.assertEqual(response.context['product'].brand.name, 'Renamed')
+
+    def test_unknown_product_renders_not_found(self):
+        response = self.client.get('/api/webapp/?tgWebAppStartParam=product-999')
+        self.assertEqual(response.status_code, 404)
+
+    def test_concurrent_misses_read_the_product_once(self):
+        async def opens():
+            return await asyncio.gather(*(aget_product(self.product.pk) for _ in range(20)))
+
+        before = product_cache_stats()
+        with self.assertNumQueries(1):
+            products = async_to_sync(opens)()
+
+        self.assertEqual({product.pk for product in products}, {self.product.pk})
+        after = product_cache_stats()
+        self.assertEqual(after['misses'] - before['misses'], 1)
+        self.assertEqual(after['hits'] - before['hits'], 19)
+
+    def test_stuck_filler_only_delays_the_others(self):
+        self.addCleanup(setattr, product_cache, 'FILL_WAIT', product_cache.FILL_WAIT)
+        product_cache.FILL_WAIT = 0.05
+        # Taken by a filler that never finishes.
+        cache.add(fill_lock_key(product_cache_key(self.product.pk)), True)
+
+        with self.assertNumQueries(1):
+            self.assertEqual(get_product(self.product.pk), self.product)
+
+
+class AsyncCheckoutTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    async def test_order_and_payment(self):
+        product = await sync_to_async(create_product)()
+        url = f'/api/webapp/?tgWebAppStartParam=product-{product.pk}'
+        self.assertEqual((await self.async_client.get(url)).status_code, 200)
+
+        response = await self.async_client.post(url, {
+            'full_name': 'Abebe', 'address': 'Bole', 'phone_number': '0911000000', 'quantity': 2,
+        })
+        order = await Order.objects.aget(product=product)
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(response.url, f'/api/payment/{order.pk}/')
+        self.assertEqual(order.total_price, Decimal('200.00'))
+
+        self.assertContains(await self.async_client.get(response.url), product.name)
+        response = await self.async_client.post(response.url, {'payment_method': 'boa', 'payment_ref': 'FT123'})
+        self.assertTemplateUsed(response, 'payment_success.html')
+        await order.arefresh_from_db()
+        self.assertEqual((order.payment_method, order.payment_ref), ('boa', 'FT123'))
+
+    async def test_unknown_order(self):
+        self.assertEqual((await self.async_client.get('/api/payment/999/')).status_code, 404)
+
+    @override_settings(QUERY_COUNT_HEADER=True)
+    async def test_query_count_header(self):
+        product = await sync_to_async(create_product)()
+        response = await self.async_client.get(f'/api/webapp/?tgWebAppStartParam=product-{product.pk}')
+        self.assertEqual(response['X-Query-Count'], '1')
+
+
+class ProductSearchTests(TestCase):
+    def setUp(self):
+        self.phone = create_product(name='Galaxy Phone', code='GX-100')
+        self.case = Product.objects.create(
+            name='Leather case', code='LC-1', description='Fits the galaxy phone',
+            category=self.phone.category, subcategory=self.phone.subcategory,
+            brand=self.phone.brand, model=self.phone.model, quantity=3, price=Decimal('5.00'),
+        )
+
+    def search(self, q):
+        return [p['id'] for p in self.client.get('/api/products/search/', {'q': q}).json()['results']]
+
+    def test_name_matches_rank_above_description_matches(self):
+        self.assertEqual(self.search('galaxy'), [self.phone.pk, self.case.pk])
+
+    def test_prefixes_and_codes_match(self):
+        self.assertEqual(self.search('leath'), [self.case.pk])
+        self.assertEqual(self.search('GX 100'), [self.phone.pk])
+
+    def test_index_follows_product_and_brand_changes(self):
+        self.case.name = 'Silicone cover'
+        self.case.save()
+        self.assertEqual(self.search('leather'), [])
+        self.assertEqual(self.search('silicone'), [self.case.pk])
+
+        brand = self.phone.brand
+        brand.name = 'Samsung'
+        brand.save()
+        self.assertEqual(set(self.search('samsung')), {self.phone.pk, self.case.pk})
+
+        self.case.delete()
+        self.assertEqual(self.search('silicone'), [])
+
+    def test_admin_search_uses_index(self):
+        user = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.client.force_login(user)
+
+        response = self.client.get('/admin/shop/purchase/', {'q': 'leather'})
+
+        self.assertEqual([p.product_id for p in response.context['cl'].result_list], [self.case.pk])
+
+    def test_punctuation_only_query_returns_nothing(self):
+        self.assertEqual(self.search('"*'), [])
+
+    def test_migrate_puts_back_dropped_triggers(self):
+        # What a rebuild of shop_product on SQLite does to them.
+        with connection.cursor() as cursor:
+            cursor.execute('DROP TRIGGER shop_product_fts_update')
+        self.assertEqual(search_index.missing(connection), ['shop_product_fts_update'])
+
+        with self.assertLogs('shop.search_index', 'WARNING'):
+            emit_post_migrate_signal(verbosity=0, interactive=False, db='default')
+
+        self.assertEqual(search_index.missing(connection), [])
+        self.case.name = 'Silicone cover'
+        self.case.save()
+        self.assertEqual(self.search('leather'), [])
+        self.assertEqual(self.search('silicone'), [self.case.pk])
+
+
+class QueryPlanTests(TestCase):
+    """
+    The hot list queries must be answered from an index: no full table scan
+    and no temporary B-tree to sort the page.
+    """
+    def setUp(self):
+        self.product = create_product()
+        Purchase.objects.create(product=self.product, quantity_purchased=5)
+        Order.objects.create(product=self.product, address='Bole', phone_number='0911000000', is_paid=True)
+        user = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.client.force_login(user)
+
+    def query_plan(self, sql):
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+            return [row[-1] for row in cursor.fetchall()]
+
+    def assertIndexed(self, sql):
+        plan = self.query_plan(sql)
+        for step in plan:
+            self.assertIsNone(re.fullmatch(r'SCAN (TABLE )?\w+( AS \w+)?', step), f'Full scan in {plan}:\n{sql}')
+            self.assertNotIn('TEMP B-TREE', step, f'Sort without an index in {plan}:\n{sql}')
+
+    def assertPageIndexed(self, url, table, params=None):
+        """Check the ordered list query that ``url`` runs against ``table``."""
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.get(url, params or {}).status_code, 200)
+        pages = [q['sql'] for q in queries if q['sql'].startswith(f'SELECT "{table}"."id"') and 'ORDER BY' in q['sql']]
+        self.assertTrue(pages, f'No paged query on {table} for {url}')
+        for sql in pages:
+            self.assertIndexed(sql)
+
+    def test_product_api(self):
+        self.assertPageIndexed('/api/products/', 'shop_product')
+        self.assertPageIndexed('/api/products/', 'shop_product', {'category': self.product.category_id})
+        self.assertPageIndexed('/api/products/', 'shop_product', {'brand': self.product.brand_id})
+
+    def test_order_api(self):
+        self.assertPageIndexed('/api/orders/', 'shop_order')
+        self.assertPageIndexed('/api/orders/', 'shop_order', {'is_paid': 'true'})
+        self.assertPageIndexed('/api/orders/', 'shop_order', {'order_type': 'online'})
+        self.assertPageIndexed('/api/orders/', 'shop_order', {'product': self.product.pk})
+
+    def test_admin_changelists(self):
+        self.assertPageIndexed('/admin/shop/order/', 'shop_order')
+        self.assertPageIndexed('/admin/shop/product/', 'shop_product')
+        self.assertPageIndexed('/admin/shop/purchase/', 'shop_purchase')
+        self.assertPageIndexed('/admin/shop/purchase/', 'shop_purchase', {'product__id__exact': self.product.pk})
+
+    def test_stock_lookup_by_product(self):
+        stock = Stock.objects.filter(product=self.product).order_by('pk')[:1]
+        self.assertIndexed(str(stock.query))
+        self.assertIndexed(str(self.product.purchases.order_by('-purchase_date', '-id')[:10].query))
+
+
+class AdminQueryBudgetTests(TestCase):
+    """
+    Changelist pages must cost the same number of queries whatever the
+    number of rows on them.
+    """
+    BUDGET = 10
+
+    def setUp(self):
+        user = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.client.force_login(user)
+        self.user = user
+        self.rows = 0
+
+    def add_rows(self, count):
+        for _ in range(count):
+            i = self.rows = self.rows + 1
+            category = Category.objects.create(name=f'Category {i}')
+            subcategory = Subcategory.objects.create(name=f'Subcategory {i}', category=category)
+            brand = Brand.objects.create(name=f'Brand {i}', subcategory=subcategory)
+            model = ProductModel.objects.create(name=f'Model {i}', brand=brand, subcategory=subcategory)
+            product = Product.objects.create(
+                name=f'Product {i}', code=f'P-{i}', category=category, subcategory=subcategory, brand=brand,
+                model=model, quantity=10, price=Decimal('100.00'), description=None if i % 2 else 'A phone',
+            )
+            Order.objects.create(product=product, address='Bole', phone_number='0911000000')
+            Telegram.objects.create(stock=product.stocks.get())
+            ExportJob.objects.create(kind='orders', requested_by=self.user)
+            target = BroadcastTarget.objects.create(chat_id=str(1000 + i), title=f'Chat {i}')
+            create_broadcast([product], [target])
+
+    def changelist_queries(self, model):
+        url = f'/admin/{model._meta.app_label}/{model._meta.model_name}/'
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.get(url).status_code, 200)
+        return len(queries)
+
+    def test_changelists_have_a_fixed_query_budget(self):
+        models = [model for model in admin.site._registry if model._meta.app_label == 'shop']
+        self.add_rows(1)
+        few = {model: self.changelist_queries(model) for model in models}
+        self.add_rows(4)
+        for model in models:
+            with self.subTest(model=model.__name__):
+                many = self.changelist_queries(model)
+                self.assertEqual(many, few[model])
+                self.assertLessEqual(many, self.BUDGET)
+
+
+class LoadTestTests(TestCase):
+    def test_percentiles(self):
+        values = list(range(1, 101))
+        self.assertEqual(loadtest.percentile(values, 50), 50)
+        self.assertEqual(loadtest.percentile(values, 95), 95)
+        self.assertEqual(loadtest.percentile(values, 99), 99)
+        self.assertEqual(loadtest.percentile([7], 99), 7)
+        self.assertIsNone(loadtest.percentile([], 50))
+
+    def test_compare_flags_regressions(self):
+        before = {'products': {'p95_ms': 100.0, 'throughput_rps': 50.0, 'queries_mean': 3.0, 'error_rate': 0.0}}
+        after = {'products': {'p95_ms': 105.0, 'throughput_rps': 40.0, 'queries_mean': 4.0, 'error_rate': 0.0}}
+        regressed = {row[1] for row in loadtest.compare(before, after, threshold=0.10) if row[-1]}
+        self.assertEqual(regressed, {'throughput_rps', 'queries_mean'})
+
+    def test_parse_size(self):
+        self.assertEqual(loadtest.parse_size('1k'), 1000)
+        self.assertEqual(loadtest.parse_size('1M'), 1000000)
+        self.assertEqual(loadtest.parse_size('2500'), 2500)
+        with self.assertRaises(ValueError):
+            loadtest.parse_size('lots')
+
+    @override_settings(QUERY_COUNT_HEADER=True)
+    def test_query_count_header(self):
+        create_product()
+        response = self.client.get('/api/products/')
+        self.assertEqual(response['X-Query-Count'], '3')
+
+    def test_query_count_header_is_off_by_default(self):
+        self.assertNotIn('X-Query-Count', self.client.get('/api/products/'))
+
+
+class CatalogImportTests(TestCase):
+    HEADER = 'Code,Name,Description,Category,Subcategory,Brand,Model,Quantity,Price\n'
+
+    def sheet(self, *lines):
+        return io.BytesIO((self.HEADER + ''.join(f'{line}\n' for line in lines)).encode())
+
+    def run_import(self, *lines, **kwargs):
+        return CatalogImporter(**kwargs).run(read_rows(self.sheet(*lines), 'products.csv'))
+
+    def test_creates_products_with_purchases_and_stock(self):
+        result = self.run_import(
+            'P-1,Phone,A phone,Phones,Smart,Acme,X1,5,100',
+            'P-2,Phone 2,,phones,Smart,Acme,X2,0,250.5',
+        )
+        self.assertEqual((result.created, result.updated, result.errors), (2, 0, []))
+        self.assertEqual(Category.objects.count(), 1)
+        self.assertEqual(ProductModel.objects.count(), 2)
+
+        phone = Product.objects.get(code='P-1')
+        self.assertEqual(phone.brand.name, 'Acme')
+        self.assertEqual(phone.stocks.get().quantity_in_stock, 5)
+        self.assertEqual(phone.purchases.get().quantity_purchased, 5)
+        self.assertEqual(Product.objects.get(code='P-2').price, Decimal('250.50'))
+        self.assertFalse(Product.objects.get(code='P-2').purchases.exists())
+
+    def test_updates_match_product_save(self):
+        product = create_product(code='P-1', quantity=10)
+        result = self.run_import('P-1,Phone Pro,,,,,,15,120')
+        self.assertEqual((result.created, result.updated), (0, 1))
+
+        product.refresh_from_db()
+        self.assertEqual((product.name, product.quantity, product.price), ('Phone Pro', 15, Decimal('120.00')))
+        self.assertEqual(product.description, 'A phone')
+        self.assertEqual(product.stocks.get().quantity_in_stock, 15)
+        self.assertEqual(list(product.purchases.order_by('pk').values_list('quantity_purchased', flat=True)), [10, 5])
+
+    def test_row_errors_are_reported_and_skipped(self):
+        result = self.run_import(
+            'P-1,Phone,,Phones,Smart,Acme,X1,5,100',
+            'P-1,Phone again,,Phones,Smart,Acme,X1,5,100',
+            'P-3,Phone,,Phones,Smart,Acme,X1,many,100',
+            'P-4,Phone,,Phones,,Acme,X1,5,100',
+            'P-5,,,Phones,Smart,Acme,X1,5,100',
+        )
+        self.assertEqual(result.created, 1)
+        self.assertEqual([line for line, _ in result.errors], [3, 4, 5, 6])
+
+    def test_queries_are_batched(self):
+        def queries(rows, start):
+            lines = [f'P-{i},Phone {i},,Phones,Smart,Acme,X1,5,100' for i in range(start, start + rows)]
+            with CaptureQueriesContext(connection) as captured:
+                self.run_import(*lines, batch_size=1000)
+            return len(captured)
+
+        queries(1, 0)  # creates the hierarchy
+        # Product.save alone took five or more per row; what is left is
+        # one INSERT per table (the stock ledger included), split by
+        # bulk_create under SQLite's parameter limit.
+        self.assertLessEqual(queries(10, 100), 11)
+        self.assertLessEqual(queries(200, 1000), 16)
+
+    def test_dry_run_saves_nothing(self):
+        result = CatalogImporter().run(
+            read_rows(self.sheet('P-1,Phone,,Phones,Smart,Acme,X1,5,100'), 'products.csv'), dry_run=True
+        )
+        self.assertEqual(result.created, 1)
+        self.assertFalse(Product.objects.exists())
+        self.assertFalse(Category.objects.exists())
+
+    def test_reads_xlsx(self):
+        target = io.BytesIO()
+        exports.write_xlsx(target, 'Products', self.HEADER.strip().split(','), [
+            ['P-1', 'Phone', None, 'Phones', 'Smart', 'Acme', 'X1', 3, 99.9],
+        ])
+        target.seek(0)
+        result = CatalogImporter().run(read_rows(target, 'products.xlsx'))
+        self.assertEqual(result.created, 1)
+        self.assertEqual(Product.objects.get(code='P-1').price, Decimal('99.90'))
+
+    def test_admin_upload(self):
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'password'))
+        upload = SimpleUploadedFile('products.csv', self.sheet('P-1,Phone,,Phones,Smart,Acme,X1,5,100').read())
+        response = self.client.post('/admin/shop/product/import/', {'file': upload})
+        self.assertRedirects(response, '/admin/shop/product/', fetch_redirect_response=False)
+        self.assertTrue(Product.objects.filter(code='P-1').exists())
+        self.assertEqual(self.client.get('/admin/shop/product/import/').status_code, 200)
@@ -1,9 +1,17 @@
 from rest_framework import viewsets, permissions
+from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError as InvalidParams
+from rest_framework.response import Response
 from .models import Product, Order
 from .serializers import ProductSerializer, OrderSerializer
+from .filters import QueryParamFilter, choice_parser, parse_bool, parse_day, parse_decimal, parse_moment
+from .pagination import ProductCursorPagination, OrderCursorPagination
+from . import catalog, compression, db, sales
+from .search import search_products
+from django.views.decorators.http import condition, require_safe
 from django.views.decorators.csrf import csrf_exempt, csrf_protect
 from django.utils.decorators import method_decorator
-from django.shortcuts import get_object_or_404, redirect, render
+from django.shortcuts import redirect, render
 from .forms import ReceiptUploadForm
 import logging
 from django.core.exceptions import ValidationError
@@ -13,55 +21,144 @@ logger = logging.getLogger(__name__)
 @method_decorator(csrf_exempt, name='dispatch')
 class ProductViewSet(viewsets.ModelViewSet):
     permission_classes = [permissions.AllowAny]
-    queryset = Product.objects.all()
+    queryset = Product.objects.with_available_stock()
     serializer_class = ProductSerializer
+    pagination_class = ProductCursorPagination
+    filter_backends = [QueryParamFilter]
+    query_filters = {
+        'category': ('category', int),
+        'subcategory': ('subcategory', int),
+        'brand': ('brand', int),
+        'model': ('model', int),
+        'code': ('code', str),
+        'min_price': ('price__gte', parse_decimal),
+        'max_price': ('price__lte', parse_decimal),
+        'added_after': ('date_added__gte', parse_moment),
+        'added_before': ('date_added__lt', parse_moment),
+    }
+
+    # Clients re-poll the catalog constantly; answer 304 when nothing changed.
+    @method_decorator(condition(etag_func=catalog.list_etag, last_modified_func=catalog.list_last_modified))
+    def list(self, request, *args, **kwargs):
+        # The same page compressed for an earlier client, if the catalog hasn't changed since.
+        cached = compression.cached_response(request, catalog.list_etag(request))
+        if cached is not None:
+            return cached
+        response = super().list(request, *args, **kwargs)
+        response.cache_compressed = True
+        return response
+
+    @method_decorator(condition(etag_func=catalog.detail_etag, last_modified_func=catalog.detail_last_modified))
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
+
+    @action(detail=False, methods=['get'], pagination_class=None)
+    def search(self, request):
+        """Ranked full-text search: ``?q=<words>&limit=<n>`` (at most 100)."""
+        query = request.query_params.get('q', '')
+        try:
+            limit = min(max(int(request.query_params.get('limit', 20)), 1), 100)
+        except ValueError:
+            limit = 20
+        products = search_products(query, self.get_queryset(), limit)
+        return Response({'query': query, 'results': self.get_serializer(products, many=True).data})
 
 @method_decorator(csrf_exempt, name='dispatch')
 class OrderViewSet(viewsets.ModelViewSet):
     permission_classes = [permissions.AllowAny]
     queryset = Order.objects.all()
     serializer_class = OrderSerializer
+    pagination_class = OrderCursorPagination
+    filter_backends = [QueryParamFilter]
+    query_filters = {
+        'product': ('product', int),
+        'is_paid': ('is_paid', parse_bool),
+        'order_type': ('order_type', choice_parser(Order.ORDER_TYPES)),
+        'payment_method': ('payment_method', choice_parser(Order.PAYMENT_METHODS)),
+        'ordered_after': ('order_date__gte', parse_moment),
+        'ordered_before': ('order_date__lt', parse_moment),
+    }
+
+class SalesViewSet(viewsets.GenericViewSet):
+    """
+    Sales totals from the rollup tables: ``?group_by=day,brand`` (any of
+    day, month, product, brand, payment_method, order_type, is_paid) with
+    the filters below. Staff only.
+    """
+    permission_classes = [permissions.IsAdminUser]
+    filter_backends = [QueryParamFilter]
+    query_filters = {
+        'from': ('day__gte', parse_day),
+        'to': ('day__lte', parse_day),
+        'product': ('product', int),
+        'brand': ('product__brand', int),
+        'is_paid': ('is_paid', parse_bool),
+        'order_type': ('order_type', choice_parser(Order.ORDER_TYPES)),
+        'payment_method': ('payment_method', choice_parser(Order.PAYMENT_METHODS)),
+    }
+
+    def group_by(self):
+        return [name for name in self.request.query_params.get('group_by', 'day').split(',') if name]
+
+    def get_queryset(self):
+        names = [*self.group_by(), *(param for param in ('product', 'brand') if self.request.query_params.get(param))]
+        return sales.rollup_for(names).objects.all()
+
+    def list(self, request):
+        group_by = self.group_by()
+        try:
+            report = sales.report(self.filter_queryset(self.get_queryset()), group_by)
+        except ValueError as e:
+            raise InvalidParams({'group_by': [str(e)]})
+        return Response({'group_by': group_by, **report})
 
-from django.shortcuts import render, get_object_or_404, redirect
+from django.shortcuts import render, aget_object_or_404, redirect
 from django.core.exceptions import ValidationError
 from .models import Product, Order
 from .forms import ReceiptUploadForm
+from . import cache as product_cache
+from django.http import Http404, HttpResponse, HttpResponseForbidden
+from django.conf import settings
+from . import media, metrics
+import hmac
 import logging
 
 logger = logging.getLogger(__name__)
 
+# The checkout views are async: under ASGI (see start.sh) a channel post's
+# burst of shoppers waits on the database without holding a worker each.
 @csrf_protect
-def webapp_view(request):
-    logger.info(f"Request Method: {request.method}")
-    logger.info(f"Query Parameters: {request.GET}")
-
+async def webapp_view(request):
     start_param = request.GET.get('tgWebAppStartParam', '')
-    logger.info(f"Start Parameter: {start_param}")
 
     # Validate the start_param to ensure it contains a valid product ID
     if start_param.startswith('product-'):
         try:
             product_id = start_param.split('-')[1]
-            logger.info(f"Product ID extracted: {product_id}")
 
-            product = get_object_or_404(Product, id=product_id)
-            logger.info(f"Product found: {product.name} (ID: {product.id})")
+            if request.method == 'POST':
+                # Orders are always priced from the database row.
+                product = await aget_object_or_404(Product, id=product_id)
+            else:
+                product = await product_cache.aget_product(product_id)
+                if product is None:
+                    raise Http404("No Product matches the given query.")
 
             # Ensure the product has stock available
             if product.quantity < 1:
-                logger.error(f"Product ID {product_id} is out of stock.")
+                logger.info("Product %s is out of stock", product.pk, extra={'product_id': product.pk})
                 return render(request, 'webapp.html', {
                     'product': product,
                     'error': 'This product is currently out of stock.',
                 })
 
         except (IndexError, ValueError):
-            logger.error("Error extracting product ID from start_param")
+            logger.warning("Invalid product id in start parameter %r", start_param)
             return render(request, '404.html', {
                 'error': 'Invalid product ID provided. Please check the URL or select a valid product.'
             })
     else:
-        logger.error("Invalid start_param, does not start with 'product-'")
+        logger.warning("Start parameter %r does not name a product", start_param)
         return render(request, '404.html', {
             'error': 'Product not found. Please check the URL and try again.'
         })
@@ -90,30 +187,33 @@ def webapp_view(request):
         try:
             # Validate the order before saving
             # order.full_clean()  # Calls the clean() method for validation
-            order.save()  # Save if clean passes
-            logger.info(f"Order created successfully for {product.name}, Quantity: {quantity}")
+            await db.awrite(order.save)  # Save if clean passes
+            logger.info(
+                "Order %s created for product %s", order.pk, product.pk,
+                extra={'order_id': order.pk, 'product_id': product.pk, 'quantity': quantity},
+            )
             return redirect('payment_choice', order_id=order.id)
         except ValidationError as e:
             # Capture and extract a friendly error message
             error_message = e.message_dict.get('__all__', ['An error occurred'])[0]
-            logger.error(f"Validation error: {error_message}")
+            logger.info("Order for product %s rejected: %s", product.pk, error_message,
+                        extra={'product_id': product.pk})
             return render(request, 'webapp.html', {
                 'product': product,
                 'error': error_message,  # Pass the friendly message to the template
             })
 
-    logger.info(f"Rendering product page for product: {product.name}")
+    logger.info("Product page %s", product.pk, extra={'product_id': product.pk})
     return render(request, 'webapp.html', {'product': product})
 
 
 @csrf_protect
-def payment_choice_view(request, order_id):
-    order = get_object_or_404(Order, id=order_id)
-    print(order.product)
+async def payment_choice_view(request, order_id):
+    order = await aget_object_or_404(Order.objects.select_related('product'), id=order_id)
 
     # Debug log to check if the order has a valid product
     if not order.product:
-        logger.error(f"Order ID {order_id} has no product associated with it.")
+        logger.error("Order %s has no product", order_id, extra={'order_id': order_id})
         return render(request, '404.html', {
             'error': 'This order does not have an associated product.'
         })
@@ -126,7 +226,7 @@ def payment_choice_view(request, order_id):
 
             order.payment_method = payment_method
             order.payment_ref = payment_ref
-            order.save()
+            await db.awrite(order.save)
 
             return render(request, 'payment_success.html', {'order': order})
     else:
@@ -136,3 +236,20 @@ def payment_choice_view(request, order_id):
 
 def custom_404_view(request, exception):
     return render(request, '404_custom.html', status=404)
+
+def metrics_view(request):
+    """Request metrics of every worker, in the Prometheus text format."""
+    # Not by address: behind a local proxy every request comes from 127.0.0.1.
+    token = settings.METRICS_TOKEN
+    allowed = request.user.is_staff or (
+        token and hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}')
+    )
+    if not allowed:
+        return HttpResponseForbidden()
+    return HttpResponse(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+@require_safe
+def media_view(request, path):
+    """Uploaded files, with caching headers and byte ranges (see shop.media)."""
+    return media.serve(request, path)
@@ -0,0 +1,44 @@
+#!/usr/bin/env bash
+# Start the web server.
+#
+#   SERVER=asgi (default)  gunicorn managing uvicorn workers running
+#                          apiOrderBot.asgi. The checkout views (webapp_view,
+#                          payment_choice_view) are async, so a burst of
+#                          shoppers after a channel post waits on the
+#                          database without tying up a worker per request.
+#                          Sync views (the DRF API, the admin) still run in a
+#                          thread per request. Exports and files stream in
+#                          chunks (shop/responses.py) rather than being read
+#                          whole first, as Django's ASGI handler otherwise does.
+#   SERVER=wsgi            the previous setup: gunicorn sync workers running
+#                          apiOrderBot.wsgi, one request per worker at a time.
+#
+# WEB_CONCURRENCY sets the number of worker processes and PORT the port.
+# SQLite is tuned for several workers by SQLITE_PROFILE=production (see
+# settings.py); SQLITE_WRITE_QUEUE=1 also funnels order and payment writes
+# through one writer thread per worker. `manage.py benchmark_writes`
+# measures both.
+# Compare both on one machine with
+#   python manage.py benchmark_http --start-server --server wsgi --json wsgi.json
+#   python manage.py benchmark_http --start-server --server asgi --json asgi.json
+#   python manage.py benchmark_compare wsgi.json asgi.json
+set -o errexit
+
+WORKERS=${WEB_CONCURRENCY:-2}
+# Each worker would rotate logs/app.log on its own; log to stderr instead.
+export LOG_FILE=${LOG_FILE:--}
+# Workers share request metrics through this directory (see /metrics);
+# start from zero like any restarted Prometheus target.
+export METRICS_DIR=${METRICS_DIR:-/tmp/shop-metrics}
+rm -rf "$METRICS_DIR" && mkdir -p "$METRICS_DIR"
+BIND=${BIND:-0.0.0.0:${PORT:-8000}}
+# Background exports run in threads of the workers; any the previous
+# workers didn't finish are lost. Tell the admin instead of showing them
+# as pending forever.
+python manage.py run_export_jobs --fail-interrupted
+
+if [ "${SERVER:-asgi}" = "wsgi" ]; then
+    exec gunicorn apiOrderBot.wsgi:application --bind "$BIND" --workers "$WORKERS"
+fi
+exec gunicorn apiOrderBot.asgi:application --bind "$BIND" --workers "$WORKERS" \
+    --worker-class uvicorn.workers.UvicornWorker